@@ -30,7 +30,8 @@ def train_one_epoch(model: torch.nn.Module,
                     data_loader: Iterable, optimizer: torch.optim.Optimizer,
                     device: torch.device, epoch: int, loss_scaler,
                     log_writer=None,
-                    args=None):
+                    args=None,
+                    batch_transform=None):
     model.train(True)
     metric_logger = misc.MetricLogger(delimiter="  ")
     metric_logger.add_meter('lr', misc.SmoothedValue(window_size=1, fmt='{value:.6f}'))
@@ -50,6 +51,12 @@ def train_one_epoch(model: torch.nn.Module,
         if data_iter_step % accum_iter == 0:
             lr_sched.adjust_learning_rate(optimizer, data_iter_step / len(data_loader) + epoch, args)
 
+        if batch_transform is not None:
+            # crop, resize, flip and normalize the uint8 images of the batch on the device
+            imgs_u8, boxes, flips, *ids = batch  # no ids with `--device_masking`
+            imgs = batch_transform(imgs_u8.to(device, non_blocking=True), boxes, flips)
+            batch = (imgs, *ids)
+
         if not misc.XLA_CFG["is_xla"]:
             with torch.cuda.amp.autocast(enabled=not misc.XLA_CFG["is_xla"]):
                 loss, _, _ = model(*batch)
@@ -30,9 +30,14 @@ from timm.loss import LabelSmoothingCrossEntropy, SoftTargetCrossEntropy
 
 import util.lr_decay as lrd
 import util.misc as misc
+from util.act_checkpoint import apply_checkpoint_policy
+from util.cpu_affinity import worker_init_fn
 from util.datasets import build_dataset
+from util.eval_cache import CachedEvalDataset
 from util.pos_embed import interpolate_pos_embed
 from util.misc import NativeScalerWithGradNormCount as NativeScaler
+from util.samplers import NodeLocalDistributedSampler
+from util.synthetic import NUM_SYNTHETIC_VAL_SAMPLES, SyntheticImageDataset, synthetic_like
 
 import models_vit
 
@@ -55,6 +60,15 @@ def get_args_parser():
     parser.add_argument('--no_k_bias_in_vit', action='store_true', dest='no_k_bias_in_vit',
                         help="Use a variant of ViT without k_bias in ViT self-attention (as in BEiT)")
     parser.set_defaults(no_k_bias_in_vit=False)
+    parser.add_argument('--fused_attn', action='store_true',
+                        help='Compute the self-attention of the ViT blocks with the fused '
+                             'torch.nn.functional.scaled_dot_product_attention (same parameters and checkpoints)')
+    parser.set_defaults(fused_attn=False)
+    parser.add_argument('--act_checkpoint', default='none', choices=['none', 'all', 'attn'],
+                        help='Activation checkpointing (recompute in the backward pass): all blocks, '
+                             'or only the attention of all blocks')
+    parser.add_argument('--act_checkpoint_every', default=1, type=int,
+                        help='Checkpoint every k-th of the blocks selected by --act_checkpoint')
 
     parser.add_argument('--input_size', default=224, type=int,
                         help='images input size')
@@ -124,6 +138,27 @@ def get_args_parser():
     # Dataset parameters
     parser.add_argument('--data_path', default='/datasets01/imagenet_full_size/061417/', type=str,
                         help='dataset path')
+    parser.add_argument('--compact_index', action='store_true',
+                        help='Store the dataset file list in flat numpy arrays shared by all DataLoader workers '
+                             '(instead of a list of tuples that each worker gradually copies)')
+    parser.set_defaults(compact_index=False)
+    parser.add_argument('--node_local_sampler', action='store_true',
+                        help='Give each node a mostly stable subset of the training data across epochs (samples '
+                             'i %% num_nodes == node_rank), so that its page cache stays warm')
+    parser.set_defaults(node_local_sampler=False)
+    parser.add_argument('--node_exchange_fraction', default=0.1, type=float,
+                        help='Fraction of the samples that is exchanged across nodes in each epoch with --node_local_sampler')
+    parser.add_argument('--eval_cache_dir', default='', type=str,
+                        help='Cache the resized and center-cropped validation images (uint8) in a memory-mapped '
+                             'file in this directory, built once and reused by every evaluation (empty: no cache)')
+    parser.add_argument('--synthetic_data', action='store_true',
+                        help='Train and evaluate on in-memory random images instead of the data, to measure the '
+                             'compute-only throughput; by default with as many samples as the data, so that the '
+                             'epochs and the LR schedule are the same')
+    parser.set_defaults(synthetic_data=False)
+    parser.add_argument('--synthetic_num_samples', default=0, type=int,
+                        help='Number of synthetic training samples per epoch with --synthetic_data (0: as many as '
+                             'the data, which only lists the data files)')
     parser.add_argument('--nb_classes', default=1000, type=int,
                         help='number of the classification types')
 
@@ -148,6 +183,10 @@ def get_args_parser():
                         help='Pin CPU memory in DataLoader for more efficient (sometimes) transfer to GPU.')
     parser.add_argument('--no_pin_mem', action='store_false', dest='pin_mem')
     parser.set_defaults(pin_mem=True)
+    parser.add_argument('--cpu_affinity', action='store_true',
+                        help='Split the cores of each rank between its main process (intra-op threads and the '
+                             'pin-memory thread, at least 2 cores) and its DataLoader workers (one core each), and '
+                             'pin them')
 
     # distributed training parameters
     parser.add_argument('--world_size', default=1, type=int,
@@ -175,15 +214,34 @@ def main(args):
 
     cudnn.benchmark = True
 
-    dataset_train = build_dataset(is_train=True, args=args)
-    dataset_val = build_dataset(is_train=False, args=args)
+    if args.synthetic_data and args.synthetic_num_samples > 0:
+        dataset_train = SyntheticImageDataset(args.synthetic_num_samples, args.input_size, args.nb_classes)
+        dataset_val = SyntheticImageDataset(NUM_SYNTHETIC_VAL_SAMPLES, args.input_size, args.nb_classes, seed=1)
+    else:
+        dataset_train = build_dataset(is_train=True, args=args)
+        dataset_val = build_dataset(is_train=False, args=args)
+    if args.synthetic_data:
+        if args.synthetic_num_samples <= 0:
+            # as many samples as the data, so that the sampler and the epochs are unchanged
+            dataset_train = synthetic_like(dataset_train, args.input_size, num_classes=args.nb_classes)
+            dataset_val = SyntheticImageDataset(len(dataset_val), args.input_size, args.nb_classes, seed=1)
+        print(dataset_train)
+    elif args.eval_cache_dir:
+        dataset_val = CachedEvalDataset(dataset_val, args.eval_cache_dir, num_workers=args.num_workers)
+        print(dataset_val)
 
     if True:  # args.distributed:
         num_tasks = misc.get_world_size()
         global_rank = misc.get_rank()
-        sampler_train = torch.utils.data.DistributedSampler(
-            dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
-        )
+        if args.node_local_sampler:
+            sampler_train = NodeLocalDistributedSampler(
+                dataset_train, num_replicas=num_tasks, rank=global_rank, ranks_per_node=misc.get_local_world_size(),
+                exchange_fraction=args.node_exchange_fraction, shuffle=True
+            )
+        else:
+            sampler_train = torch.utils.data.DistributedSampler(
+                dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
+            )
         print("Sampler_train = %s" % str(sampler_train))
         if args.dist_eval:
             if len(dataset_val) % num_tasks != 0:
@@ -208,6 +266,7 @@ def main(args):
         dataset_train, sampler=sampler_train,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        worker_init_fn=worker_init_fn,
         pin_memory=args.pin_mem,
         drop_last=True,
     )
@@ -216,6 +275,7 @@ def main(args):
         dataset_val, sampler=sampler_val,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        worker_init_fn=worker_init_fn,
         pin_memory=args.pin_mem,
         drop_last=False
     )
@@ -262,6 +322,8 @@ def main(args):
         # manually initialize fc layer
         trunc_normal_(model.head.weight, std=2e-5)
 
+    apply_checkpoint_policy(args.act_checkpoint, model.blocks, every=args.act_checkpoint_every)
+
     model.to(device)
 
     model_without_ddp = model
@@ -21,7 +21,6 @@ import torch
 import torch.backends.cudnn as cudnn
 from torch.utils.tensorboard import SummaryWriter
 import torchvision.transforms as transforms
-import torchvision.datasets as datasets
 
 import timm
 
@@ -29,10 +28,14 @@ import timm
 from timm.models.layers import trunc_normal_
 
 import util.misc as misc
+from util.cpu_affinity import worker_init_fn
 from util.pos_embed import interpolate_pos_embed
 from util.misc import NativeScalerWithGradNormCount as NativeScaler
 from util.lars import LARS
 from util.crop import RandomResizedCrop
+from util.datasets import build_image_folder
+from util.eval_cache import CachedEvalDataset
+from util.samplers import NodeLocalDistributedSampler
 
 import models_vit
 
@@ -55,6 +58,10 @@ def get_args_parser():
     parser.add_argument('--no_k_bias_in_vit', action='store_true', dest='no_k_bias_in_vit',
                         help="Use a variant of ViT without k_bias in ViT self-attention (as in BEiT)")
     parser.set_defaults(no_k_bias_in_vit=False)
+    parser.add_argument('--fused_attn', action='store_true',
+                        help='Compute the self-attention of the ViT blocks with the fused '
+                             'torch.nn.functional.scaled_dot_product_attention (same parameters and checkpoints)')
+    parser.set_defaults(fused_attn=False)
 
     # Optimizer parameters
     parser.add_argument('--weight_decay', type=float, default=0,
@@ -82,6 +89,19 @@ def get_args_parser():
     # Dataset parameters
     parser.add_argument('--data_path', default='/datasets01/imagenet_full_size/061417/', type=str,
                         help='dataset path')
+    parser.add_argument('--compact_index', action='store_true',
+                        help='Store the dataset file list in flat numpy arrays shared by all DataLoader workers '
+                             '(instead of a list of tuples that each worker gradually copies)')
+    parser.set_defaults(compact_index=False)
+    parser.add_argument('--node_local_sampler', action='store_true',
+                        help='Give each node a mostly stable subset of the training data across epochs (samples '
+                             'i %% num_nodes == node_rank), so that its page cache stays warm')
+    parser.set_defaults(node_local_sampler=False)
+    parser.add_argument('--node_exchange_fraction', default=0.1, type=float,
+                        help='Fraction of the samples that is exchanged across nodes in each epoch with --node_local_sampler')
+    parser.add_argument('--eval_cache_dir', default='', type=str,
+                        help='Cache the resized and center-cropped validation images (uint8) in a memory-mapped '
+                             'file in this directory, built once and reused by every evaluation (empty: no cache)')
     parser.add_argument('--nb_classes', default=1000, type=int,
                         help='number of the classification types')
 
@@ -106,6 +126,10 @@ def get_args_parser():
                         help='Pin CPU memory in DataLoader for more efficient (sometimes) transfer to GPU.')
     parser.add_argument('--no_pin_mem', action='store_false', dest='pin_mem')
     parser.set_defaults(pin_mem=True)
+    parser.add_argument('--cpu_affinity', action='store_true',
+                        help='Split the cores of each rank between its main process (intra-op threads and the '
+                             'pin-memory thread, at least 2 cores) and its DataLoader workers (one core each), and '
+                             'pin them')
 
     # distributed training parameters
     parser.add_argument('--world_size', default=1, type=int,
@@ -144,17 +168,25 @@ def main(args):
             transforms.CenterCrop(224),
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
-    dataset_train = datasets.ImageFolder(os.path.join(args.data_path, 'train'), transform=transform_train)
-    dataset_val = datasets.ImageFolder(os.path.join(args.data_path, 'val'), transform=transform_val)
+    dataset_train = build_image_folder(os.path.join(args.data_path, 'train'), transform_train, args)
+    dataset_val = build_image_folder(os.path.join(args.data_path, 'val'), transform_val, args)
+    if args.eval_cache_dir:
+        dataset_val = CachedEvalDataset(dataset_val, args.eval_cache_dir, num_workers=args.num_workers)
     print(dataset_train)
     print(dataset_val)
 
     if True:  # args.distributed:
         num_tasks = misc.get_world_size()
         global_rank = misc.get_rank()
-        sampler_train = torch.utils.data.DistributedSampler(
-            dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
-        )
+        if args.node_local_sampler:
+            sampler_train = NodeLocalDistributedSampler(
+                dataset_train, num_replicas=num_tasks, rank=global_rank, ranks_per_node=misc.get_local_world_size(),
+                exchange_fraction=args.node_exchange_fraction, shuffle=True
+            )
+        else:
+            sampler_train = torch.utils.data.DistributedSampler(
+                dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
+            )
         print("Sampler_train = %s" % str(sampler_train))
         if args.dist_eval:
             if len(dataset_val) % num_tasks != 0:
@@ -179,6 +211,7 @@ def main(args):
         dataset_train, sampler=sampler_train,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        worker_init_fn=worker_init_fn,
         pin_memory=args.pin_mem,
         drop_last=True,
     )
@@ -187,6 +220,7 @@ def main(args):
         dataset_val, sampler=sampler_val,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        worker_init_fn=worker_init_fn,
         pin_memory=args.pin_mem,
         drop_last=False
     )
@@ -20,7 +20,6 @@ import torch
 import torch.backends.cudnn as cudnn
 from torch.utils.tensorboard import SummaryWriter
 import torchvision.transforms as transforms
-import torchvision.datasets as datasets
 
 import timm
 
@@ -28,9 +27,16 @@ import timm
 import timm.optim.optim_factory as optim_factory
 
 import util.misc as misc
-from util.crop import RandomResizedCrop as BYOLRandomResizedCrop
+import util.lr_sched as lr_sched
+from util.act_checkpoint import ACT_CHECKPOINT_POLICIES, apply_checkpoint_policy
+from util.cpu_affinity import worker_init_fn
+from util.crop import RandomResizedCrop as BYOLRandomResizedCrop, ArrayRandomResizedCrop, DraftRandomResizedCrop
+from util.datasets import attach_decoded_cache, build_pretrain_dataset, get_data_stats
 from util.misc import NativeScalerWithGradNormCount as NativeScaler
-from util.long_seq_patch_loader import SampleVisiblePatchIndices, MAEIndexCollator
+from util.batched_aug import SampleCrop, BatchedResizeFlipNormalize
+from util.long_seq_patch_loader import SampleVisiblePatchIndices, MAEIndexCollator, MAECropIndexCollator
+from util.synthetic import SyntheticImageDataset, num_source_samples, synthetic_like
+from util.samplers import NodeLocalDistributedSampler, RepeatFactorDistributedSampler, parse_data_sources, repeat_factors_from_mixing_weights
 
 import models_mae
 
@@ -65,6 +71,25 @@ def get_args_parser():
     parser.add_argument('--no_k_bias_in_vit', action='store_true', dest='no_k_bias_in_vit',
                         help="Use a variant of ViT without k_bias in ViT self-attention (as in BEiT)")
     parser.set_defaults(no_k_bias_in_vit=False)
+    parser.add_argument('--fused_attn', action='store_true',
+                        help='Compute the self-attention of the ViT blocks with the fused '
+                             'torch.nn.functional.scaled_dot_product_attention (same parameters and checkpoints)')
+    parser.set_defaults(fused_attn=False)
+    parser.add_argument('--patchify_once', action='store_true',
+                        help='Patchify the images once, embed only the visible patches (with the patch embedding '
+                             'conv weights as a linear projection) and reuse the patches as the loss target')
+    parser.set_defaults(patchify_once=False)
+    parser.add_argument('--masked_loss', action='store_true',
+                        help='Apply the prediction head to the removed patches only and compute the loss of '
+                             'these patches in chunks (the model then returns no pred and mask)')
+    parser.set_defaults(masked_loss=False)
+    parser.add_argument('--loss_chunk_size', default=8192, type=int,
+                        help='Number of patches per chunk of the --masked_loss loss (0 means a single chunk)')
+    parser.add_argument('--act_checkpoint', default='none', choices=ACT_CHECKPOINT_POLICIES,
+                        help='Activation checkpointing (recompute in the backward pass): all encoder and decoder '
+                             'blocks, encoder or decoder blocks only, or only the attention of all blocks')
+    parser.add_argument('--act_checkpoint_every', default=1, type=int,
+                        help='Checkpoint every k-th of the blocks selected by --act_checkpoint')
 
     parser.add_argument('--input_size', default=224, type=int,
                         help='images input size')
@@ -77,11 +102,54 @@ def get_args_parser():
     parser.add_argument('--use_byol_crop', action='store_true',
                         help='Use BYOL random resized crop')
     parser.set_defaults(use_byol_crop=False)
+    parser.add_argument('--draft_decode', action='store_true',
+                        help='Sample the random resized crop from the JPEG header size first, and decode the JPEG at '
+                             'the lowest resolution (1/2, 1/4 or 1/8 DCT scaling) that still only downscales the crop '
+                             '(same crop distribution, for --data_format image_folder)')
+    parser.set_defaults(draft_decode=False)
+    parser.add_argument('--batched_augmentation', action='store_true',
+                        help='DataLoader workers only decode the images and sample the crop boxes and flips, and '
+                             'the crop, resize (antialiased bicubic, like PIL), flip and normalization run batched on '
+                             'the training device (meant for GPUs, slower than the default on CPU)')
+    parser.set_defaults(batched_augmentation=False)
+    parser.add_argument('--compact_batch', action='store_true',
+                        help='Send uint8 images and int16/int32 patch indices from the DataLoader to the model (which '
+                             'normalizes and widens them on the device), instead of float32 images and int64 indices')
+    parser.set_defaults(compact_batch=False)
+    parser.add_argument('--num_repeats', default=1, type=int,
+                        help='Repeated augmentation: sample this many crops (each with its own mask) from each decoded '
+                             'image, with batch_size / num_repeats unique images per batch; each image is visited '
+                             '1/num_repeats times per epoch, so an epoch has the same number of samples')
 
     parser.add_argument('--mask_ratio', default=0.75, type=float,
                         help='Masking ratio (percentage of removed patches).')
+    parser.add_argument('--mask_ratio_start', default=None, type=float,
+                        help='Mask ratio curriculum: start at this mask ratio and anneal it to --mask_ratio with '
+                             'half-cycle cosine over --mask_ratio_anneal_epochs (the ratio is constant within an epoch)')
+    parser.add_argument('--mask_ratio_anneal_epochs', default=0, type=int,
+                        help='Epochs to anneal the mask ratio over with --mask_ratio_start (0 means all epochs)')
+    parser.add_argument('--decoder_keep_ratio', default=1., type=float,
+                        help='Decoder token subsampling: feed the decoder the visible patches and only this fraction '
+                             'of the removed patches (a random subset per sample), and compute the loss on them')
+    parser.add_argument('--decoder_keep_ratio_start', default=None, type=float,
+                        help='Start at this decoder keep ratio and anneal it to --decoder_keep_ratio with half-cycle '
+                             'cosine over --decoder_keep_ratio_anneal_epochs (constant within an epoch)')
+    parser.add_argument('--decoder_keep_ratio_anneal_epochs', default=0, type=int,
+                        help='Epochs to anneal the decoder keep ratio over (0 means all epochs)')
     parser.add_argument('--mask_downsampling', default=1, type=int,
                         help='Downsampling ratio of masks (e.g. 2 means using 32x32 mask patches for 16x16 image patches).')
+    parser.add_argument('--masking', default='random', choices=['random', 'blockwise', 'grid', 'rectangle'],
+                        help='Masking strategy (util/masking.py): random (MAE), blockwise (BEiT-style random '
+                             'rectangles), grid (keep a regular grid with a random offset) or rectangle (mask one '
+                             'random rectangle); applied to d x d blocks with --mask_downsampling d')
+    parser.add_argument('--device_masking', action='store_true',
+                        help='Sample the masks of the whole batch on the training device in the model (seeded with '
+                             '--seed and the rank), instead of per sample in the DataLoader workers')
+    parser.set_defaults(device_masking=False)
+    parser.add_argument('--mask_ratio_range', default=None, type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help='Sample a mask ratio per sample, uniform in [LOW, HIGH], and pack the visible patches '
+                             'of the batch into one variable-length encoder sequence (util/packed_seq.py); '
+                             'needs --device_masking')
     parser.add_argument('--decoder_downsampling', default=1, type=int,
                         help='Downsampling ratio in the MAE decoder (e.g. 2 means using a 2x2 conv w/ stride 2 '
                              'to downsample the decoder input, giving a smaller decoder sequence length than encoder).')
@@ -110,6 +178,60 @@ def get_args_parser():
     # Dataset parameters
     parser.add_argument('--data_path', default='/datasets01/imagenet_full_size/061417/', type=str,
                         help='dataset path')
+    parser.add_argument('--data_format', default='image_folder', choices=['image_folder', 'uint8_shards', 'tar_shards'],
+                        help='image_folder: JPEG image folders; uint8_shards: pre-decoded uint8 shards written by '
+                             'tools/convert_to_uint8_shards.py (memory-mapped, no JPEG decoding during training); '
+                             'tar_shards: tar shards written by tools/make_tar_shards.py (streamed sequentially)')
+    parser.add_argument('--shuffle_buffer', default=2000, type=int,
+                        help='Size of the in-memory shuffle buffer (per DataLoader worker) for --data_format tar_shards')
+    parser.add_argument('--compact_index', action='store_true',
+                        help='Store the dataset file list in flat numpy arrays shared by all DataLoader workers '
+                             '(instead of a list of tuples that each worker gradually copies)')
+    parser.set_defaults(compact_index=False)
+    parser.add_argument('--use_manifest', action='store_true',
+                        help='Load the file list from a persistent manifest (built on the first run) '
+                             'instead of walking the data folder')
+    parser.set_defaults(use_manifest=False)
+    parser.add_argument('--manifest_dir', default='', type=str,
+                        help='Where to store the manifest (empty means next to the data folder)')
+    parser.add_argument('--manifest_check', default='quick', choices=['none', 'quick', 'full'],
+                        help='Staleness check of the manifest against the data folder')
+    parser.add_argument('--unlabeled_data', action='store_true',
+                        help='Treat the data folder as a flat folder of unlabeled images (instead of one sub-folder per class)')
+    parser.set_defaults(unlabeled_data=False)
+
+    parser.add_argument('--shm_store', default='none', choices=['none', 'full', 'node_shard'],
+                        help='Load the encoded image files once per node into shared memory (/dev/shm), and read '
+                             'them from there in all ranks and DataLoader workers (full: the whole dataset; '
+                             'node_shard: only 1/num_nodes of the dataset on each node, the rest is read from disk)')
+    parser.add_argument('--decoded_cache_gb', default=0, type=float,
+                        help='Size (GB per host) of a cache of decoded images in shared memory (/dev/shm), shared by '
+                             'all ranks and DataLoader workers on a host (one cache for all --data_sources), with CLOCK '
+                             'eviction (0: disabled). Its hit rate and the decoding time saved are written to the '
+                             'training log')
+    parser.add_argument('--node_local_sampler', action='store_true',
+                        help='Give each node a mostly stable subset of the training data across epochs (samples '
+                             'i %% num_nodes == node_rank), so that its page cache stays warm')
+    parser.set_defaults(node_local_sampler=False)
+    parser.add_argument('--node_exchange_fraction', default=0.1, type=float,
+                        help='Fraction of the samples that is exchanged across nodes in each epoch with --node_local_sampler')
+    parser.add_argument('--data_sources', default=None, type=str, nargs='+',
+                        help='Train on several data folders (used as is, without appending "train"), each given as '
+                             'path[:repeat] and virtually repeated by a (possibly fractional) repeat factor per epoch, '
+                             'instead of duplicating them on disk (overrides --data_path)')
+    parser.add_argument('--data_mixing_weights', default=None, type=float, nargs='+',
+                        help='Mixing weights of --data_sources (overriding their repeat factors), where each source '
+                             'makes up a fraction w_i / sum(w) of the --samples_per_epoch samples in an epoch')
+    parser.add_argument('--samples_per_epoch', default=-1, type=int,
+                        help='Epoch size for --data_mixing_weights (-1 means the total size of all sources)')
+    parser.add_argument('--synthetic_data', action='store_true',
+                        help='Train on in-memory random images (with random masks) instead of the data, to measure '
+                             'the compute-only throughput; by default with the same number of samples (and sources) '
+                             'as the data, so that the epochs and the LR schedule are the same')
+    parser.set_defaults(synthetic_data=False)
+    parser.add_argument('--synthetic_num_samples', default=0, type=int,
+                        help='Number of synthetic samples per epoch with --synthetic_data (0: as many as the data, '
+                             'which only lists the data files)')
 
     parser.add_argument('--output_dir', default='./output_dir',
                         help='path where to save, empty for no saving')
@@ -128,6 +250,10 @@ def get_args_parser():
                         help='Pin CPU memory in DataLoader for more efficient (sometimes) transfer to GPU.')
     parser.add_argument('--no_pin_mem', action='store_false', dest='pin_mem')
     parser.set_defaults(pin_mem=True)
+    parser.add_argument('--cpu_affinity', action='store_true',
+                        help='Split the cores of each rank between its main process (intra-op threads and the '
+                             'pin-memory thread, at least 2 cores) and its DataLoader workers (one core each), and '
+                             'pin them')
 
     # distributed training parameters
     parser.add_argument('--world_size', default=1, type=int,
@@ -145,6 +271,132 @@ def get_args_parser():
     return parser
 
 
+def build_pretrain_transform(args):
+    """
+    Build the per-sample pretraining transform (augmentation and mask sampling).
+    This also infers `args.patch_size` from the model name if it's -1.
+    """
+    # simple augmentation
+    MAECrop = BYOLRandomResizedCrop if args.use_byol_crop else transforms.RandomResizedCrop
+    if args.synthetic_data:
+        assert not args.batched_augmentation, "the synthetic images are already augmented"
+        # the synthetic images are already normalized (or uint8 with --compact_batch) tensors
+        transform_train = transforms.Compose([])
+    elif args.batched_augmentation:
+        assert not args.draft_decode, "--batched_augmentation needs fully decoded images"
+        assert not misc.XLA_CFG["is_xla"], "--batched_augmentation produces batches of varying image sizes"
+        # the workers emit the uint8 images, crop boxes and flips, see `batch_transform` below
+        transform_train = SampleCrop(scale=(args.min_crop, args.max_crop), crop_cls=MAECrop)
+    else:
+        if args.data_format == 'uint8_shards':
+            # crop directly from the memory-mapped uint8 arrays (with the same crop distribution)
+            crop = ArrayRandomResizedCrop(args.input_size, scale=(args.min_crop, args.max_crop), crop_cls=MAECrop)
+        elif args.draft_decode:
+            assert args.data_format == 'image_folder', "--draft_decode is only supported for image folders"
+            # the dataset returns lazily opened images, which the crop decodes at a reduced resolution
+            crop = DraftRandomResizedCrop(args.input_size, scale=(args.min_crop, args.max_crop), crop_cls=MAECrop)
+        else:
+            crop = MAECrop(args.input_size, scale=(args.min_crop, args.max_crop), interpolation=3)  # 3 is bicubic
+        if args.compact_batch:
+            # uint8 images, normalized in `MaskedAutoencoderViT.forward`
+            to_tensor = [transforms.PILToTensor()]
+        else:
+            to_tensor = [
+                transforms.ToTensor(),
+                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])]
+        transform_train = transforms.Compose([
+                crop,
+                transforms.RandomHorizontalFlip()] + to_tensor)
+    if args.patch_size == -1:
+        # automatically infer the patch size from model names
+        if "patch14" in args.model:
+            args.patch_size = 14
+        elif "patch64" in args.model:
+            args.patch_size = 64
+        elif "patch32" in args.model:
+            args.patch_size = 32
+        elif "patch24" in args.model:
+            args.patch_size = 24
+        elif "patch16" in args.model:
+            args.patch_size = 16
+        elif "patch8" in args.model:
+            args.patch_size = 8
+        elif "patch4" in args.model:
+            args.patch_size = 4
+        else:
+            raise Exception("cannot automatically infer patch size from args.model")
+    assert args.input_size % args.patch_size == 0
+    num_patches = (args.input_size // args.patch_size) ** 2
+    if args.num_repeats > 1:
+        assert args.batch_size % args.num_repeats == 0, "--batch_size must be a multiple of --num_repeats"
+        assert args.data_format != 'tar_shards', "--num_repeats is not supported with tar shards"
+        assert not args.draft_decode, "--num_repeats needs fully decoded images"
+    if args.mask_ratio_range is not None:
+        assert args.device_masking, "--mask_ratio_range samples the masks on the device"
+        assert not misc.XLA_CFG["is_xla"], "--mask_ratio_range produces packed sequences of varying lengths"
+        assert 0 <= args.mask_ratio_range[0] <= args.mask_ratio_range[1] < 1
+        assert args.mask_ratio_start is None, "--mask_ratio_range and --mask_ratio_start are exclusive"
+    if min(args.decoder_keep_ratio, args.decoder_keep_ratio_start or 1.) < 1:
+        assert args.decoder_downsampling == 1 and args.pred_downsampling == 1, \
+            "--decoder_keep_ratio needs the full-resolution decoder"
+        assert args.mask_ratio_range is None, "--decoder_keep_ratio is not supported with --mask_ratio_range"
+        assert not misc.XLA_CFG["is_xla"], "--decoder_keep_ratio changes the decoder length during training"
+    if args.masked_loss:
+        assert not misc.XLA_CFG["is_xla"], "--masked_loss predicts a data-dependent number of patches"
+    transform_with_mask = SampleVisiblePatchIndices(
+        transform_train, num_patches, args.mask_ratio, args.mask_downsampling, num_repeats=args.num_repeats,
+        sample_masks=not args.device_masking,
+        masking=args.masking,
+    )
+    return transform_with_mask
+
+
+def build_pretrain_data(args, transform_with_mask):
+    """Build the pretraining dataset and the (virtual) repeat factors of its data sources."""
+    if args.synthetic_data and args.synthetic_num_samples > 0:
+        dataset_train = SyntheticImageDataset(
+            args.synthetic_num_samples, args.input_size, transform=transform_with_mask, uint8=args.compact_batch,
+        )
+        repeat_factors = [1.]
+        print(dataset_train)
+    elif args.data_sources:
+        assert args.data_format != 'tar_shards', "--data_sources is not supported with tar shards"
+        source_paths, repeat_factors = parse_data_sources(args.data_sources)
+        dataset_train = torch.utils.data.ConcatDataset([
+            build_pretrain_dataset(path, transform=transform_with_mask, args=args, decoded_cache=False)
+            for path in source_paths
+        ])
+        attach_decoded_cache(dataset_train, args)  # one cache (and budget) for all sources
+        if args.data_mixing_weights:
+            repeat_factors = repeat_factors_from_mixing_weights(
+                args.data_mixing_weights, [len(d) for d in dataset_train.datasets], args.samples_per_epoch
+            )
+        for path, d, r in zip(source_paths, dataset_train.datasets, repeat_factors):
+            print("data source %s: %d images, repeat factor %g" % (path, len(d), r))
+    else:
+        dataset_train = build_pretrain_dataset(
+            os.path.join(args.data_path, 'train'), transform=transform_with_mask, args=args,
+        )
+        repeat_factors = [1.]
+        print(dataset_train)
+    if args.synthetic_data and args.synthetic_num_samples <= 0:
+        # the same number of samples per source, so that the sampler and the epochs are unchanged
+        dataset_train = synthetic_like(
+            dataset_train, args.input_size, transform=transform_with_mask, uint8=args.compact_batch,
+        )
+        print("synthetic data: %s samples" % " + ".join(str(n) for n in num_source_samples(dataset_train)))
+    if args.num_repeats > 1:
+        repeat_factors = [r / args.num_repeats for r in repeat_factors]
+        print("repeated augmentation: %d crops per decoded image, %d unique images per global batch" % (
+            args.num_repeats, args.batch_size // args.num_repeats * misc.get_world_size()))
+    return dataset_train, repeat_factors
+
+
+def build_pretrain_collate_fn(args):
+    collator_cls = MAECropIndexCollator if args.batched_augmentation else MAEIndexCollator
+    return collator_cls(compact=args.compact_batch)
+
+
 def main(args):
     misc.init_distributed_mode(args)
 
@@ -171,47 +423,28 @@ def main(args):
         assert args.effective_batch_size % (world_size * args.accum_iter) == 0
         args.batch_size = args.effective_batch_size // world_size // args.accum_iter
 
-    # simple augmentation
-    MAECrop = BYOLRandomResizedCrop if args.use_byol_crop else transforms.RandomResizedCrop
-    transform_train = transforms.Compose([
-            MAECrop(args.input_size, scale=(args.min_crop, args.max_crop), interpolation=3),  # 3 is bicubic
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
-    if args.patch_size == -1:
-        # automatically infer the patch size from model names
-        if "patch14" in args.model:
-            args.patch_size = 14
-        elif "patch64" in args.model:
-            args.patch_size = 64
-        elif "patch32" in args.model:
-            args.patch_size = 32
-        elif "patch24" in args.model:
-            args.patch_size = 24
-        elif "patch16" in args.model:
-            args.patch_size = 16
-        elif "patch8" in args.model:
-            args.patch_size = 8
-        elif "patch4" in args.model:
-            args.patch_size = 4
-        else:
-            raise Exception("cannot automatically infer patch size from args.model")
-    assert args.input_size % args.patch_size == 0
-    num_patches = (args.input_size // args.patch_size) ** 2
-    dataset_train = datasets.ImageFolder(
-        os.path.join(args.data_path, 'train'),
-        transform=SampleVisiblePatchIndices(
-            transform_train, num_patches, args.mask_ratio, args.mask_downsampling,
-        ),
-    )
-    print(dataset_train)
+    transform_with_mask = build_pretrain_transform(args)
+    dataset_train, repeat_factors = build_pretrain_data(args, transform_with_mask)
 
     if True:  # args.distributed:
         num_tasks = misc.get_world_size()
         global_rank = misc.get_rank()
-        sampler_train = torch.utils.data.DistributedSampler(
-            dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
-        )
+        if args.data_format == 'tar_shards' and not args.synthetic_data:
+            # the streaming dataset splits its shards across ranks and workers itself
+            sampler_train = None
+        elif args.node_local_sampler:
+            sampler_train = NodeLocalDistributedSampler(
+                dataset_train, repeat_factors, num_replicas=num_tasks, rank=global_rank,
+                ranks_per_node=misc.get_local_world_size(), exchange_fraction=args.node_exchange_fraction, shuffle=True
+            )
+        elif args.data_sources or args.num_repeats > 1:
+            sampler_train = RepeatFactorDistributedSampler(
+                dataset_train, repeat_factors, num_replicas=num_tasks, rank=global_rank, shuffle=True
+            )
+        else:
+            sampler_train = torch.utils.data.DistributedSampler(
+                dataset_train, num_replicas=num_tasks, rank=global_rank, shuffle=True
+            )
         print("Sampler_train = %s" % str(sampler_train))
     else:
         sampler_train = torch.utils.data.RandomSampler(dataset_train)
@@ -224,14 +457,18 @@ def main(args):
 
     data_loader_train = torch.utils.data.DataLoader(
         dataset_train, sampler=sampler_train,
-        batch_size=args.batch_size,
+        batch_size=args.batch_size // args.num_repeats,  # the collator flattens the repeated samples
         num_workers=args.num_workers,
+        worker_init_fn=worker_init_fn,
         pin_memory=args.pin_mem,
         drop_last=True,
-        persistent_workers=True,
-        collate_fn=MAEIndexCollator(),
+        # with a mask ratio curriculum, the workers sampling the masks are re-forked with the ratio of each epoch
+        persistent_workers=args.mask_ratio_start is None or args.device_masking,
+        collate_fn=build_pretrain_collate_fn(args),
     )
-    data_loader_train_sampler = data_loader_train.sampler
+    batch_transform = BatchedResizeFlipNormalize(args.input_size) if args.batched_augmentation else None
+    # `set_epoch` is called on the sampler (or on the streaming dataset) every epoch
+    data_loader_train_sampler = dataset_train if sampler_train is None else data_loader_train.sampler
     if misc.XLA_CFG["is_xla"]:
         data_loader_train = pl.MpDeviceLoader(data_loader_train, device)
     
@@ -245,7 +482,12 @@ def main(args):
         decoder_depth=args.decoder_depth,
     )
 
+    apply_checkpoint_policy(args.act_checkpoint, model.blocks, model.decoder_blocks, args.act_checkpoint_every)
+
     model.to(device)
+    if args.device_masking and not misc.XLA_CFG["is_xla"]:
+        # a dedicated mask generator per rank (XLA uses the global RNG)
+        model.mask_sampler.manual_seed(seed)
 
     model_without_ddp = model
     print("Model = %s" % str(model_without_ddp))
@@ -277,22 +519,48 @@ def main(args):
 
     print(f"Start training for {args.epochs} epochs")
     start_time = time.time()
+    samples_per_epoch = len(data_loader_train) * args.batch_size * misc.get_world_size()
+    # phase (number of visible patches, decoder keep ratio) => [epochs, samples, seconds]
+    phase_stats = {}
     for epoch in range(args.start_epoch, args.epochs):
         if args.distributed:
             data_loader_train_sampler.set_epoch(epoch)
+        if args.mask_ratio_start is not None:
+            # the mask ratio of this epoch, in the DataLoader workers and on the device
+            mask_ratio = lr_sched.adjust_mask_ratio(epoch, args)
+            transform_with_mask.masking.mask_ratio = mask_ratio
+            model_without_ddp.mask_sampler.masking.mask_ratio = mask_ratio
+        # the fraction of the removed patches fed to the decoder in this epoch
+        model_without_ddp.decoder_keep_ratio = lr_sched.adjust_decoder_keep_ratio(epoch, args)
+        num_keep_patches = transform_with_mask.num_keep_patches
+        epoch_start_time = time.time()
         train_stats = train_one_epoch(
             model, data_loader_train,
             optimizer, device, epoch, loss_scaler,
             log_writer=log_writer,
-            args=args
+            args=args,
+            batch_transform=batch_transform,
         )
+        epoch_time = time.time() - epoch_start_time
+        phase = phase_stats.setdefault((num_keep_patches, model_without_ddp.decoder_keep_ratio), [0, 0, 0.])
+        phase[0] += 1
+        phase[1] += samples_per_epoch
+        phase[2] += epoch_time
+        print("epoch {}: mask ratio {:.4f} ({} visible patches), decoder keep ratio {:.4f}, {:.1f} samples/s".format(
+            epoch, transform_with_mask.masking.mask_ratio, num_keep_patches, model_without_ddp.decoder_keep_ratio,
+            samples_per_epoch / epoch_time))
         if args.output_dir and (epoch % args.ckpt_interval == 0 or epoch + 1 == args.epochs):
             misc.save_model(
                 args=args, model=model, model_without_ddp=model_without_ddp, optimizer=optimizer,
                 loss_scaler=loss_scaler, epoch=epoch)
 
         log_stats = {**{f'train_{k}': v for k, v in train_stats.items()},
-                        'epoch': epoch,}
+                        **{f'data_{k}': v for k, v in get_data_stats(dataset_train).items()},
+                        'epoch': epoch,
+                        'mask_ratio': transform_with_mask.masking.mask_ratio,
+                        'num_keep_patches': num_keep_patches,
+                        'decoder_keep_ratio': model_without_ddp.decoder_keep_ratio,
+                        'samples_per_s': samples_per_epoch / epoch_time,}
 
         if args.output_dir and misc.is_main_process():
             if log_writer is not None:
@@ -303,6 +571,10 @@ def main(args):
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
     print('Training time {}'.format(total_time_str))
+    for (num_keep_patches, decoder_keep_ratio), (num_epochs, num_samples, phase_time) in sorted(phase_stats.items()):
+        print("{} visible patches, decoder keep ratio {:.4f}: {} epochs in {}, {:.1f} samples/s".format(
+            num_keep_patches, decoder_keep_ratio, num_epochs, datetime.timedelta(seconds=int(phase_time)),
+            num_samples / phase_time))
 
 
 def xla_main(index, args):
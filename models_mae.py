@@ -13,9 +13,15 @@ from functools import partial
 
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
+from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
 from timm.models.vision_transformer import PatchEmbed, Block
 
+from util.act_checkpoint import block_forward
+from util.long_seq_patch_loader import BatchedVisiblePatchSampler
+from util.masking import build_masking
+from util.packed_seq import PackedBatch, packed_block_forward
 from util.pos_embed import get_2d_sincos_pos_embed
 
 
@@ -59,6 +65,70 @@ class AttentionNoKBias(nn.Module):
         return x
 
 
+class FusedAttention(nn.Module):
+    """
+    The self-attention of a timm `Attention` or an `AttentionNoKBias` (taking
+    over its parameters, with the same state dict keys) computed with the fused
+    `torch.nn.functional.scaled_dot_product_attention`, which doesn't keep the
+    L x L attention matrix when a fused kernel is available for the device.
+    """
+    def __init__(self, attn):
+        super().__init__()
+        assert hasattr(nn.functional, "scaled_dot_product_attention"), "the fused attention needs PyTorch 2.0+"
+        self.num_heads = attn.num_heads
+        head_dim = attn.qkv.in_features // attn.num_heads
+        assert attn.scale == head_dim ** -0.5, "the fused attention uses the default scale"
+        self.scale = attn.scale
+        self.qkv = attn.qkv
+        self.q_bias = getattr(attn, "q_bias", None)
+        self.v_bias = getattr(attn, "v_bias", None)
+        if self.q_bias is not None:
+            self.register_buffer("k_bias", torch.zeros_like(self.v_bias, requires_grad=False), persistent=False)
+        self._qkv_bias_cache = (None, None)
+        self.attn_drop = attn.attn_drop
+        self.proj = attn.proj
+        self.proj_drop = attn.proj_drop
+
+    def qkv_bias(self):
+        """
+        The (3C,) qkv bias, with a zero k bias for `AttentionNoKBias`. The
+        concatenation is only cached in eval mode or with frozen biases: while
+        training, it is rebuilt in every forward pass so that autograd reaches
+        `q_bias` and `v_bias` (a negligible (3C,) copy next to the qkv matmul).
+        """
+        if self.q_bias is None:
+            return self.qkv.bias
+        if torch.is_grad_enabled() and (self.q_bias.requires_grad or self.v_bias.requires_grad):
+            return torch.cat((self.q_bias, self.k_bias, self.v_bias))
+        # the concatenation is reused until the biases are updated (e.g. by the optimizer or `load_state_dict`)
+        key = (self.q_bias._version, self.v_bias._version, self.q_bias.data_ptr(), self.v_bias.data_ptr())
+        if self._qkv_bias_cache[0] != key:
+            self._qkv_bias_cache = (key, torch.cat((self.q_bias, self.k_bias, self.v_bias)).detach())
+        return self._qkv_bias_cache[1]
+
+    def forward(self, x):
+        B, N, C = x.shape
+        qkv = nn.functional.linear(input=x, weight=self.qkv.weight, bias=self.qkv_bias())
+        qkv = qkv.reshape(B, N, 3, self.num_heads, -1).permute(2, 0, 3, 1, 4)
+        q, k, v = qkv[0], qkv[1], qkv[2]
+
+        x = nn.functional.scaled_dot_product_attention(
+            q, k, v, dropout_p=self.attn_drop.p if self.training else 0.)
+
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
+
+def use_fused_attention(model):
+    """Replace the attention of every block of `model` by `FusedAttention` (`--fused_attn`)."""
+    for module in list(model.modules()):
+        if isinstance(module, Block) and not isinstance(module.attn, FusedAttention):
+            module.attn = FusedAttention(module.attn)
+    return model
+
+
 class MaskedAutoencoderViT(nn.Module):
     """ Masked Autoencoder with VisionTransformer backbone
     """
@@ -132,8 +202,24 @@ class MaskedAutoencoderViT(nn.Module):
 
         self.norm_pix_loss = norm_pix_loss
 
+        # the fraction of the removed patches fed to the decoder (`--decoder_keep_ratio`, set every epoch)
+        self.decoder_keep_ratio = getattr(args, "decoder_keep_ratio", 1.)
+
+        # to normalize compact uint8 batches on the device (not saved in checkpoints)
+        self.register_buffer("pixel_mean", torch.tensor(IMAGENET_DEFAULT_MEAN).view(1, 3, 1, 1), persistent=False)
+        self.register_buffer("pixel_std", torch.tensor(IMAGENET_DEFAULT_STD).view(1, 3, 1, 1), persistent=False)
+
+        # samples the masks on the device when `forward` gets no indices (`--device_masking`)
+        self.mask_sampler = BatchedVisiblePatchSampler(build_masking(
+            getattr(args, "masking", "random"), num_patches, getattr(args, "mask_ratio", 0.75),
+            getattr(args, "mask_downsampling", 1),
+        ))
+
         self.initialize_weights()
 
+        if getattr(args, "fused_attn", False):
+            use_fused_attention(self)
+
     def initialize_weights(self):
         # initialization
         # initialize (and freeze) pos_embed by sin-cos embedding
@@ -164,10 +250,10 @@ class MaskedAutoencoderViT(nn.Module):
             nn.init.constant_(m.bias, 0)
             nn.init.constant_(m.weight, 1.0)
 
-    def patchify(self, imgs):
+    def patchify(self, imgs, patch_size=None):
         """
         imgs: (N, 3, H, W)
-        x: (N, L, patch_size**2 *3)
+        x: (N, L, patch_size**2 *3), by default with the prediction patch size
         """
         # p = self.patch_embed.patch_size[0]
         # assert imgs.shape[2] == imgs.shape[3] and imgs.shape[2] % p == 0
@@ -178,7 +264,7 @@ class MaskedAutoencoderViT(nn.Module):
         # x = x.reshape(shape=(imgs.shape[0], h * w, p**2 * 3))
         # return x
 
-        p = q = self.patch_embed.patch_size[0] * self.args.pred_downsampling
+        p = q = patch_size or self.patch_embed.patch_size[0] * self.args.pred_downsampling
         # (n, c, h, w) => (n, c, h/p, p, w/q, q) => (n, h/p, w/q, p, q, c)
         #  => (n, h/p * w/q, p*q*c)
         return imgs.view(
@@ -204,6 +290,34 @@ class MaskedAutoencoderViT(nn.Module):
         imgs = x.reshape(shape=(x.shape[0], 3, h * p, h * p))
         return imgs
 
+    def embed_patches(self, patches):
+        """
+        patches: (..., p*p*3), from `patchify` with the encoder patch size
+        x: (..., D), the patch embedding (its conv weights used as a linear projection)
+        """
+        w = self.patch_embed.proj.weight  # (D, 3, p, p) => (D, p*p*3) in the (p, q, c) order of `patchify`
+        x = nn.functional.linear(patches, w.permute(0, 2, 3, 1).flatten(1), self.patch_embed.proj.bias)
+        return self.patch_embed.norm(x)
+
+    def embed_visible_patches(self, patches, ids_keep, ids_restore):
+        """
+        Embed only the visible patches (`--patchify_once`), with the same result as
+        `patch_embed` + pos embed + `random_masking` on the whole image.
+        patches: [N, L, p*p*3], from `patchify` with the encoder patch size
+        """
+        N, L, P = patches.shape
+        len_keep = ids_keep.size(-1)
+        x = self.embed_patches(torch.gather(patches, dim=1, index=ids_keep.unsqueeze(-1).expand(-1, -1, P)))
+        x = x + self.pos_embed[0, 1:, :][ids_keep]
+
+        # generate the binary mask: 0 is keep, 1 is remove
+        mask = torch.ones([N, L], device=x.device)
+        mask[:, :len_keep] = 0
+        # unshuffle to get the binary mask
+        mask = torch.gather(mask, dim=1, index=ids_restore)
+
+        return x, mask
+
     def random_masking(self, x, ids_keep, ids_restore):
         """
         Perform per-sample random masking by per-sample shuffling.
@@ -222,15 +336,19 @@ class MaskedAutoencoderViT(nn.Module):
 
         return x_masked, mask
 
-    def forward_encoder(self, x, ids_keep, ids_restore):
-        # embed patches
-        x = self.patch_embed(x)
+    def forward_encoder(self, x, ids_keep, ids_restore, patches=None):
+        if patches is not None:
+            # embed the visible patches only
+            x, mask = self.embed_visible_patches(patches, ids_keep, ids_restore)
+        else:
+            # embed patches
+            x = self.patch_embed(x)
 
-        # add pos embed w/o cls token
-        x = x + self.pos_embed[:, 1:, :]
+            # add pos embed w/o cls token
+            x = x + self.pos_embed[:, 1:, :]
 
-        # masking: length -> length * mask_ratio
-        x, mask = self.random_masking(x, ids_keep, ids_restore)
+            # masking: length -> length * mask_ratio
+            x, mask = self.random_masking(x, ids_keep, ids_restore)
 
         # append cls token
         cls_token = self.cls_token + self.pos_embed[:, :1, :]
@@ -239,12 +357,35 @@ class MaskedAutoencoderViT(nn.Module):
 
         # apply Transformer blocks
         for blk in self.blocks:
-            x = blk(x)
+            x = block_forward(blk, x)
         x = self.norm(x)
 
         return x, mask, ids_restore
 
-    def forward_decoder(self, x, ids_restore):
+    def forward_encoder_packed(self, x, packed, patches=None):
+        # masking: pack the visible patches of all samples (each after its cls token) into one sequence
+        cls_token = self.cls_token + self.pos_embed[:, :1, :]
+        cls_tokens = cls_token[0].expand(packed.batch_size, -1)
+        if patches is not None:
+            # embed the visible patches only
+            x = self.embed_patches(patches[packed.batch_index, packed.ids_keep])
+            x = packed.pack_visible(x + self.pos_embed[0, 1:, :][packed.ids_keep], cls_tokens)
+        else:
+            # embed patches
+            x = self.patch_embed(x)
+
+            # add pos embed w/o cls token
+            x = x + self.pos_embed[:, 1:, :]
+            x = packed.pack(x, cls_tokens)
+
+        # apply Transformer blocks
+        for blk in self.blocks:
+            x = packed_block_forward(blk, x, packed)
+        x = self.norm(x)
+
+        return x, packed.mask(x.device)
+
+    def forward_decoder(self, x, ids_restore, pred_ids=None):
         # embed tokens
         x = self.decoder_embed(x)
 
@@ -252,24 +393,83 @@ class MaskedAutoencoderViT(nn.Module):
         mask_tokens = self.mask_token.repeat(x.shape[0], ids_restore.shape[1] + 1 - x.shape[1], 1)
         x_ = torch.cat([x[:, 1:, :], mask_tokens], dim=1)  # no cls token
         x_ = torch.gather(x_, dim=1, index=ids_restore.unsqueeze(-1).repeat(1, 1, x.shape[2]))  # unshuffle
+        return self.forward_decoder_grid(x[:, :1, :], x_, pred_ids)
+
+    def forward_decoder_subset(self, x, ids_restore, num_mask_tokens):
+        """
+        Decode the visible patches and a random subset of `num_mask_tokens` removed
+        patches per sample (`--decoder_keep_ratio`), in their shuffled order (the
+        tokens get the pos embed of their patch instead of being unshuffled).
+        pred: [N, num_mask_tokens, p*p*3], the predictions of the subset
+        ids_pred: [N, num_mask_tokens], the patches of the subset
+        """
+        N, L = ids_restore.shape
+        len_keep = x.shape[1] - 1
+        # the patch at each position of the shuffled sequence (the inverse of ids_restore)
+        ids_shuffle = torch.empty_like(ids_restore).scatter_(
+            1, ids_restore, torch.arange(L, device=ids_restore.device).expand(N, -1))
+        subset = self.mask_sampler.sample_subset(N, L - len_keep, num_mask_tokens, x.device)
+        ids_pred = torch.gather(ids_shuffle[:, len_keep:], dim=1, index=subset)
+        ids_decode = torch.cat([ids_shuffle[:, :len_keep], ids_pred], dim=1)
+
+        # embed tokens
+        x = self.decoder_embed(x)
+
+        # append the mask tokens of the subset to sequence
+        x = torch.cat([x, self.mask_token.expand(N, num_mask_tokens, -1).to(x.dtype)], dim=1)
+
+        # add pos embed (of the patch of each token)
+        pos_embed = torch.cat([
+            self.decoder_pos_embed[:, :1, :].expand(N, -1, -1), self.decoder_pos_embed[0, 1:, :][ids_decode]], dim=1)
+        x = x + pos_embed
+
+        # apply Transformer blocks
+        for blk in self.decoder_blocks:
+            x = block_forward(blk, x)
+        # keep the mask tokens
+        x = x[:, 1 + len_keep:, :]
+
+        x = self.decoder_norm(x)
+
+        # predictor projection
+        x = self.decoder_pred(x)
+
+        return x, ids_pred
+
+    def forward_decoder_packed(self, x, packed, pred_ids=None):
+        # embed tokens
+        x = self.decoder_embed(x)
+
+        # unpack the visible patches into the patch grid, filled with mask tokens
+        cls_tokens, x_ = packed.unpack(x, self.mask_token[0, 0])
+        return self.forward_decoder_grid(cls_tokens[:, None, :], x_, pred_ids)
+
+    def forward_decoder_grid(self, cls_tokens, x_, pred_ids=None):
+        """
+        cls_tokens: [N, 1, D], decoder cls tokens
+        x_: [N, L, D], decoder tokens in patch order (mask tokens at removed patches)
+        pred_ids: [M], predict only these patches (flat indices into the [N * L] prediction grid)
+        """
         if self.args.decoder_downsampling != 1:
             x_ = x_.view(x_.size(0), self.grid_size, self.grid_size, x_.size(2)).permute(0, 3, 1, 2)  # NHWC => NCHW
             x_ = self.decoder_downsample(x_)
             x_ = x_.flatten(start_dim=2).permute(0, 2, 1)  # NCHW => NHWC
-        x = torch.cat([x[:, :1, :], x_], dim=1)  # append cls token
+        x = torch.cat([cls_tokens, x_], dim=1)  # append cls token
 
         # add pos embed
         x = x + self.decoder_pos_embed
 
         # apply Transformer blocks
         for blk in self.decoder_blocks:
-            x = blk(x)
+            x = block_forward(blk, x)
         # remove cls token
         x = x[:, 1:, :]
         if self.decoder_out_upsampling != 1:
             x = x.view(x.size(0), self.decoder_grid_size, self.decoder_grid_size, x.size(2)).permute(0, 3, 1, 2)  # NHWC => NCHW
             x = self.decoder_upsample(x)
             x = x.flatten(start_dim=2).permute(0, 2, 1)  # NCHW => NHWC
+        if pred_ids is not None:
+            x = x.flatten(0, 1)[pred_ids]
 
         x = self.decoder_norm(x)
 
@@ -278,13 +478,15 @@ class MaskedAutoencoderViT(nn.Module):
 
         return x
 
-    def forward_loss(self, imgs, pred, mask):
+    def forward_loss(self, imgs, pred, mask, target=None):
         """
         imgs: [N, 3, H, W]
         pred: [N, L, p*p*3]
         mask: [N, L], 0 is keep, 1 is remove, 
+        target: [N, L, p*p*3], the patches of imgs if already computed
         """
-        target = self.patchify(imgs)
+        if target is None:
+            target = self.patchify(imgs)
         if self.norm_pix_loss:
             mean = target.mean(dim=-1, keepdim=True)
             var = target.var(dim=-1, keepdim=True)
@@ -293,19 +495,97 @@ class MaskedAutoencoderViT(nn.Module):
         loss = (pred - target) ** 2
         loss = loss.mean(dim=-1)  # [N, L], mean loss per patch
 
+        mask = self.loss_weights(mask)
+        loss = (loss * mask).sum() / mask.sum()  # mean loss on removed patches
+        return loss
+
+    def loss_weights(self, mask):
+        """
+        mask: [N, L], 0 is keep, 1 is remove
+        weights: [N, L'], the loss weight of each predicted patch (the fraction of its patches that are removed)
+        """
         if self.args.pred_downsampling > 1:
             mask = nn.functional.avg_pool2d(
                 mask.view(mask.size(0), 1, self.grid_size, self.grid_size),
                 kernel_size=self.args.pred_downsampling,
                 stride=self.args.pred_downsampling,
             ).flatten(1)
-        loss = (loss * mask).sum() / mask.sum()  # mean loss on removed patches
-        return loss
+        return mask
 
-    def forward(self, imgs, ids_keep, ids_restore):
-        latent, mask, ids_restore = self.forward_encoder(imgs, ids_keep, ids_restore)
-        pred = self.forward_decoder(latent, ids_restore)  # [N, L, p*p*3]
-        loss = self.forward_loss(imgs, pred, mask)
+    def forward_loss_masked(self, imgs, pred, weights, pred_ids, target=None):
+        """
+        The loss of `forward_loss` from the predictions of the patches with a
+        nonzero weight only, computed in chunks of `--loss_chunk_size` patches.
+        imgs: [N, 3, H, W]
+        pred: [M, p*p*3], the predicted patches `pred_ids` (flat indices into [N * L])
+        weights: [M], their loss weights
+        target: [N, L, p*p*3], the patches of imgs if already computed
+        """
+        if target is None:
+            target = self.patchify(imgs)
+        target = target.flatten(0, 1)
+        chunk_size = getattr(self.args, "loss_chunk_size", 0) or pred.size(0)
+        loss = 0.
+        for start in range(0, pred.size(0), chunk_size):
+            chunk = (pred[start:start + chunk_size], target, pred_ids[start:start + chunk_size],
+                     weights[start:start + chunk_size])
+            if torch.is_grad_enabled():
+                # don't keep the target and error of each chunk for the backward pass
+                loss = loss + checkpoint(self._chunk_loss, *chunk, use_reentrant=False)
+            else:
+                loss = loss + self._chunk_loss(*chunk)
+        return loss / weights.sum()  # mean loss on removed patches
+
+    def _chunk_loss(self, pred, target, pred_ids, weights):
+        target = target[pred_ids]
+        if self.norm_pix_loss:
+            mean = target.mean(dim=-1, keepdim=True)
+            var = target.var(dim=-1, keepdim=True)
+            target = (target - mean) / (var + 1.e-6)**.5
+        loss = ((pred - target) ** 2).mean(dim=-1)
+        return (loss * weights).sum()
+
+    def forward(self, imgs, ids_keep=None, ids_restore=None, return_pred=False):
+        if imgs.dtype == torch.uint8:
+            # compact batch (`--compact_batch`): normalize the images on the device
+            imgs = (imgs.float() / 255. - self.pixel_mean) / self.pixel_std
+        patches = target = None
+        if getattr(self.args, "patchify_once", False):
+            # `--patchify_once`: embed only the visible patches, and reuse the patches as the target
+            patches = self.patchify(imgs, self.patch_embed.patch_size[0])
+            if self.args.pred_downsampling == 1:
+                target = patches
+        if ids_keep is None and getattr(self.args, "mask_ratio_range", None) is not None:
+            # `--mask_ratio_range`: a mask ratio per sample, with a packed variable-length encoder batch
+            packed = PackedBatch(*self.mask_sampler.sample_variable(
+                imgs.size(0), imgs.device, self.args.mask_ratio_range))
+            latent, mask = self.forward_encoder_packed(imgs, packed, patches)
+            decode = partial(self.forward_decoder_packed, latent, packed)
+        else:
+            if ids_keep is None:
+                # `--device_masking`: sample the masks of the whole batch on the device
+                ids_keep, ids_restore = self.mask_sampler(imgs.size(0), imgs.device)
+            ids_keep, ids_restore = ids_keep.long(), ids_restore.long()
+            latent, mask, ids_restore = self.forward_encoder(imgs, ids_keep, ids_restore, patches)
+            decode = partial(self.forward_decoder, latent, ids_restore)
+            if self.decoder_keep_ratio < 1 and not return_pred:
+                # `--decoder_keep_ratio`: decode (and compute the loss of) a random subset of the removed patches
+                N, L = ids_restore.shape
+                num_mask_tokens = max(1, int((L - ids_keep.size(1)) * self.decoder_keep_ratio))
+                pred, ids_pred = self.forward_decoder_subset(latent, ids_restore, num_mask_tokens)
+                pred_ids = (ids_pred + L * torch.arange(N, device=ids_pred.device)[:, None]).flatten()
+                weights = torch.ones(pred_ids.size(0), device=pred.device)
+                loss = self.forward_loss_masked(imgs, pred.flatten(0, 1), weights, pred_ids, target)
+                return loss, None, None
+        if getattr(self.args, "masked_loss", False) and not return_pred:
+            # `--masked_loss`: predict (and compute the loss of) the removed patches only
+            weights = self.loss_weights(mask).flatten()
+            pred_ids = weights.nonzero().squeeze(1)
+            pred = decode(pred_ids)  # [M, p*p*3]
+            loss = self.forward_loss_masked(imgs, pred, weights[pred_ids], pred_ids, target)
+            return loss, None, None
+        pred = decode()  # [N, L, p*p*3]
+        loss = self.forward_loss(imgs, pred, mask, target)
         return loss, pred, mask
 
 
@@ -16,7 +16,8 @@ import torch.nn as nn
 
 import timm.models.vision_transformer
 
-from models_mae import AttentionNoKBias
+from models_mae import AttentionNoKBias, use_fused_attention
+from util.act_checkpoint import block_forward
 
 
 class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
@@ -43,7 +44,7 @@ class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
         x = self.pos_drop(x)
 
         for blk in self.blocks:
-            x = blk(x)
+            x = block_forward(blk, x)
 
         if self.global_pool:
             x = x[:, 1:, :].mean(dim=1)  # global pool without cls token
@@ -65,6 +66,8 @@ def vit_base_patch16(args, **kwargs):
     model = VisionTransformer(
         patch_size=16, embed_dim=768, depth=12, num_heads=12, mlp_ratio=4, qkv_bias=True,
         norm_layer=partial(nn.LayerNorm, eps=1e-6), **kwargs)
+    if getattr(args, "fused_attn", False):
+        use_fused_attention(model)
     return model
 
 
@@ -78,6 +81,8 @@ def vit_large_patch16(args, **kwargs):
     model = VisionTransformer(
         patch_size=16, embed_dim=1024, depth=24, num_heads=16, mlp_ratio=4, qkv_bias=True,
         norm_layer=partial(nn.LayerNorm, eps=1e-6), **kwargs)
+    if getattr(args, "fused_attn", False):
+        use_fused_attention(model)
     return model
 
 
@@ -91,4 +96,6 @@ def vit_huge_patch14(args, **kwargs):
     model = VisionTransformer(
         patch_size=14, embed_dim=1280, depth=32, num_heads=16, mlp_ratio=4, qkv_bias=True,
         norm_layer=partial(nn.LayerNorm, eps=1e-6), **kwargs)
+    if getattr(args, "fused_attn", False):
+        use_fused_attention(model)
     return model
\ No newline at end of file
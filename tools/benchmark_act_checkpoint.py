@@ -0,0 +1,104 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Compare the activation checkpointing policies (util/act_checkpoint.py,
+# --act_checkpoint): the activation memory kept for the backward pass (and the
+# peak memory on CUDA) and the time of an MAE pretraining step per policy, e.g.
+#   python3 tools/benchmark_act_checkpoint.py --model mae_vit_large_patch16_dec512d16h8b --input_size 448 \
+#       --batch_size 16 --device cuda --output act_checkpoint.json
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_pretrain  # noqa: E402
+import models_mae  # noqa: E402
+from util.act_checkpoint import ACT_CHECKPOINT_POLICIES, apply_checkpoint_policy  # noqa: E402
+
+
+def saved_activation_bytes(fn):
+    """The bytes of the (distinct) tensors kept for the backward pass by `fn` (without the inputs of the checkpoints)."""
+    storages = {}
+
+    def pack(t):
+        storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = fn()
+    return out, sum(storages.values())
+
+
+def main():
+    parser = argparse.ArgumentParser("Activation checkpointing benchmark")
+    parser.add_argument("--model", default="mae_vit_base_patch16_dec384d12h8b", type=str)
+    parser.add_argument("--input_size", default=224, type=int)
+    parser.add_argument("--patch_size", default=16, type=int)
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--policies", default=ACT_CHECKPOINT_POLICIES, nargs="+", choices=ACT_CHECKPOINT_POLICIES)
+    parser.add_argument("--every", default=[1, 2], type=int, nargs="+", help="values of --act_checkpoint_every")
+    parser.add_argument("--fused_attn", action="store_true")
+    parser.add_argument("--device", default="cpu", type=torch.device)
+    parser.add_argument("--num_iters", default=3, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    model_args = main_pretrain.get_args_parser().parse_args(["--fused_attn"] if args.fused_attn else [])
+    model = models_mae.__dict__[args.model](
+        args=model_args, img_size=args.input_size, patch_size=args.patch_size, norm_pix_loss=True,
+    ).to(args.device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    imgs = torch.randn(args.batch_size, 3, args.input_size, args.input_size, device=args.device)
+    use_amp = args.device.type == "cuda"
+
+    def step():
+        with torch.cuda.amp.autocast(enabled=use_amp):
+            loss, _, _ = model(imgs)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        return loss
+
+    results = []
+    for policy in args.policies:
+        for every in ([1] if policy == "none" else args.every):
+            apply_checkpoint_policy(policy, model.blocks, model.decoder_blocks, every)
+            step()  # warmup (and the optimizer states)
+            if args.device.type == "cuda":
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+            with torch.cuda.amp.autocast(enabled=use_amp):
+                (loss, _, _), saved_bytes = saved_activation_bytes(lambda: model(imgs))
+            loss.backward()
+            optimizer.zero_grad()
+            r = {"policy": policy, "every": every, "saved_activations_mb": saved_bytes / 1024 ** 2}
+            if args.device.type == "cuda":
+                r["peak_memory_mb"] = torch.cuda.max_memory_allocated() / 1024 ** 2
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            for _ in range(args.num_iters):
+                step()
+            if args.device.type == "cuda":
+                torch.cuda.synchronize()
+            r["step_ms"] = (time.perf_counter() - start_time) / args.num_iters * 1000
+            results.append(r)
+            print("{:<8s} every {}: saved activations {:9.1f} MB{}, step {:8.1f} ms".format(
+                policy, every, r["saved_activations_mb"],
+                ", peak memory {:9.1f} MB".format(r["peak_memory_mb"]) if "peak_memory_mb" in r else "", r["step_ms"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Benchmark the data pipelines of main_pretrain.py and main_finetune.py
+# (util/datasets.build_transform) without a model:
+#  - per-stage latency percentiles of a single sample (file read, decode, each
+#    transform, mask generation, collation), measured in the main process
+#  - end-to-end DataLoader throughput (samples/s) vs. num_workers, batch_size
+#    and pin_mem, and a recommended number of DataLoader workers for the host
+# The arguments after `--` are passed to the training script, e.g.
+#   python3 tools/benchmark_data_pipeline.py --pipeline pretrain \
+#     --sweep_num_workers 2 4 8 16 --output data_benchmark.json \
+#     -- --data_path ./data/coco --model mae_vit_large_patch16 --input_size 448 --batch_size 64
+# --------------------------------------------------------
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_finetune  # noqa: E402
+import main_pretrain  # noqa: E402
+from util.datasets import build_dataset  # noqa: E402
+from util.long_seq_patch_loader import SampleVisiblePatchIndices  # noqa: E402
+
+
+class StageTimer:
+    """Collect the time of each stage of each sample (summed over the calls within a sample)."""
+    def __init__(self):
+        self.current = {}
+        self.samples = []
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0.) + seconds
+
+    def end_sample(self):
+        self.samples.append(self.current)
+        self.current = {}
+
+    def summary(self):
+        names = []
+        for sample in self.samples:
+            names += [n for n in sample if n not in names]
+        stats = {}
+        for name in names:
+            ms = np.array([sample.get(name, 0.) for sample in self.samples]) * 1000
+            stats[name] = {
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(np.percentile(ms, 50)),
+                "p90_ms": float(np.percentile(ms, 90)),
+                "p99_ms": float(np.percentile(ms, 99)),
+            }
+        return stats
+
+
+class Timed:
+    def __init__(self, name, fn, timer):
+        self.name = name
+        self.fn = fn
+        self.timer = timer
+
+    def __call__(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        out = self.fn(*args, **kwargs)
+        self.timer.add(self.name, time.perf_counter() - start_time)
+        return out
+
+
+class TimedLoader:
+    """Same output as `torchvision.datasets.folder.pil_loader`, with the file read and the decoding timed apart."""
+    def __init__(self, timer):
+        self.timer = timer
+
+    def __call__(self, path):
+        start_time = time.perf_counter()
+        with open(path, "rb") as f:
+            data = f.read()
+        decode_time = time.perf_counter()
+        img = Image.open(io.BytesIO(data)).convert("RGB")
+        self.timer.add("read", decode_time - start_time)
+        self.timer.add("decode", time.perf_counter() - decode_time)
+        return img
+
+
+def instrument_transform(transform, timer):
+    if isinstance(transform, SampleVisiblePatchIndices):
+        transform.transforms = instrument_transform(transform.transforms, timer)
+        # the mask generation time is this minus the time of the inner transforms
+        return Timed("transform_and_mask", transform, timer)
+    if isinstance(transform, transforms.Compose):
+        transform.transforms = [instrument_transform(t, timer) for t in transform.transforms]
+        return transform
+    return Timed(type(transform).__name__, transform, timer)
+
+
+def profile_stages(dataset, collate_fn, num_samples, batch_size, seed):
+    """Per-stage latency of single samples in the main process (num_workers=0)."""
+    timer = StageTimer()
+    if hasattr(dataset, "loader") and not getattr(dataset, "lazy_decode", False) \
+            and getattr(dataset, "byte_store", None) is None:
+        dataset.loader = TimedLoader(timer)
+    if hasattr(dataset, "get_array"):  # uint8 shards
+        dataset.get_array = Timed("read", dataset.get_array, timer)
+    dataset.transform = instrument_transform(dataset.transform, timer)
+
+    indices = np.random.RandomState(seed).randint(0, len(dataset), size=num_samples)
+    samples = []
+    for i in indices:
+        start_time = time.perf_counter()
+        samples.append(dataset[int(i)])
+        timer.add("total", time.perf_counter() - start_time)
+        timer.end_sample()
+    inner = [n for n in timer.summary() if n not in ("read", "decode", "total", "transform_and_mask")]
+    for sample in timer.samples:
+        if "transform_and_mask" in sample:
+            sample["mask_generation"] = sample.pop("transform_and_mask") - sum(sample.get(n, 0.) for n in inner)
+    stats = timer.summary()
+
+    # collation (per batch)
+    collate_ms = []
+    for start in range(0, len(samples) - batch_size + 1, batch_size):
+        start_time = time.perf_counter()
+        collate_fn(samples[start:start + batch_size])
+        collate_ms.append((time.perf_counter() - start_time) * 1000)
+    if collate_ms:
+        stats["collate_per_batch"] = {
+            "mean_ms": float(np.mean(collate_ms)),
+            "p50_ms": float(np.percentile(collate_ms, 50)),
+            "p90_ms": float(np.percentile(collate_ms, 90)),
+            "p99_ms": float(np.percentile(collate_ms, 99)),
+        }
+    return stats
+
+
+def measure_throughput(dataset, collate_fn, num_workers, batch_size, pin_mem, num_batches, warmup_batches):
+    if isinstance(dataset, torch.utils.data.IterableDataset):
+        sampler = None
+    else:
+        num_samples = (warmup_batches + num_batches) * batch_size
+        sampler = torch.utils.data.RandomSampler(dataset, replacement=True, num_samples=num_samples)
+    data_loader = torch.utils.data.DataLoader(
+        dataset, sampler=sampler,
+        batch_size=batch_size, num_workers=num_workers, pin_memory=pin_mem, drop_last=True,
+        collate_fn=collate_fn,
+    )
+    start_time = time.perf_counter()
+    num_samples, first_batch_s, timed_start = 0, None, None
+    for step, batch in enumerate(data_loader):
+        if step == 0:
+            first_batch_s = time.perf_counter() - start_time
+        if step == warmup_batches:
+            timed_start = time.perf_counter()
+        if step >= warmup_batches:
+            num_samples += batch[0].size(0)  # counts repeated samples too
+        if step + 1 == warmup_batches + num_batches:
+            break
+    elapsed = time.perf_counter() - timed_start
+    del data_loader
+    return {
+        "num_workers": num_workers,
+        "batch_size": batch_size,
+        "pin_mem": pin_mem,
+        "samples_per_s": num_samples / elapsed,
+        "first_batch_s": first_batch_s,
+    }
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def build_pipeline(pipeline, script_args):
+    if pipeline == "pretrain":
+        args = main_pretrain.get_args_parser().parse_args(script_args)
+        dataset, _ = main_pretrain.build_pretrain_data(args, main_pretrain.build_pretrain_transform(args))
+        if isinstance(dataset, torch.utils.data.ConcatDataset):
+            dataset = dataset.datasets[0]  # profile the first data source
+        loader_batch_size = args.batch_size // args.num_repeats
+        return args, dataset, main_pretrain.build_pretrain_collate_fn(args), loader_batch_size
+    args = main_finetune.get_args_parser().parse_args(script_args)
+    dataset = build_dataset(is_train=(pipeline == "finetune_train"), args=args)
+    return args, dataset, torch.utils.data.default_collate, args.batch_size
+
+
+def main():
+    parser = argparse.ArgumentParser("Data pipeline benchmark")
+    parser.add_argument("--pipeline", default="pretrain", choices=["pretrain", "finetune_train", "finetune_val"])
+    parser.add_argument("--num_profile_samples", default=200, type=int,
+                        help="samples for the per-stage latencies (in the main process)")
+    parser.add_argument("--sweep_num_workers", default=None, type=int, nargs="+",
+                        help="num_workers values to benchmark (default: powers of 2 up to the CPUs per GPU)")
+    parser.add_argument("--sweep_batch_size", default=None, type=int, nargs="+",
+                        help="batch sizes to benchmark (default: the --batch_size of the training script)")
+    parser.add_argument("--sweep_pin_mem", default=None, type=int, nargs="+", choices=[0, 1],
+                        help="pin_mem values to benchmark (default: the --pin_mem of the training script)")
+    parser.add_argument("--num_batches", default=20, type=int, help="timed batches per configuration")
+    parser.add_argument("--warmup_batches", default=5, type=int)
+    parser.add_argument("--gpus_per_node", default=-1, type=int,
+                        help="ranks sharing the host CPUs (default: the number of visible GPUs)")
+    parser.add_argument("--target_samples_per_s", default=0., type=float,
+                        help="the training throughput per GPU to sustain (e.g. measured with synthetic data); "
+                             "the recommendation is then the fewest workers reaching it")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args, script_argv = parser.parse_args(argv[:split]), argv[split + 1:]
+
+    script_args, dataset, collate_fn, loader_batch_size = build_pipeline(args.pipeline, script_argv)
+    gpus_per_node = args.gpus_per_node if args.gpus_per_node > 0 else max(1, torch.cuda.device_count())
+    cpus_per_gpu = max(1, available_cpus() // gpus_per_node)
+    sweep_num_workers = args.sweep_num_workers or [0] + [2 ** i for i in range(int(np.log2(cpus_per_gpu)) + 1)]
+    sweep_batch_size = args.sweep_batch_size or [loader_batch_size]
+    sweep_pin_mem = [bool(p) for p in args.sweep_pin_mem] if args.sweep_pin_mem else [script_args.pin_mem]
+
+    results = {
+        "pipeline": args.pipeline,
+        "script_args": vars(script_args),
+        "host": {"cpus": available_cpus(), "gpus_per_node": gpus_per_node, "cpus_per_gpu": cpus_per_gpu},
+        "dataset_size": len(dataset),
+    }
+    if not isinstance(dataset, torch.utils.data.IterableDataset):
+        torch.manual_seed(args.seed)
+        results["stages"] = profile_stages(
+            dataset, collate_fn, args.num_profile_samples, sweep_batch_size[0], args.seed
+        )
+        for name, s in results["stages"].items():
+            print("{:<34s} mean {:8.2f} ms  p50 {:8.2f} ms  p90 {:8.2f} ms  p99 {:8.2f} ms".format(
+                name, s["mean_ms"], s["p50_ms"], s["p90_ms"], s["p99_ms"]))
+        # a fresh (uninstrumented) pipeline for the throughput runs
+        _, dataset, collate_fn, _ = build_pipeline(args.pipeline, script_argv)
+
+    results["throughput"] = []
+    for batch_size in sweep_batch_size:
+        for pin_mem in sweep_pin_mem:
+            for num_workers in sweep_num_workers:
+                r = measure_throughput(dataset, collate_fn, num_workers, batch_size, pin_mem,
+                                       args.num_batches, args.warmup_batches)
+                results["throughput"].append(r)
+                print("num_workers {:3d}  batch_size {:4d}  pin_mem {:d}: {:8.1f} samples/s".format(
+                    num_workers, batch_size, pin_mem, r["samples_per_s"]))
+
+    # recommend the fewest workers (within the CPUs per GPU) that reach the target throughput,
+    # or 95% of the best measured throughput
+    candidates = [r for r in results["throughput"] if r["num_workers"] <= cpus_per_gpu] or results["throughput"]
+    best = max(r["samples_per_s"] for r in candidates)
+    target = args.target_samples_per_s if 0 < args.target_samples_per_s <= best else 0.95 * best
+    recommended = min(
+        (r for r in candidates if r["samples_per_s"] >= target), key=lambda r: (r["num_workers"], -r["samples_per_s"])
+    )
+    results["recommended"] = {
+        "num_workers": recommended["num_workers"],
+        "batch_size": recommended["batch_size"],
+        "pin_mem": recommended["pin_mem"],
+        "samples_per_s": recommended["samples_per_s"],
+        "target_samples_per_s": target,
+    }
+    print("recommended: --num_workers {} (~{:.0f} samples/s per GPU, {} CPUs per GPU)".format(
+        recommended["num_workers"], recommended["samples_per_s"], cpus_per_gpu))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
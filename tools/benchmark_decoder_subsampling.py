@@ -0,0 +1,127 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Throughput vs reconstruction loss of decoder token subsampling
+# (--decoder_keep_ratio): train the same MAE (from the same initialization, on
+# the same batches) with several decoder keep ratios, and record the training
+# throughput and the curve of the full reconstruction loss (all removed
+# patches, fixed masks) on held-out images against the training time, e.g.
+#   python3 tools/benchmark_decoder_subsampling.py --data_path ./data/imagenet/train --input_size 448 \
+#       --keep_ratios 1 0.5 0.25 0.1 --steps 200 --device cuda --output decoder_subsampling.json
+# --------------------------------------------------------
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+import torch
+import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_pretrain  # noqa: E402
+import models_mae  # noqa: E402
+from util.datasets import build_image_folder  # noqa: E402
+
+
+def load_images(args):
+    transform = transforms.Compose([
+        transforms.Resize(args.input_size, interpolation=3),
+        transforms.CenterCrop(args.input_size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    dataset = build_image_folder(args.data_path, transform, args)
+    num_images = min(len(dataset), args.num_train_images + args.num_eval_images)
+    imgs = torch.stack([dataset[i][0] for i in range(num_images)])
+    return imgs[args.num_eval_images:], imgs[:args.num_eval_images]
+
+
+def eval_loss(model, imgs, masks, args):
+    model.eval()
+    losses = []
+    with torch.no_grad():
+        for i in range(0, imgs.size(0), args.batch_size):
+            ids_keep, ids_restore = [m[i:i + args.batch_size] for m in masks]
+            loss, _, _ = model(imgs[i:i + args.batch_size].to(args.device), ids_keep, ids_restore, return_pred=True)
+            losses.append(loss.item())
+    model.train()
+    return sum(losses) / len(losses)
+
+
+def main():
+    parser = argparse.ArgumentParser("Decoder token subsampling benchmark")
+    parser.add_argument("--data_path", required=True, type=str, help="an image folder")
+    parser.add_argument("--model", default="mae_vit_base_patch16_dec384d12h8b", type=str)
+    parser.add_argument("--input_size", default=224, type=int)
+    parser.add_argument("--patch_size", default=16, type=int)
+    parser.add_argument("--mask_ratio", default=0.75, type=float)
+    parser.add_argument("--keep_ratios", default=[1., 0.5, 0.25], type=float, nargs="+")
+    parser.add_argument("--batch_size", default=16, type=int)
+    parser.add_argument("--lr", default=1.5e-4, type=float)
+    parser.add_argument("--steps", default=50, type=int)
+    parser.add_argument("--eval_interval", default=10, type=int)
+    parser.add_argument("--num_train_images", default=512, type=int)
+    parser.add_argument("--num_eval_images", default=64, type=int)
+    parser.add_argument("--device", default="cpu", type=torch.device)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    train_imgs, eval_imgs = load_images(args)
+    model_args = main_pretrain.get_args_parser().parse_args(["--mask_ratio", str(args.mask_ratio)])
+    torch.manual_seed(args.seed)
+    init_model = models_mae.__dict__[args.model](
+        args=model_args, img_size=args.input_size, patch_size=args.patch_size, norm_pix_loss=True,
+    )
+    eval_masks = init_model.mask_sampler(eval_imgs.size(0), torch.device("cpu"))
+    eval_masks = [m.to(args.device) for m in eval_masks]
+    use_amp = args.device.type == "cuda"
+
+    results = []
+    for keep_ratio in args.keep_ratios:
+        model = copy.deepcopy(init_model).to(args.device)
+        model.decoder_keep_ratio = keep_ratio
+        model.mask_sampler.manual_seed(args.seed)
+        optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, betas=(0.9, 0.95), weight_decay=0.05)
+        scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
+        generator = torch.Generator().manual_seed(args.seed)
+        curve = [{"step": 0, "train_s": 0., "eval_loss": eval_loss(model, eval_imgs, eval_masks, args)}]
+        train_s = 0.
+        for step in range(1, args.steps + 1):
+            batch = train_imgs[torch.randint(train_imgs.size(0), (args.batch_size,), generator=generator)]
+            batch = batch.to(args.device)
+            if args.device.type == "cuda":
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            with torch.cuda.amp.autocast(enabled=use_amp):
+                loss, _, _ = model(batch)
+            optimizer.zero_grad()
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            if args.device.type == "cuda":
+                torch.cuda.synchronize()
+            train_s += time.perf_counter() - start_time
+            if step % args.eval_interval == 0 or step == args.steps:
+                curve.append({"step": step, "train_s": train_s, "eval_loss": eval_loss(model, eval_imgs, eval_masks, args)})
+        r = {
+            "keep_ratio": keep_ratio, "samples_per_s": args.steps * args.batch_size / train_s,
+            "final_eval_loss": curve[-1]["eval_loss"], "curve": curve,
+        }
+        results.append(r)
+        print("decoder keep ratio {:.3f}: {:8.1f} samples/s, eval reconstruction loss {:.4f} -> {:.4f}".format(
+            keep_ratio, r["samples_per_s"], curve[0]["eval_loss"], r["final_eval_loss"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Compare the decode + random resized crop time (single process) of full-size
+# JPEG decoding vs. reduced-resolution decoding (util/crop.py
+# DraftRandomResizedCrop), with the same sampled crops, e.g.
+#   python3 tools/benchmark_draft_decode.py --data_path ./data/coco/train --input_size 224
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import PIL
+import torch
+import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.crop import RandomResizedCrop as BYOLRandomResizedCrop, DraftRandomResizedCrop  # noqa: E402
+from util.datasets import CompactImageFolder  # noqa: E402
+
+
+def benchmark(dataset, crop, indices, seed):
+    torch.manual_seed(seed)  # the same crops for both decoders
+    outputs = []
+    start_time = time.time()
+    for i in indices:
+        outputs.append(np.asarray(crop(dataset.load_image(int(i))), dtype=np.float32))
+    elapsed = time.time() - start_time
+    stats = {"num_samples": len(indices), "elapsed_s": elapsed, "samples_per_s": len(indices) / elapsed}
+    return stats, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser("Reduced-resolution JPEG decoding benchmark")
+    parser.add_argument("--data_path", required=True, type=str, help="an image folder")
+    parser.add_argument("--input_size", default=448, type=int)
+    parser.add_argument("--min_crop", default=0.2, type=float)
+    parser.add_argument("--max_crop", default=1.0, type=float)
+    parser.add_argument("--use_byol_crop", action="store_true")
+    parser.add_argument("--num_samples", default=500, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+    torch.set_num_threads(1)  # like in a DataLoader worker
+
+    crop_cls = BYOLRandomResizedCrop if args.use_byol_crop else transforms.RandomResizedCrop
+    scale = (args.min_crop, args.max_crop)
+    dataset = CompactImageFolder.from_image_folder(args.data_path)
+    indices = np.random.RandomState(args.seed).randint(0, len(dataset), size=args.num_samples)
+
+    results = {}
+    dataset.lazy_decode = False
+    results["full_decode"], full = benchmark(
+        dataset, crop_cls(args.input_size, scale=scale, interpolation=3), indices, args.seed)
+    dataset.lazy_decode = True
+    results["draft_decode"], draft = benchmark(
+        dataset, DraftRandomResizedCrop(args.input_size, scale=scale, interpolation=PIL.Image.BICUBIC,
+                                        crop_cls=crop_cls), indices, args.seed)
+    for name in ["full_decode", "draft_decode"]:
+        print(f"{name}: {results[name]['samples_per_s']:.1f} samples/s")
+    results["speedup"] = results["draft_decode"]["samples_per_s"] / results["full_decode"]["samples_per_s"]
+    # same crops, so the outputs only differ by the DCT downscaling
+    results["mean_abs_pixel_diff"] = float(np.mean([np.abs(a - b).mean() for a, b in zip(full, draft)]))
+    print(f"speedup: {results['speedup']:.2f}x, mean abs pixel difference: {results['mean_abs_pixel_diff']:.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
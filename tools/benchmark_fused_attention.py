@@ -0,0 +1,107 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Check the fused attention (`models_mae.FusedAttention`, --fused_attn) against
+# timm's `Attention` and `AttentionNoKBias` (outputs and gradients), and compare
+# the activation memory saved for the backward pass and the forward + backward
+# time of one attention layer at several sequence lengths, e.g.
+#   python3 tools/benchmark_fused_attention.py --seq_lens 197 785 3137 --devices cpu cuda --output attn.json
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+from timm.models.vision_transformer import Attention
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models_mae import AttentionNoKBias, FusedAttention  # noqa: E402
+
+
+def saved_activation_bytes(fn):
+    """The bytes of the (distinct) tensors saved for the backward pass by `fn`."""
+    storages = {}
+
+    def pack(t):
+        storages[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        out = fn()
+    return out, sum(storages.values())
+
+
+def time_fwd_bwd(attn, x, device, num_iters):
+    def step():
+        attn(x).sum().backward()
+
+    for _ in range(2):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for _ in range(num_iters):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / num_iters
+
+
+def main():
+    parser = argparse.ArgumentParser("Fused attention check and benchmark")
+    parser.add_argument("--seq_lens", default=[197, 785, 3137], type=int, nargs="+",
+                        help="sequence lengths (with the cls token), e.g. 224, 448 and 896 pixel images")
+    parser.add_argument("--embed_dim", default=768, type=int)
+    parser.add_argument("--num_heads", default=12, type=int)
+    parser.add_argument("--batch_size", default=2, type=int)
+    parser.add_argument("--devices", default=["cpu"], nargs="+")
+    parser.add_argument("--num_iters", default=3, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    results = []
+    for device in [torch.device(d) for d in args.devices]:
+        for attn_cls in [Attention, AttentionNoKBias]:
+            torch.manual_seed(0)
+            ref = attn_cls(args.embed_dim, args.num_heads, qkv_bias=True).to(device)
+            if attn_cls is AttentionNoKBias:
+                torch.nn.init.normal_(ref.q_bias, std=0.02)
+                torch.nn.init.normal_(ref.v_bias, std=0.02)
+            fused = FusedAttention(ref)  # shares the parameters of `ref`
+            for seq_len in args.seq_lens:
+                x = torch.randn(args.batch_size, seq_len, args.embed_dim, device=device, requires_grad=True)
+                r = {"attention": attn_cls.__name__, "device": str(device), "seq_len": seq_len}
+                grads = []
+                for name, attn in [("ref", ref), ("fused", fused)]:
+                    attn.zero_grad()
+                    x.grad = None
+                    out, r[name + "_saved_mb"] = saved_activation_bytes(lambda: attn(x))
+                    r[name + "_saved_mb"] /= 1024 ** 2
+                    out.square().sum().backward()
+                    grads.append([t.detach().clone() for t in [out, x.grad] + [p.grad for p in attn.parameters()]])
+                    r[name + "_fwd_bwd_ms"] = time_fwd_bwd(attn, x, device, args.num_iters) * 1000
+                # the largest difference of the output and the gradients, relative to their largest value
+                r["max_rel_diff"] = max(((a - b).abs().max() / b.abs().max()).item() for a, b in zip(*grads))
+                assert r["max_rel_diff"] < 1e-4, "the fused attention differs by {}".format(r["max_rel_diff"])
+                with torch.no_grad():
+                    # the cached bias concatenation without autograd
+                    assert torch.allclose(fused(x), ref(x), atol=1e-5)
+                results.append(r)
+                print("{:<16s} {:<5s} L={:<5d} saved activations {:8.1f} MB -> {:8.1f} MB, "
+                      "fwd+bwd {:8.1f} ms -> {:8.1f} ms, max rel diff {:.1e}".format(
+                          attn_cls.__name__, str(device), seq_len, r["ref_saved_mb"], r["fused_saved_mb"],
+                          r["ref_fwd_bwd_ms"], r["fused_fwd_bwd_ms"], r["max_rel_diff"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Microbenchmark of the masking strategies (util/masking.py, --masking): the
+# time to sample the masks of a batch at once (e.g. with --device_masking) and
+# of the same number of samples one at a time (as in the DataLoader workers),
+# for each strategy and sequence length, e.g.
+#   python3 tools/benchmark_masking.py --seq_lens 196 784 3136 --devices cpu cuda --output masking.json
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.masking import MASKING_STRATEGIES, build_masking  # noqa: E402
+
+
+def time_per_call(fn, device, num_iters, warmup_iters=3):
+    for _ in range(warmup_iters):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for _ in range(num_iters):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / num_iters
+
+
+def main():
+    parser = argparse.ArgumentParser("Masking strategy microbenchmark")
+    parser.add_argument("--strategies", default=list(MASKING_STRATEGIES), nargs="+", choices=list(MASKING_STRATEGIES))
+    parser.add_argument("--seq_lens", default=[196, 784, 3136], type=int, nargs="+",
+                        help="numbers of patches (e.g. 224, 448 and 896 pixel images with 16x16 patches)")
+    parser.add_argument("--mask_ratio", default=0.75, type=float)
+    parser.add_argument("--mask_downsampling", default=[1, 2], type=int, nargs="+")
+    parser.add_argument("--batch_size", default=256, type=int)
+    parser.add_argument("--devices", default=["cpu"], nargs="+")
+    parser.add_argument("--num_iters", default=20, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    results = []
+    for device in [torch.device(d) for d in args.devices]:
+        for name in args.strategies:
+            for seq_len in args.seq_lens:
+                for d in args.mask_downsampling:
+                    masking = build_masking(name, seq_len, args.mask_ratio, d)
+                    generator = torch.Generator(device=device).manual_seed(0)
+                    batched_s = time_per_call(
+                        lambda: masking(args.batch_size, device, generator), device, args.num_iters)
+                    r = {
+                        "strategy": name, "seq_len": seq_len, "mask_downsampling": d, "device": str(device),
+                        "batch_size": args.batch_size, "batched_ms": batched_s * 1000,
+                    }
+                    if device.type == "cpu":
+                        # one sample at a time, as in `SampleVisiblePatchIndices`
+                        per_sample_s = time_per_call(lambda: masking(1), device, args.num_iters * args.batch_size)
+                        r["per_sample_us"] = per_sample_s * 1e6
+                        r["per_sample_batch_ms"] = per_sample_s * args.batch_size * 1000
+                    results.append(r)
+                    print("{:<10s} L={:<5d} d={} {:<5s} batch of {}: {:8.2f} ms{}".format(
+                        name, seq_len, d, str(device), args.batch_size, r["batched_ms"],
+                        "  (one at a time: {:8.2f} ms)".format(r["per_sample_batch_ms"]) if "per_sample_us" in r else ""))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
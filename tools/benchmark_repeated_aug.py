@@ -0,0 +1,123 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Small CPU pretraining run of a tiny MAE with and without repeated
+# augmentation (--num_repeats), reporting the image decodes per training
+# sample, the data loading throughput and the training loss, e.g.
+#   python3 tools/benchmark_repeated_aug.py --data_path ./data/coco/train --num_repeats 4
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_pretrain  # noqa: E402
+import models_mae  # noqa: E402
+from util.datasets import CompactImageFolder  # noqa: E402
+from util.long_seq_patch_loader import SampleVisiblePatchIndices, MAEIndexCollator  # noqa: E402
+from util.samplers import RepeatFactorDistributedSampler  # noqa: E402
+
+
+class CountingLoader:
+    """Count the decoded images."""
+    def __init__(self, loader):
+        self.loader = loader
+        self.num_decodes = 0
+
+    def __call__(self, path):
+        self.num_decodes += 1
+        return self.loader(path)
+
+
+def run(args, num_repeats):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    transform = transforms.Compose([
+        transforms.RandomResizedCrop(args.input_size, scale=(args.min_crop, 1.0), interpolation=3),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    num_patches = (args.input_size // args.patch_size) ** 2
+    dataset = CompactImageFolder.from_image_folder(
+        args.data_path, transform=SampleVisiblePatchIndices(transform, num_patches, args.mask_ratio, 1, num_repeats),
+    )
+    dataset.loader = loader = CountingLoader(dataset.loader)
+    sampler = RepeatFactorDistributedSampler(dataset, [1. / num_repeats], num_replicas=1, rank=0, seed=args.seed)
+    data_loader = torch.utils.data.DataLoader(
+        dataset, sampler=sampler, batch_size=args.batch_size // num_repeats, drop_last=True,
+        collate_fn=MAEIndexCollator(),
+    )
+
+    model_args = main_pretrain.get_args_parser().parse_args(["--mask_ratio", str(args.mask_ratio)])
+    model = models_mae.MaskedAutoencoderViT(
+        model_args, img_size=args.input_size, patch_size=args.patch_size, embed_dim=192, depth=4, num_heads=3,
+        decoder_embed_dim=128, decoder_depth=2, decoder_num_heads=4, norm_pix_loss=True,
+    )
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, betas=(0.9, 0.95), weight_decay=0.05)
+
+    losses, num_samples, data_s = [], 0, 0.
+    step, epoch = 0, 0
+    while step < args.steps:
+        sampler.set_epoch(epoch)
+        start_time = time.time()
+        for batch in data_loader:
+            data_s += time.time() - start_time
+            loss, _, _ = model(*batch)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.item())
+            num_samples += batch[0].size(0)
+            step += 1
+            if step == args.steps:
+                break
+            start_time = time.time()
+        epoch += 1
+    last = losses[-args.steps // 4:]
+    return {
+        "num_repeats": num_repeats,
+        "decodes_per_sample": loader.num_decodes / num_samples,
+        "data_samples_per_s": num_samples / data_s,
+        "final_loss": float(np.mean(last)),
+        "final_loss_std": float(np.std(last)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("Repeated augmentation benchmark (small CPU run)")
+    parser.add_argument("--data_path", required=True, type=str, help="an image folder")
+    parser.add_argument("--num_repeats", default=4, type=int)
+    parser.add_argument("--input_size", default=64, type=int)
+    parser.add_argument("--patch_size", default=8, type=int)
+    parser.add_argument("--min_crop", default=0.2, type=float)
+    parser.add_argument("--mask_ratio", default=0.75, type=float)
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--lr", default=1e-3, type=float)
+    parser.add_argument("--steps", default=200, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    results = {"baseline": run(args, 1), "repeated": run(args, args.num_repeats)}
+    results["decode_reduction"] = results["baseline"]["decodes_per_sample"] / results["repeated"]["decodes_per_sample"]
+    results["final_loss_diff"] = results["repeated"]["final_loss"] - results["baseline"]["final_loss"]
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Compare the training throughput of main_pretrain.py or main_finetune.py on the
+# real data and on synthetic data (--synthetic_data, util/synthetic.py) with the
+# same model and arguments, to tell whether a run is input-bound. The arguments
+# after `--` are passed to the training script, e.g.
+#   python3 tools/benchmark_synthetic_data.py --pipeline pretrain --num_steps 50 \
+#     -- --data_path ./data/coco --model mae_vit_large_patch16 --input_size 448 --batch_size 64
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_finetune  # noqa: E402
+import main_pretrain  # noqa: E402
+import models_mae  # noqa: E402
+import models_vit  # noqa: E402
+from util.batched_aug import BatchedResizeFlipNormalize  # noqa: E402
+from util.datasets import build_dataset  # noqa: E402
+from util.synthetic import SyntheticImageDataset, synthetic_like  # noqa: E402
+
+
+def build_loader(pipeline, script_argv, synthetic):
+    parser = main_pretrain.get_args_parser() if pipeline == "pretrain" else main_finetune.get_args_parser()
+    args = parser.parse_args(script_argv + (["--synthetic_data"] if synthetic else []))
+    if synthetic:
+        # the synthetic images are already augmented, so the synthetic run skips the batched
+        # augmentation on the device (which counts as input pipeline work of the real run)
+        args.batched_augmentation = False
+    batch_transform = None
+    if pipeline == "pretrain":
+        dataset, _ = main_pretrain.build_pretrain_data(args, main_pretrain.build_pretrain_transform(args))
+        collate_fn = main_pretrain.build_pretrain_collate_fn(args)
+        batch_size = args.batch_size // args.num_repeats
+        if args.batched_augmentation:
+            batch_transform = BatchedResizeFlipNormalize(args.input_size)
+    else:
+        # like main_finetune.py (without mixup, which runs on the device in both cases)
+        if args.synthetic_data and args.synthetic_num_samples > 0:
+            dataset = SyntheticImageDataset(args.synthetic_num_samples, args.input_size, args.nb_classes)
+        else:
+            dataset = build_dataset(is_train=True, args=args)
+            if args.synthetic_data:
+                dataset = synthetic_like(dataset, args.input_size, num_classes=args.nb_classes)
+        collate_fn, batch_size = None, args.batch_size
+    # sample with replacement, so that small datasets don't run out
+    sampler = torch.utils.data.RandomSampler(dataset, replacement=True, num_samples=10 ** 9)
+    loader = torch.utils.data.DataLoader(
+        dataset, sampler=sampler, batch_size=batch_size, num_workers=args.num_workers,
+        pin_memory=args.pin_mem, drop_last=True, collate_fn=collate_fn,
+    )
+    return args, loader, batch_transform
+
+
+def build_model(pipeline, args):
+    if pipeline == "pretrain":
+        return models_mae.__dict__[args.model](
+            args=args, img_size=args.input_size, patch_size=args.patch_size, norm_pix_loss=args.norm_pix_loss,
+            decoder_embed_dim=args.decoder_embed_dim, decoder_depth=args.decoder_depth,
+        )
+    return models_vit.__dict__[args.model](
+        args=args, num_classes=args.nb_classes, drop_path_rate=args.drop_path, global_pool=args.global_pool,
+    )
+
+
+def measure(pipeline, script_argv, synthetic, num_steps, warmup_steps):
+    args, loader, batch_transform = build_loader(pipeline, script_argv, synthetic)
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    model = build_model(pipeline, args).to(device)
+    model.train(True)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    criterion = torch.nn.CrossEntropyLoss()
+
+    num_samples, data_s, start_time = 0, 0., None
+    data_start = time.time()
+    for step, batch in enumerate(loader):
+        if step == warmup_steps:
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            start_time, num_samples, data_s = time.time(), 0, 0.
+        data_s += time.time() - data_start
+        if pipeline == "pretrain":
+            if batch_transform is not None:
+                imgs, boxes, flips, *ids = batch  # no ids with `--device_masking`
+                batch = (batch_transform(imgs.to(device, non_blocking=True), boxes, flips), *ids)
+            batch = [x.to(device, non_blocking=True) for x in batch]
+            with torch.cuda.amp.autocast(enabled=device.type == "cuda"):
+                loss, _, _ = model(*batch)
+        else:
+            samples, targets = (x.to(device, non_blocking=True) for x in batch)
+            with torch.cuda.amp.autocast(enabled=device.type == "cuda"):
+                loss = criterion(model(samples), targets)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        num_samples += len(batch[0])
+        if step + 1 == warmup_steps + num_steps:
+            break
+        data_start = time.time()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.time() - start_time
+    return {
+        "samples_per_s": num_samples / elapsed,
+        "data_wait_fraction": data_s / elapsed,
+        "loss": loss.item(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("Real vs. synthetic data training throughput")
+    parser.add_argument("--pipeline", default="pretrain", choices=["pretrain", "finetune"])
+    parser.add_argument("--num_steps", default=50, type=int, help="timed training steps per run")
+    parser.add_argument("--warmup_steps", default=5, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args, script_argv = parser.parse_args(argv[:split]), argv[split + 1:]
+
+    results = {"pipeline": args.pipeline, "script_argv": script_argv}
+    for name, synthetic in (("synthetic", True), ("real", False)):
+        results[name] = measure(args.pipeline, script_argv, synthetic, args.num_steps, args.warmup_steps)
+        print("{:<9s} {:8.1f} samples/s (waiting for data {:.0%} of the time)".format(
+            name, results[name]["samples_per_s"], results[name]["data_wait_fraction"]))
+    ratio = results["real"]["samples_per_s"] / results["synthetic"]["samples_per_s"]
+    results["real_over_synthetic"] = ratio
+    print("real data reaches {:.0%} of the synthetic throughput: {}".format(
+        ratio, "input-bound" if ratio < 0.95 else "compute-bound"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
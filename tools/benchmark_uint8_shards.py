@@ -0,0 +1,82 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Compare the per-worker throughput (single process) of the pretraining data
+# pipeline on an image folder (JPEG + PIL) vs. pre-decoded uint8 shards, e.g.
+#   python3 tools/benchmark_uint8_shards.py \
+#     --data_path ./data/imagenet-1k/train --shard_dir ./data/imagenet-1k-u8/train
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.crop import ArrayRandomResizedCrop  # noqa: E402
+from util.datasets import CompactImageFolder  # noqa: E402
+from util.uint8_shards import Uint8ShardDataset  # noqa: E402
+
+
+def benchmark(dataset, num_samples, seed=0):
+    indices = np.random.RandomState(seed).randint(0, len(dataset), size=num_samples)
+    dataset[int(indices[0])]  # warm up
+    start_time = time.time()
+    for i in indices:
+        dataset[int(i)]
+    elapsed = time.time() - start_time
+    return {"num_samples": num_samples, "elapsed_s": elapsed, "samples_per_s": num_samples / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser("uint8 shard vs. image folder throughput benchmark")
+    parser.add_argument("--data_path", required=True, type=str, help="the original image folder")
+    parser.add_argument("--shard_dir", required=True, type=str, help="its uint8 shards")
+    parser.add_argument("--input_size", default=448, type=int)
+    parser.add_argument("--min_crop", default=0.2, type=float)
+    parser.add_argument("--max_crop", default=1.0, type=float)
+    parser.add_argument("--num_samples", default=1000, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+    torch.set_num_threads(1)  # like in a DataLoader worker
+
+    post_crop = [
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ]
+    scale = (args.min_crop, args.max_crop)
+    image_folder = CompactImageFolder.from_image_folder(
+        args.data_path,
+        transform=transforms.Compose(
+            [transforms.RandomResizedCrop(args.input_size, scale=scale, interpolation=3)] + post_crop
+        ),
+    )
+    shards = Uint8ShardDataset(
+        args.shard_dir,
+        transform=transforms.Compose([ArrayRandomResizedCrop(args.input_size, scale=scale)] + post_crop),
+    )
+
+    results = {}
+    for name, dataset in [("image_folder", image_folder), ("uint8_shards", shards)]:
+        results[name] = benchmark(dataset, args.num_samples)
+        print(f"{name}: {results[name]['samples_per_s']:.1f} samples/s per worker")
+    results["speedup"] = results["uint8_shards"]["samples_per_s"] / results["image_folder"]["samples_per_s"]
+    print(f"speedup: {results['speedup']:.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
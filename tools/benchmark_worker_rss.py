@@ -0,0 +1,118 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Measure the memory growth of DataLoader workers over an epoch for
+# `datasets.ImageFolder` vs. `CompactImageFolder`, e.g.
+#   python3 tools/benchmark_worker_rss.py --data_path ./data/imagenet-1k/train
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from torchvision import datasets  # noqa: E402
+
+from util.datasets import CompactImageFolder  # noqa: E402
+
+
+def read_smaps_rollup(pid):
+    """Return the USS (private) and PSS memory of a process in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1]) / 1024  # kB => MB
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {"uss_mb": uss, "pss_mb": fields.get("Pss", 0), "rss_mb": fields.get("Rss", 0)}
+
+
+class ReportWorkerPid(torch.utils.data.Dataset):
+    """Look up each sample (without decoding it by default) and return the worker pid."""
+    def __init__(self, dataset, decode):
+        self.dataset = dataset
+        if not decode:
+            self.dataset.loader = lambda path: path
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        self.dataset[index]
+        return os.getpid()
+
+
+def measure(dataset, args):
+    loader = torch.utils.data.DataLoader(
+        ReportWorkerPid(dataset, args.decode),
+        sampler=torch.utils.data.RandomSampler(dataset),
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        persistent_workers=True,
+    )
+    start, end = {}, {}
+    start_time = time.time()
+    for epoch in range(args.epochs):
+        for step, pids in enumerate(loader):
+            for pid in set(pids.tolist()):
+                if pid not in start:
+                    start[pid] = read_smaps_rollup(pid)
+            if args.max_steps > 0 and step + 1 >= args.max_steps:
+                break
+    for pid in start:
+        end[pid] = read_smaps_rollup(pid)
+    elapsed = time.time() - start_time
+
+    growth = {k: [end[p][k] - start[p][k] for p in start] for k in ("uss_mb", "pss_mb", "rss_mb")}
+    return {
+        "num_workers": len(start),
+        "elapsed_s": elapsed,
+        "worker_uss_growth_mb_mean": sum(growth["uss_mb"]) / len(start),
+        "worker_pss_growth_mb_mean": sum(growth["pss_mb"]) / len(start),
+        "worker_rss_growth_mb_mean": sum(growth["rss_mb"]) / len(start),
+        "worker_uss_end_mb_total": sum(end[p]["uss_mb"] for p in start),
+        "worker_pss_end_mb_total": sum(end[p]["pss_mb"] for p in start),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("DataLoader worker memory benchmark")
+    parser.add_argument("--data_path", required=True, type=str,
+                        help="an image folder (one sub-folder per class), e.g. ./data/imagenet-1k/train")
+    parser.add_argument("--num_workers", default=10, type=int)
+    parser.add_argument("--batch_size", default=256, type=int)
+    parser.add_argument("--epochs", default=1, type=int)
+    parser.add_argument("--max_steps", default=-1, type=int,
+                        help="stop each epoch after this many batches (-1 means a full epoch)")
+    parser.add_argument("--decode", action="store_true",
+                        help="also read and decode the images (slower, but closer to training)")
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    results = {}
+    for name in ("ImageFolder", "CompactImageFolder"):
+        if name == "ImageFolder":
+            dataset = datasets.ImageFolder(args.data_path)
+        else:
+            dataset = CompactImageFolder.from_image_folder(args.data_path)
+        print(f"{name}: {len(dataset)} samples, measuring {args.num_workers} workers ...")
+        results[name] = measure(dataset, args)
+        print(json.dumps(results[name], indent=2))
+        del dataset
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Check that the batched augmentation (util/batched_aug.py, --batched_augmentation)
+# matches the per-sample PIL augmentation of main_pretrain.py on the same crops
+# and flips, and compare their throughput, e.g.
+#   python3 tools/check_batched_augmentation.py --data_path ./data/coco/train --use_byol_crop
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.batched_aug import SampleCrop, BatchedResizeFlipNormalize, collate_crops  # noqa: E402
+from util.crop import RandomResizedCrop as BYOLRandomResizedCrop  # noqa: E402
+from util.datasets import CompactImageFolder  # noqa: E402
+
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def main():
+    parser = argparse.ArgumentParser("Batched vs. per-sample pretraining augmentation check")
+    parser.add_argument("--data_path", required=True, type=str, help="an image folder")
+    parser.add_argument("--input_size", default=448, type=int)
+    parser.add_argument("--min_crop", default=0.2, type=float)
+    parser.add_argument("--max_crop", default=1.0, type=float)
+    parser.add_argument("--use_byol_crop", action="store_true")
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--num_batches", default=4, type=int)
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--max_diff", default=2., type=float,
+                        help="max allowed difference (in uint8 pixel levels) between the two pipelines "
+                             "(PIL rounds its fixed-point coefficients, which can flip the rounding of a pass)")
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    crop_cls = BYOLRandomResizedCrop if args.use_byol_crop else transforms.RandomResizedCrop
+    scale = (args.min_crop, args.max_crop)
+    per_sample = transforms.Compose([
+        crop_cls(args.input_size, scale=scale, interpolation=3),
+        transforms.RandomHorizontalFlip(),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=MEAN, std=STD),
+    ])
+    sample_crop = SampleCrop(scale=scale, crop_cls=crop_cls)
+    batch_transform = BatchedResizeFlipNormalize(args.input_size, mean=MEAN, std=STD)
+
+    dataset = CompactImageFolder.from_image_folder(args.data_path)
+    indices = np.random.RandomState(args.seed).randint(0, len(dataset), size=args.batch_size * args.num_batches)
+    images = [dataset.load_image(int(i)) for i in indices]
+    std = torch.tensor(STD, device=device).view(1, 3, 1, 1)
+
+    per_sample_s, worker_s, batched_s, diffs = 0., 0., 0., []
+    for b in range(args.num_batches):
+        batch_images = images[b * args.batch_size:(b + 1) * args.batch_size]
+        torch.manual_seed(args.seed + b)  # the same crops and flips in both pipelines
+        start_time = time.time()
+        expected = torch.stack([per_sample(img) for img in batch_images]).to(device)
+        per_sample_s += time.time() - start_time
+
+        torch.manual_seed(args.seed + b)
+        start_time = time.time()
+        imgs, boxes, flips = collate_crops([sample_crop(img) for img in batch_images])
+        worker_s += time.time() - start_time
+        start_time = time.time()
+        output = batch_transform(imgs.to(device), boxes, flips)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        batched_s += time.time() - start_time
+        diffs.append(((output - expected) * std * 255).abs().flatten().cpu())
+
+    diffs = torch.cat(diffs)
+    num_samples = len(images)
+    results = {
+        "num_samples": num_samples,
+        "max_diff": diffs.max().item(),
+        "mean_diff": diffs.mean().item(),
+        "frac_pixels_diff": (diffs > 0.5).float().mean().item(),
+        "per_sample_samples_per_s": num_samples / per_sample_s,
+        "worker_samples_per_s": num_samples / worker_s,
+        "batched_samples_per_s": num_samples / batched_s,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    assert results["max_diff"] <= args.max_diff + 1e-3, \
+        f"batched augmentation differs by {results['max_diff']:.2f} pixel levels"
+    print("batched augmentation matches the per-sample augmentation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Check that the cached eval set (util/eval_cache.py, --eval_cache_dir) returns
+# exactly the samples of the eval transform of main_finetune.py, and compare the
+# throughput of an eval pass with and without the cache, e.g.
+#   python3 tools/check_eval_cache.py --data_path ./data/imagenet/val --cache_dir /dev/shm/eval_cache
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.datasets import build_transform, build_image_folder  # noqa: E402
+from util.eval_cache import CachedEvalDataset  # noqa: E402
+
+
+def loader_samples_per_s(dataset, args):
+    loader = torch.utils.data.DataLoader(
+        dataset, batch_size=args.batch_size, num_workers=args.num_workers, shuffle=False
+    )
+    start_time = time.time()
+    for _ in loader:
+        pass
+    return len(dataset) / (time.time() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser("Cached eval set check")
+    parser.add_argument("--data_path", required=True, type=str, help="an image folder")
+    parser.add_argument("--cache_dir", required=True, type=str)
+    parser.add_argument("--input_size", default=224, type=int)
+    parser.add_argument("--batch_size", default=64, type=int)
+    parser.add_argument("--num_workers", default=8, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    dataset = build_image_folder(args.data_path, build_transform(False, args), args)
+    start_time = time.time()
+    cached = CachedEvalDataset(dataset, args.cache_dir, num_workers=args.num_workers)
+    build_s = time.time() - start_time
+    print(cached)
+
+    assert len(cached) == len(dataset)
+    for i in range(len(dataset)):
+        img, target = dataset[i]
+        cached_img, cached_target = cached[i]
+        assert target == cached_target, f"sample {i}: label {cached_target} != {target}"
+        assert torch.equal(img, cached_img), f"sample {i}: the cached image differs"
+
+    results = {
+        "num_samples": len(dataset),
+        "cache_gb": os.path.getsize(cached.images_path) / 1024 ** 3,
+        "build_or_load_s": build_s,
+        "uncached_samples_per_s": loader_samples_per_s(dataset, args),
+        "cached_samples_per_s": loader_samples_per_s(cached, args),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print("the cached eval set matches the eval transform")
+
+
+if __name__ == "__main__":
+    main()
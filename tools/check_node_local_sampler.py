@@ -0,0 +1,108 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Check the per-epoch coverage guarantee of NodeLocalDistributedSampler
+# (util/samplers.py) by simulating all ranks, and report how stable the
+# subset of each node is across epochs, e.g.
+#   python3 tools/check_node_local_sampler.py --dataset_size 100003 --num_nodes 4 --ranks_per_node 8
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.samplers import NodeLocalDistributedSampler  # noqa: E402
+
+
+def check(dataset_sizes, repeat_factors, num_nodes, ranks_per_node, exchange_fraction, drop_last, num_epochs):
+    datasets = [torch.utils.data.TensorDataset(torch.zeros(n)) for n in dataset_sizes]
+    dataset = torch.utils.data.ConcatDataset(datasets)
+    world_size = num_nodes * ranks_per_node
+    samplers = [
+        NodeLocalDistributedSampler(dataset, repeat_factors, num_replicas=world_size, rank=r,
+                                    ranks_per_node=ranks_per_node, exchange_fraction=exchange_fraction,
+                                    drop_last=drop_last)
+        for r in range(world_size)
+    ]
+    epoch_size = samplers[0].epoch_size
+    home_nodes = torch.cat([torch.arange(n) % num_nodes for n in dataset_sizes]).tolist()
+    previous, stats = None, {"overlap_with_previous_epoch": [], "home_fraction": []}
+    for epoch in range(num_epochs):
+        node_sets, counts = [set() for _ in range(num_nodes)], Counter()
+        for r, sampler in enumerate(samplers):
+            sampler.set_epoch(epoch)
+            indices = list(sampler)
+            assert len(indices) == len(sampler) == samplers[0].num_samples
+            node_sets[r // ranks_per_node].update(indices)
+            counts.update(indices)
+
+        # coverage: every sample is visited `repeat` times (up to the padding or dropping of each node)
+        num_visits = sum(counts.values())
+        offset = 0
+        for n, r in zip(dataset_sizes, repeat_factors):
+            if r >= 1 and r == int(r):
+                expected = int(r)
+                low = sum(1 for i in range(offset, offset + n) if counts[i] < expected)
+                high = sum(counts[i] - expected for i in range(offset, offset + n) if counts[i] > expected)
+                if drop_last:
+                    assert high == 0 and low < world_size, (epoch, low, high)
+                else:
+                    assert low == 0 and high < world_size, (epoch, low, high)
+            offset += n
+        assert abs(num_visits - epoch_size) < world_size
+
+        # locality: the fraction of the samples of each node that are home samples of the node
+        num_home = sum(sum(1 for i in s if home_nodes[i] == node) for node, s in enumerate(node_sets))
+        stats["home_fraction"].append(num_home / max(1, sum(len(s) for s in node_sets)))
+        if previous is not None:
+            overlap = sum(len(a & b) for a, b in zip(node_sets, previous)) / max(1, sum(len(s) for s in node_sets))
+            stats["overlap_with_previous_epoch"].append(overlap)
+        previous = node_sets
+    return {
+        "epoch_size": epoch_size,
+        "samples_per_rank": samplers[0].num_samples,
+        "mean_home_fraction": sum(stats["home_fraction"]) / len(stats["home_fraction"]),
+        "mean_overlap_with_previous_epoch": (sum(stats["overlap_with_previous_epoch"])
+                                             / max(1, len(stats["overlap_with_previous_epoch"]))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser("NodeLocalDistributedSampler check")
+    parser.add_argument("--dataset_size", default=10007, type=int)
+    parser.add_argument("--num_nodes", default=4, type=int)
+    parser.add_argument("--ranks_per_node", default=8, type=int)
+    parser.add_argument("--exchange_fraction", default=0.1, type=float)
+    parser.add_argument("--num_epochs", default=3, type=int)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    results = {}
+    configs = [
+        ("single_source", [args.dataset_size], [1.]),
+        ("repeated_sources", [args.dataset_size, args.dataset_size // 3 + 1], [1., 5.]),
+        ("fractional_repeat", [args.dataset_size], [0.25]),
+    ]
+    for name, sizes, repeats in configs:
+        for drop_last in (False, True):
+            key = f"{name}{'_drop_last' if drop_last else ''}"
+            results[key] = check(sizes, repeats, args.num_nodes, args.ranks_per_node, args.exchange_fraction,
+                                 drop_last, args.num_epochs)
+            print(key, json.dumps(results[key]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    print("all coverage checks passed")
+
+
+if __name__ == "__main__":
+    main()
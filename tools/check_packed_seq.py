@@ -0,0 +1,116 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Check that the packed variable-length encoder (util/packed_seq.py,
+# --mask_ratio_range) gives the same loss and predictions as the dense encoder
+# for the same masks, and time a training step of a batch with per-sample mask
+# ratios in [LOW, HIGH], packed, against the dense encoder at mask ratio LOW
+# (i.e. padding every sample to the longest one), e.g.
+#   python3 tools/check_packed_seq.py --input_size 448 --mask_ratio_range 0.6 0.9 --device cuda
+# --------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_pretrain  # noqa: E402
+import models_mae  # noqa: E402
+
+
+def build_model(args, mask_ratio, mask_ratio_range, no_k_bias_in_vit=False):
+    argv = ["--mask_ratio", str(mask_ratio)]
+    if mask_ratio_range is not None:
+        argv += ["--mask_ratio_range"] + [str(r) for r in mask_ratio_range]
+    if no_k_bias_in_vit:
+        argv.append("--no_k_bias_in_vit")
+    model_args = main_pretrain.get_args_parser().parse_args(argv)
+    torch.manual_seed(0)
+    model = models_mae.MaskedAutoencoderViT(
+        model_args, img_size=args.input_size, patch_size=args.patch_size, embed_dim=args.embed_dim,
+        depth=args.depth, num_heads=args.embed_dim // 64, decoder_embed_dim=256, decoder_depth=2,
+        decoder_num_heads=8, norm_pix_loss=True,
+    )
+    return model.to(args.device)
+
+
+def check_equivalence(args, no_k_bias_in_vit):
+    model = build_model(args, args.mask_ratio_range[0], [args.mask_ratio_range[0]] * 2, no_k_bias_in_vit).eval()
+    imgs = torch.randn(4, 3, args.input_size, args.input_size, device=args.device)
+    model.mask_sampler.manual_seed(0)
+    ids_shuffle, len_keep = model.mask_sampler.sample_variable(4, imgs.device, model.args.mask_ratio_range)
+    model.mask_sampler.manual_seed(0)
+    with torch.no_grad():
+        loss, pred, mask = model(imgs)
+        model.args.mask_ratio_range = None
+        num_keep = int(len_keep[0])
+        dense_loss, dense_pred, dense_mask = model(imgs, ids_shuffle[:, :num_keep], ids_shuffle.argsort(dim=1))
+    assert torch.equal(mask, dense_mask), "the packed and dense masks differ"
+    max_diff = (pred - dense_pred).abs().max().item()
+    assert max_diff < 1e-4, f"the packed and dense predictions differ by {max_diff}"
+    print("no_k_bias_in_vit={}: loss {:.6f} (packed) vs {:.6f} (dense), max pred diff {:.2e}".format(
+        no_k_bias_in_vit, loss.item(), dense_loss.item(), max_diff))
+
+
+def step_s(model, args):
+    imgs = torch.randn(args.batch_size, 3, args.input_size, args.input_size, device=args.device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+
+    def step():
+        with torch.cuda.amp.autocast(enabled=args.device.type == "cuda"):
+            loss, _, _ = model(imgs)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    for _ in range(2):
+        step()
+    if args.device.type == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    for _ in range(args.num_iters):
+        step()
+    if args.device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start_time) / args.num_iters
+
+
+def main():
+    parser = argparse.ArgumentParser("Packed variable-length encoder check")
+    parser.add_argument("--input_size", default=224, type=int)
+    parser.add_argument("--patch_size", default=16, type=int)
+    parser.add_argument("--embed_dim", default=384, type=int)
+    parser.add_argument("--depth", default=6, type=int)
+    parser.add_argument("--mask_ratio_range", default=[0.6, 0.9], type=float, nargs=2)
+    parser.add_argument("--batch_size", default=32, type=int)
+    parser.add_argument("--num_iters", default=5, type=int)
+    parser.add_argument("--device", default="cpu", type=torch.device)
+    parser.add_argument("--output", default="", type=str, help="save the results as json")
+    args = parser.parse_args()
+
+    for no_k_bias_in_vit in [False, True]:
+        check_equivalence(args, no_k_bias_in_vit)
+
+    low, high = args.mask_ratio_range
+    packed_s = step_s(build_model(args, low, args.mask_ratio_range).train(), args)
+    padded_s = step_s(build_model(args, low, None).train(), args)
+    results = {
+        "mask_ratio_range": args.mask_ratio_range, "input_size": args.input_size, "batch_size": args.batch_size,
+        "packed_samples_per_s": args.batch_size / packed_s, "padded_samples_per_s": args.batch_size / padded_s,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
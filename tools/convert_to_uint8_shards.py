@@ -0,0 +1,80 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Convert an image folder into pre-decoded uint8 shards (see util/uint8_shards.py), e.g.
+#   python3 tools/convert_to_uint8_shards.py \
+#     --data_path ./data/imagenet-1k/train --output_dir ./data/imagenet-1k-u8/train
+# --------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.manifest import FileManifest  # noqa: E402
+from util.uint8_shards import Uint8ShardWriter  # noqa: E402
+
+
+def decode_and_cap(path, max_short_side):
+    with open(path, "rb") as f:
+        img = Image.open(f)
+        img = img.convert("RGB")
+    w, h = img.size
+    if max_short_side > 0 and min(w, h) > max_short_side:
+        scale = max_short_side / min(w, h)
+        img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.BICUBIC)
+    return np.asarray(img, dtype=np.uint8)
+
+
+def _decode_job(job):
+    path, max_short_side = job
+    return decode_and_cap(path, max_short_side)
+
+
+def main():
+    parser = argparse.ArgumentParser("Convert an image folder into pre-decoded uint8 shards")
+    parser.add_argument("--data_path", required=True, type=str, help="the image folder to convert")
+    parser.add_argument("--output_dir", required=True, type=str, help="where to write the shards")
+    parser.add_argument("--unlabeled_data", action="store_true",
+                        help="treat data_path as a flat folder of unlabeled images")
+    parser.add_argument("--max_short_side", default=-1, type=int,
+                        help="downscale images whose short side is larger than this (-1: no capping, the default). "
+                             "A cap trades quality for size: a small-scale random resized crop of a capped image "
+                             "covers fewer pixels than the same crop of the full-resolution JPEG and is upsampled "
+                             "more; crops of scale >= min_crop (and aspect ratio >= 3/4) keep at least input_size "
+                             "pixels if the cap is >= input_size / sqrt(min_crop * 3/4), e.g. 1157 for 448 and 0.2")
+    parser.add_argument("--shard_size_gb", default=4., type=float)
+    parser.add_argument("--num_workers", default=16, type=int)
+    args = parser.parse_args()
+
+    manifest = FileManifest.scan(args.data_path, labeled=not args.unlabeled_data)
+    print(f"converting {len(manifest)} images from {args.data_path}")
+    writer = Uint8ShardWriter(
+        args.output_dir, shard_size=int(args.shard_size_gb * 1024 ** 3), classes=manifest.classes
+    )
+    jobs = ((manifest.path(i), args.max_short_side) for i in range(len(manifest)))
+    start_time = time.time()
+    total_bytes = 0
+    with Pool(args.num_workers) as pool:
+        for i, arr in enumerate(pool.imap(_decode_job, jobs, chunksize=64)):
+            writer.write(arr, int(manifest.labels[i]))
+            total_bytes += arr.nbytes
+            if (i + 1) % 10000 == 0:
+                print(f"{i + 1} / {len(manifest)} images, {total_bytes / 1024 ** 3:.1f} GB, "
+                      f"{time.time() - start_time:.0f} s")
+    writer.close()
+    print(f"wrote {len(manifest)} images ({total_bytes / 1024 ** 3:.1f} GB) "
+          f"in {writer.shard_id + 1} shards to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
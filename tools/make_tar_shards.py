@@ -0,0 +1,59 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+# --------------------------------------------------------
+# Pack an image folder into tar shards for streaming (see util/tar_shards.py), e.g.
+#   python3 tools/make_tar_shards.py \
+#     --data_path ./data/imagenet-1k/train --output_dir ./data/imagenet-1k-tar/train
+# --------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util.manifest import FileManifest  # noqa: E402
+from util.tar_shards import TarShardWriter  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser("Pack an image folder into tar shards")
+    parser.add_argument("--data_path", required=True, type=str, help="the image folder to pack")
+    parser.add_argument("--output_dir", required=True, type=str, help="where to write the shards")
+    parser.add_argument("--unlabeled_data", action="store_true",
+                        help="treat data_path as a flat folder of unlabeled images")
+    parser.add_argument("--samples_per_shard", default=10000, type=int)
+    parser.add_argument("--no_shuffle", action="store_false", dest="shuffle",
+                        help="keep the folder order (by default the samples are shuffled once before packing, "
+                             "so that each shard is a random subset and the streaming shuffle buffer can be small)")
+    parser.set_defaults(shuffle=True)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    manifest = FileManifest.scan(args.data_path, labeled=not args.unlabeled_data)
+    order = np.arange(len(manifest))
+    if args.shuffle:
+        np.random.RandomState(args.seed).shuffle(order)
+    print(f"packing {len(manifest)} images from {args.data_path}")
+
+    writer = TarShardWriter(args.output_dir, args.samples_per_shard, classes=manifest.classes)
+    start_time = time.time()
+    for n, i in enumerate(order):
+        path = manifest.path(i)
+        ext = os.path.splitext(path)[1][1:].lower()
+        with open(path, "rb") as f:
+            writer.write(f.read(), int(manifest.labels[i]), ext=ext)
+        if (n + 1) % 10000 == 0:
+            print(f"{n + 1} / {len(manifest)} images, {time.time() - start_time:.0f} s")
+    writer.close()
+    print(f"wrote {writer.num_samples} images in {len(writer.shards)} shards to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
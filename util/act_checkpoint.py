@@ -0,0 +1,55 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Selective activation checkpointing of the ViT blocks (--act_checkpoint): the
+# selected blocks (or only their attention) don't keep their activations for
+# the backward pass and recompute them instead, trading compute for memory.
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+
+ACT_CHECKPOINT_POLICIES = ["none", "all", "encoder", "decoder", "attn"]
+
+
+def set_activation_checkpointing(blocks, mode, every=1):
+    """Checkpoint every `every`-th block of `blocks` (starting with the first): `mode` is "block", "attn" or None."""
+    for i, blk in enumerate(blocks):
+        blk.act_checkpoint = mode if i % every == 0 else None
+
+
+def apply_checkpoint_policy(policy, encoder_blocks, decoder_blocks=(), every=1):
+    """
+    Apply an --act_checkpoint policy: recompute the whole blocks of the encoder
+    and the decoder ("all"), of the encoder or the decoder only, or only the
+    attention (with its L x L attention matrix) of all blocks ("attn").
+    """
+    assert policy in ACT_CHECKPOINT_POLICIES
+    for name, blocks in [("encoder", encoder_blocks), ("decoder", decoder_blocks)]:
+        if policy == "attn":
+            mode = "attn"
+        elif policy in ["all", name]:
+            mode = "block"
+        else:
+            mode = None
+        set_activation_checkpointing(blocks, mode, every)
+
+
+def maybe_checkpoint(blk, part, fn, *args):
+    """`fn(*args)`, recomputed in the backward pass if `part` ("block" or "attn") of `blk` is checkpointed."""
+    if getattr(blk, "act_checkpoint", None) == part and torch.is_grad_enabled():
+        # the non-reentrant variant restores the RNG (drop path) and autocast states and works with DDP
+        return checkpoint(fn, *args, use_reentrant=False)
+    return fn(*args)
+
+
+def block_forward(blk, x):
+    """A timm `Block` with its activation checkpointing."""
+    if getattr(blk, "act_checkpoint", None) == "attn":
+        x = x + blk.drop_path(maybe_checkpoint(blk, "attn", lambda y: blk.attn(blk.norm1(y)), x))
+        x = x + blk.drop_path(blk.mlp(blk.norm2(x)))
+        return x
+    return maybe_checkpoint(blk, "block", blk, x)
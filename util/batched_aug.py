@@ -0,0 +1,168 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Batched pretraining augmentation: the DataLoader workers only decode the
+# images and sample the crop boxes and flips of the random resized crops
+# (`SampleCrop`), and the crop, resize, flip and normalization of the whole
+# batch run as tensor ops on the training device (`BatchedResizeFlipNormalize`).
+
+import math
+
+import numpy as np
+import torch
+from torchvision import transforms
+
+from util.crop import get_crop_params_from_size
+
+
+class SampleCrop:
+    """
+    Sample a random resized crop box (with `crop_cls.get_params`) and a
+    horizontal flip of a PIL image or HWC uint8 array, and return the uint8
+    image (not cropped), the box (top, left, height, width) and the flip. The
+    random numbers are drawn in the same order as in
+    `Compose([crop_cls(...), RandomHorizontalFlip()])`.
+
+    Repeated calls on the same image (repeated augmentation) return the same
+    uint8 tensor, so that the collator sends the image only once.
+    """
+    def __init__(self, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.), crop_cls=transforms.RandomResizedCrop):
+        self.scale = scale
+        self.ratio = ratio
+        self.crop_cls = crop_cls
+        self._last = (None, None)  # the last image and its uint8 tensor
+
+    def __call__(self, img):
+        if isinstance(img, np.ndarray):
+            height, width = img.shape[:2]
+        else:
+            width, height = img.size
+        i, j, h, w = get_crop_params_from_size(self.crop_cls, width, height, self.scale, self.ratio)
+        flip = bool(torch.rand(1) < 0.5)
+        if self._last[0] is not img:
+            pixels = np.array(img) if isinstance(img, np.ndarray) else np.array(img.convert("RGB"))
+            self._last = (img, torch.from_numpy(pixels))
+        return {"img": self._last[1], "box": (i, j, h, w), "flip": flip}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_last"] = (None, None)
+        return state
+
+    def __repr__(self):
+        return "{}(scale={}, ratio={}, crop_cls={})".format(
+            self.__class__.__name__, self.scale, self.ratio, self.crop_cls.__name__
+        )
+
+
+def collate_crops(samples):
+    """
+    Collate the samples of `SampleCrop` into (imgs, boxes, flips): the distinct
+    (h, w, 3) uint8 images zero-padded into one (M, H_max, W_max, 3) batch, and
+    for each of the N samples its (N, 5) int32 box (the index of its image in
+    `imgs`, top, left, height, width) and its (N,) flip.
+    """
+    images, boxes = [], []
+    for s in samples:
+        if not images or s["img"] is not images[-1]:  # the repeated crops of an image are consecutive
+            images.append(s["img"])
+        boxes.append((len(images) - 1,) + tuple(s["box"]))
+    h_max = max(img.size(0) for img in images)
+    w_max = max(img.size(1) for img in images)
+    batch = torch.zeros(len(images), h_max, w_max, 3, dtype=torch.uint8)
+    for b, img in zip(batch, images):
+        b[:img.size(0), :img.size(1)] = img
+    boxes = torch.tensor(boxes, dtype=torch.int32)
+    flips = torch.tensor([s["flip"] for s in samples], dtype=torch.bool)
+    return batch, boxes, flips
+
+
+def _bicubic_filter(x, a=-0.5):
+    # the bicubic kernel of PIL's resampling
+    x = x.abs()
+    near = ((a + 2) * x - (a + 3)) * x * x + 1
+    far = (((x - 5) * x + 8) * x - 4) * a
+    return torch.where(x < 1, near, torch.where(x < 2, far, torch.zeros_like(x)))
+
+
+def resample_taps(in_sizes, out_size):
+    """
+    The filter taps of PIL's antialiased bicubic resampling (`Image.resize`) of
+    N inputs of `in_sizes` pixels to `out_size` pixels along one axis: the
+    (N, out_size, K) input positions and weights of each output pixel.
+    """
+    in_sizes = in_sizes.to(torch.float64)
+    scale = in_sizes / out_size
+    filter_scale = scale.clamp(min=1.)
+    support = 2. * filter_scale  # the bicubic kernel has a support of 2
+    num_taps = int(math.ceil(support.max().item())) * 2 + 1
+    device = in_sizes.device
+    centers = (torch.arange(out_size, device=device, dtype=torch.float64) + 0.5)[None] * scale[:, None]
+    first = (centers - support[:, None] + 0.5).floor().clamp(min=0)
+    positions = first[..., None] + torch.arange(num_taps, device=device, dtype=torch.float64)
+    weights = _bicubic_filter((positions - centers[..., None] + 0.5) / filter_scale[:, None, None])
+    weights = weights * (positions < in_sizes[:, None, None])
+    weights = weights / weights.sum(dim=-1, keepdim=True)
+    positions = torch.minimum(positions, (in_sizes - 1)[:, None, None])  # zero weight beyond the input
+    return positions.long(), weights.float()
+
+
+def resample_matrices(in_sizes, offsets, in_length, out_size):
+    """
+    The (N, out_size, in_length) matrices of PIL's antialiased bicubic
+    resampling of the N ranges [offset, offset + in_size) of inputs of
+    `in_length` pixels to `out_size` pixels along one axis (one row of filter
+    taps per output pixel, zero outside the range).
+    """
+    positions, weights = resample_taps(in_sizes, out_size)
+    matrices = torch.zeros(in_sizes.size(0), out_size, in_length, device=in_sizes.device)
+    return matrices.scatter_add_(2, positions + offsets.long()[:, None, None], weights)
+
+
+def _round_uint8(x):
+    # like PIL, round (half up) and clip to uint8 values after each pass
+    return (x + 0.5).floor().clamp(0, 255)
+
+
+class BatchedResizeFlipNormalize:
+    """
+    Crop the `boxes` of a batch of zero-padded uint8 images, resize them to
+    `size` x `size` with PIL's antialiased bicubic resampling, flip the ones in
+    `flips` horizontally and normalize them, on the device of the images.
+
+    The crop, resize and flip of each axis are one (size x length) resampling
+    matrix per sample, so the whole batch takes two batched matrix products.
+    Like PIL, the horizontal pass runs first and both passes round to uint8
+    values, so the output matches `Compose([RandomResizedCrop(size,
+    interpolation=3), RandomHorizontalFlip(), ToTensor(), Normalize(mean,
+    std)])` up to PIL's fixed-point rounding. The dense matrices take
+    O(size * (H + W)) multiply-adds per output row instead of the few filter
+    taps of PIL, which GPUs run at a small fraction of a training step, but on
+    CPU this is no faster than the per-sample PIL augmentation.
+    """
+    def __init__(self, size, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        self.size = size
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, imgs, boxes, flips):
+        boxes = boxes.to(imgs.device)
+        N, (_, H, W, _) = boxes.size(0), imgs.shape
+        weights_y = resample_matrices(boxes[:, 3], boxes[:, 1], H, self.size)  # (N, size, H)
+        weights_x = resample_matrices(boxes[:, 4], boxes[:, 2], W, self.size)  # (N, size, W)
+        # a horizontal flip reverses the order of the output columns
+        weights_x = torch.where(flips.to(imgs.device)[:, None, None], weights_x.flip(1), weights_x)
+
+        x = imgs.index_select(0, boxes[:, 0].long()).permute(0, 3, 1, 2).float()  # (N, 3, H, W)
+        x = _round_uint8(torch.bmm(x.reshape(N, 3 * H, W), weights_x.transpose(1, 2)))  # (N, 3 * H, size)
+        x = _round_uint8(torch.matmul(weights_y[:, None], x.view(N, 3, H, self.size)))  # (N, 3, size, size)
+        x = x.div_(255.)
+        mean = torch.tensor(self.mean, device=x.device).view(1, 3, 1, 1)
+        std = torch.tensor(self.std, device=x.device).view(1, 3, 1, 1)
+        return x.sub_(mean).div_(std)
+
+    def __repr__(self):
+        return "{}(size={}, mean={}, std={})".format(self.__class__.__name__, self.size, self.mean, self.std)
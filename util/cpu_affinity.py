@@ -0,0 +1,112 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# CPU thread and core-affinity layout of each rank (--cpu_affinity): the cores
+# visible to a rank are split between its main process (intra-op threads and
+# the pin-memory thread, at least MIN_MAIN_CPUS cores) and its DataLoader
+# workers (one core each), so that they don't oversubscribe the same cores.
+
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+
+
+# the layout of this rank, set by `configure_cpu_affinity` and read by the
+# (forked) DataLoader workers in `worker_init_fn`
+CPU_LAYOUT = {}
+
+# the cores kept by the main process (its intra-op threads and the pin-memory thread)
+MIN_MAIN_CPUS = 2
+
+
+def visible_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def _set_affinity(cpus):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def plan_cpu_layout(cpus, num_workers):
+    """
+    Split `cpus` into the cores of the main process and one core per DataLoader
+    worker: the workers get the last cores and the main process keeps the rest
+    (at least `MIN_MAIN_CPUS` cores). With fewer cores than workers +
+    `MIN_MAIN_CPUS`, the workers share the cores left by the main process
+    round-robin (or all cores, if there are none left).
+    """
+    cpus = list(cpus)
+    num_main = max(min(MIN_MAIN_CPUS, len(cpus)), len(cpus) - num_workers)
+    if num_workers == 0 or num_main == len(cpus):
+        return cpus, [cpus] * num_workers
+    main_cpus, worker_pool = cpus[:num_main], cpus[num_main:]
+    worker_cpus = [[worker_pool[i % len(worker_pool)]] for i in range(num_workers)]
+    return main_cpus, worker_cpus
+
+
+def _format_cpus(cpus):
+    # e.g. "0-3,8,10-11"
+    ranges, start = [], None
+    for i, c in enumerate(cpus):
+        if start is None:
+            start = c
+        if i + 1 == len(cpus) or cpus[i + 1] != c + 1:
+            ranges.append(str(start) if start == c else "{}-{}".format(start, c))
+            start = None
+    return ",".join(ranges)
+
+
+def configure_cpu_affinity(num_workers, rank=0):
+    """
+    Set the core affinity and the number of intra-op threads of this rank, and
+    record the cores of its DataLoader workers (see `worker_init_fn`).
+
+    Ranks on the same host that see the same cores (e.g. with torchrun, or a
+    launcher that doesn't bind tasks to cores) split them into contiguous
+    chunks; ranks that already see their own cores (e.g. SLURM tasks bound with
+    `cpus_per_task`) use all of them.
+    """
+    cpus = visible_cpus()
+    key = (socket.gethostname(), tuple(cpus))
+    if dist.is_available() and dist.is_initialized():
+        keys = [None] * dist.get_world_size()
+        dist.all_gather_object(keys, key)
+        peers = [r for r, k in enumerate(keys) if k == key]
+    else:
+        peers = [rank]
+    num_peers, peer_index = len(peers), peers.index(rank)
+    if len(cpus) >= num_peers:
+        chunk = len(cpus) // num_peers
+        cpus = cpus[peer_index * chunk:(peer_index + 1) * chunk]
+
+    main_cpus, worker_cpus = plan_cpu_layout(cpus, num_workers)
+    _set_affinity(main_cpus)
+    torch.set_num_threads(len(main_cpus))
+    CPU_LAYOUT.update(rank_cpus=cpus, main_cpus=main_cpus, worker_cpus=worker_cpus)
+    print("cpu layout of rank {} on {}: cores {} ({} ranks sharing the visible cores), main process: cores {} "
+          "({} threads), {} DataLoader workers: cores {}".format(
+              rank, key[0], _format_cpus(cpus), num_peers, _format_cpus(main_cpus), len(main_cpus), num_workers,
+              " ".join(_format_cpus(c) for c in worker_cpus) or "-"), force=True)
+    if num_workers > 0 and len(cpus) < num_workers + MIN_MAIN_CPUS:
+        print("warning: rank {} has {} cores for {} DataLoader workers and the main process ({} cores), so the "
+              "workers share cores; use --num_workers {} or fewer for one core per worker".format(
+                  rank, len(cpus), num_workers, MIN_MAIN_CPUS, max(1, len(cpus) - MIN_MAIN_CPUS)), force=True)
+    return CPU_LAYOUT
+
+
+def worker_init_fn(worker_id):
+    """DataLoader `worker_init_fn` that pins each worker to its cores of `configure_cpu_affinity`."""
+    if not CPU_LAYOUT or not CPU_LAYOUT["worker_cpus"]:
+        return
+    worker_cpus = CPU_LAYOUT["worker_cpus"]
+    cpus = worker_cpus[worker_id % len(worker_cpus)]
+    _set_affinity(cpus)
+    torch.set_num_threads(len(cpus))
@@ -6,7 +6,9 @@
 
 import math
 
+import numpy as np
 import torch
+from PIL import Image
 
 from torchvision import transforms
 from torchvision.transforms import functional as F
@@ -45,4 +47,83 @@ class RandomResizedCrop(transforms.RandomResizedCrop):
         i = torch.randint(0, height - h + 1, size=(1,)).item()
         j = torch.randint(0, width - w + 1, size=(1,)).item()
 
-        return i, j, h, w
\ No newline at end of file
+        return i, j, h, w
+
+
+def get_crop_params_from_size(crop_cls, width, height, scale, ratio):
+    """
+    Sample the (i, j, h, w) crop parameters of `crop_cls` (torchvision's or the
+    BYOL RandomResizedCrop above) for an image of the given size, without the
+    image. `get_params` only reads the image size, so we pass it an empty
+    tensor expanded (without allocating memory) to the image shape, and the
+    sampled crops follow exactly the same distribution.
+    """
+    img = torch.empty(1).expand(3, height, width)
+    return crop_cls.get_params(img, scale, ratio)
+
+
+class ArrayRandomResizedCrop:
+    """
+    RandomResizedCrop on an HWC uint8 numpy array (e.g. a view of a memory-mapped
+    shard). Only the crop region is copied out of the array before resizing.
+    """
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.),
+                 interpolation=Image.BICUBIC, crop_cls=transforms.RandomResizedCrop):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.interpolation = interpolation
+        self.crop_cls = crop_cls
+
+    def __call__(self, arr):
+        height, width = arr.shape[:2]
+        i, j, h, w = get_crop_params_from_size(self.crop_cls, width, height, self.scale, self.ratio)
+        crop = Image.fromarray(np.ascontiguousarray(arr[i:i + h, j:j + w]))
+        return crop.resize((self.size, self.size), self.interpolation)
+
+    def __repr__(self):
+        return "{}(size={}, scale={}, ratio={}, crop_cls={})".format(
+            self.__class__.__name__, self.size, self.scale, self.ratio, self.crop_cls.__name__
+        )
+
+
+class DraftRandomResizedCrop:
+    """
+    RandomResizedCrop of a lazily opened PIL image (`Image.open` without loading
+    it) that decodes JPEG images at a reduced resolution when possible.
+
+    The crop is sampled first from the image size in the header (with
+    `crop_cls.get_params`, so the crops follow exactly the same distribution),
+    and the JPEG is then decoded with the largest DCT scaling (1/2, 1/4 or 1/8,
+    see `Image.draft`) that keeps the crop at least as large as the output, i.e.
+    the crop is still only downscaled. Other images are decoded at full size.
+    """
+    def __init__(self, size, scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.),
+                 interpolation=Image.BICUBIC, crop_cls=transforms.RandomResizedCrop):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+        self.interpolation = interpolation
+        self.crop_cls = crop_cls
+
+    def __call__(self, img):
+        width, height = img.size
+        i, j, h, w = get_crop_params_from_size(self.crop_cls, width, height, self.scale, self.ratio)
+        reduce = 1
+        while reduce < 8 and min(h, w) // (2 * reduce) >= self.size:
+            reduce *= 2
+        if reduce > 1 and img.format == "JPEG":
+            img.draft("RGB", (width // reduce, height // reduce))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size == (width, height):
+            # same as F.resized_crop
+            return img.crop((j, i, j + w, i + h)).resize((self.size, self.size), self.interpolation)
+        sx, sy = img.width / width, img.height / height
+        box = (j * sx, i * sy, (j + w) * sx, (i + h) * sy)
+        return img.resize((self.size, self.size), self.interpolation, box=box)
+
+    def __repr__(self):
+        return "{}(size={}, scale={}, ratio={}, crop_cls={})".format(
+            self.__class__.__name__, self.size, self.scale, self.ratio, self.crop_cls.__name__
+        )
@@ -8,26 +8,230 @@
 # DeiT: https://github.com/facebookresearch/deit
 # --------------------------------------------------------
 
+import io
 import os
+import time
 import PIL
 
+import numpy as np
+import torch
 from torchvision import datasets, transforms
+from torchvision.datasets.folder import default_loader
 
 from timm.data import create_transform
 from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
 
+import util.misc as misc
+from util.decoded_cache import SharedDecodedImageCache
+from util.manifest import FileManifest, default_manifest_path, load_or_build_manifest, pack_strings
+from util.shm_store import SharedBytesStore
+from util.tar_shards import TarShardDataset
+from util.uint8_shards import Uint8ShardDataset
+
 
 def build_dataset(is_train, args):
     transform = build_transform(is_train, args)
 
     root = os.path.join(args.data_path, 'train' if is_train else 'val')
-    dataset = datasets.ImageFolder(root, transform=transform)
+    dataset = build_image_folder(root, transform, args)
 
     print(dataset)
 
     return dataset
 
 
+class CompactImageFolder(torch.utils.data.Dataset):
+    """
+    A drop-in replacement of `datasets.ImageFolder` whose file list is stored in
+    flat numpy arrays (path offsets + one utf-8 byte blob, and labels) instead
+    of a list of (str, int) tuples.
+
+    DataLoader workers are forked from the main process and share its memory
+    copy-on-write. Indexing into a Python list of tuples updates the refcounts
+    of the indexed objects, so each worker gradually copies the pages holding
+    `ImageFolder.samples`. Reading from a few numpy arrays touches no per-sample
+    Python objects, so these pages stay shared across all workers.
+    """
+    def __init__(self, root, classes, path_offsets, path_bytes, labels,
+                 transform=None, target_transform=None, loader=default_loader):
+        self.root = root
+        self.classes = classes
+        self.class_to_idx = {c: i for i, c in enumerate(classes)}
+        self.path_offsets = path_offsets
+        self.path_bytes = path_bytes
+        self.labels = labels
+        self.transform = transform
+        self.target_transform = target_transform
+        self.loader = loader
+        # optional in-memory store of the encoded image bytes (see `util.shm_store`)
+        self.byte_store = None
+        # optional host-wide cache of the decoded images (see `util.decoded_cache`), keyed by
+        # `decoded_cache_offset + index` (the index in a ConcatDataset of all data sources)
+        self.decoded_cache = None
+        self.decoded_cache_offset = 0
+        # return lazily opened (not yet decoded) images, e.g. for `util.crop.DraftRandomResizedCrop`
+        self.lazy_decode = False
+
+    @staticmethod
+    def from_manifest(manifest, **kwargs):
+        return CompactImageFolder(
+            manifest.root, manifest.classes, manifest.path_offsets, manifest.path_bytes,
+            manifest.labels, **kwargs
+        )
+
+    @staticmethod
+    def from_image_folder(root, **kwargs):
+        # walk the folder with `datasets.ImageFolder` (so that the samples are in
+        # exactly the same order) and pack its samples before dropping the list
+        image_folder = datasets.ImageFolder(root)
+        root = image_folder.root
+        rel_paths = [os.path.relpath(path, root) for path, _ in image_folder.samples]
+        path_offsets, path_bytes = pack_strings(rel_paths)
+        labels = np.array(image_folder.targets, dtype=np.int32)
+        return CompactImageFolder(
+            root, image_folder.classes, path_offsets, path_bytes, labels, **kwargs
+        )
+
+    def __len__(self):
+        return len(self.labels)
+
+    def path(self, index):
+        start, end = self.path_offsets[index], self.path_offsets[index + 1]
+        return os.path.join(self.root, self.path_bytes[start:end].tobytes().decode("utf-8"))
+
+    @property
+    def index_nbytes(self):
+        return self.path_offsets.nbytes + self.path_bytes.nbytes + self.labels.nbytes
+
+    def load_image(self, index):
+        if self.decoded_cache is None:
+            return self._read_image(index)
+        img = self.decoded_cache.get(self.decoded_cache_offset + index)
+        if img is None:
+            start_time = time.perf_counter_ns()
+            img = self._read_image(index)
+            self.decoded_cache.put(self.decoded_cache_offset + index, img, time.perf_counter_ns() - start_time)
+        return img
+
+    def _read_image(self, index):
+        if self.byte_store is not None:
+            data = self.byte_store.get(index)
+            if data is not None:
+                return pil_decode(data, lazy=self.lazy_decode)
+        if self.lazy_decode:
+            return PIL.Image.open(self.path(index))
+        return self.loader(self.path(index))
+
+    def __getitem__(self, index):
+        sample = self.load_image(index)
+        target = int(self.labels[index])
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, target
+
+    def __repr__(self):
+        lines = [
+            "Dataset " + self.__class__.__name__,
+            "    Number of datapoints: {}".format(len(self)),
+            "    Root location: {}".format(self.root),
+            "    Sample index size: {:.1f} MB".format(self.index_nbytes / 1024 ** 2),
+        ]
+        if self.byte_store is not None:
+            lines.append("    Shared-memory byte store: {:.2f} GB".format(self.byte_store.nbytes / 1024 ** 3))
+        if self.decoded_cache is not None:
+            lines.append("    Decoded image cache: {:.2f} GB".format(self.decoded_cache.budget_bytes / 1024 ** 3))
+        if self.transform is not None:
+            lines.append("    StandardTransform")
+            lines.append("Transform: " + repr(self.transform).replace("\n", "\n           "))
+        return "\n".join(lines)
+
+
+def pil_decode(data, lazy=False):
+    img = PIL.Image.open(io.BytesIO(data))
+    return img if lazy else img.convert('RGB')
+
+
+def build_image_folder(root, transform, args, decoded_cache=True):
+    """
+    Build an image folder dataset, by walking `root` with `datasets.ImageFolder`,
+    or as a `CompactImageFolder` (`--compact_index`), optionally loaded from a
+    persistent file manifest (`--use_manifest`). With `decoded_cache=False`, the
+    `--decoded_cache_gb` cache is attached later (see `attach_decoded_cache`).
+    """
+    labeled = not getattr(args, "unlabeled_data", False)
+    shm_store = getattr(args, "shm_store", "none")
+    decoded_cache_gb = getattr(args, "decoded_cache_gb", 0)
+    draft_decode = getattr(args, "draft_decode", False)
+    assert not (draft_decode and decoded_cache_gb > 0), "the decoded image cache needs fully decoded images"
+    if getattr(args, "use_manifest", False):
+        manifest_path = ""
+        if args.manifest_dir:
+            manifest_path = default_manifest_path(root, labeled, args.manifest_dir)
+        # the main process checks, (re)builds and writes the manifest (atomically), and
+        # the other ranks load it after the barrier instead of all scanning the folder
+        if misc.is_main_process():
+            manifest = load_or_build_manifest(root, labeled, manifest_path, check=args.manifest_check)
+        misc.barrier("manifest")
+        if not misc.is_main_process():
+            manifest = load_or_build_manifest(root, labeled, manifest_path, check="none", save=False)
+        dataset = CompactImageFolder.from_manifest(manifest, transform=transform)
+    elif not labeled:
+        # a flat folder of unlabeled images (not supported by `datasets.ImageFolder`)
+        dataset = CompactImageFolder.from_manifest(FileManifest.scan(root, labeled), transform=transform)
+    elif getattr(args, "compact_index", False) or shm_store != "none" or decoded_cache_gb > 0 or draft_decode:
+        dataset = CompactImageFolder.from_image_folder(root, transform=transform)
+    else:
+        return datasets.ImageFolder(root, transform=transform)
+
+    dataset.lazy_decode = draft_decode
+    if shm_store != "none":
+        dataset.byte_store = SharedBytesStore(
+            dataset.path, len(dataset), name=os.path.abspath(root), node_shard=(shm_store == "node_shard")
+        )
+    if decoded_cache:
+        attach_decoded_cache(dataset, args)
+    return dataset
+
+
+def attach_decoded_cache(dataset, args):
+    """
+    Attach one host-wide cache of decoded images of `--decoded_cache_gb` GB to an
+    image folder, or to all image folder sources of a ConcatDataset (keyed by the
+    index in the ConcatDataset), so that all data sources share the budget.
+    """
+    decoded_cache_gb = getattr(args, "decoded_cache_gb", 0)
+    if decoded_cache_gb <= 0:
+        return
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        sources = zip(dataset.datasets, [0] + dataset.cumulative_sizes[:-1])
+    else:
+        sources = [(dataset, 0)]
+    sources = [(d, offset) for d, offset in sources if isinstance(d, CompactImageFolder)]
+    if not sources:
+        return
+    decoded_cache = SharedDecodedImageCache(
+        len(dataset), int(decoded_cache_gb * 1024 ** 3), name=",".join(os.path.abspath(d.root) for d, _ in sources)
+    )
+    for d, offset in sources:
+        d.decoded_cache = decoded_cache
+        d.decoded_cache_offset = offset
+
+
+def build_pretrain_dataset(root, transform, args, decoded_cache=True):
+    """Build a pretraining dataset from an image folder, pre-decoded uint8 shards or tar shards."""
+    data_format = getattr(args, "data_format", "image_folder")
+    if data_format == "uint8_shards":
+        return Uint8ShardDataset(root, transform=transform)
+    if data_format == "tar_shards":
+        return TarShardDataset(
+            root, transform=transform, batch_size=args.batch_size, shuffle_buffer=args.shuffle_buffer,
+            num_replicas=misc.get_world_size(), rank=misc.get_rank(), seed=args.seed,
+        )
+    return build_image_folder(root, transform, args, decoded_cache=decoded_cache)
+
+
 def build_transform(is_train, args):
     mean = IMAGENET_DEFAULT_MEAN
     std = IMAGENET_DEFAULT_STD
@@ -63,3 +267,22 @@ def build_transform(is_train, args):
     t.append(transforms.ToTensor())
     t.append(transforms.Normalize(mean, std))
     return transforms.Compose(t)
+
+
+def get_data_stats(dataset):
+    """Collect the stats (e.g. cache hit rates) of a dataset or of all sources of a ConcatDataset."""
+    datasets_ = dataset.datasets if isinstance(dataset, torch.utils.data.ConcatDataset) else [dataset]
+    stats = {}
+    stores = []
+    for d in datasets_:
+        for store in (getattr(d, "byte_store", None), getattr(d, "decoded_cache", None)):
+            # the decoded image cache is shared by all sources
+            if store is not None and not any(store is s for s in stores):
+                stores.append(store)
+                for k, v in store.stats().items():
+                    stats[k] = stats.get(k, 0) + v
+    for prefix in ("shm_store", "decoded_cache"):
+        if prefix + "_hits" in stats:
+            total = max(1., stats[prefix + "_hits"] + stats[prefix + "_misses"])
+            stats[prefix + "_hit_rate"] = stats[prefix + "_hits"] / total
+    return stats
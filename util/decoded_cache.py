@@ -0,0 +1,200 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import atexit
+import fcntl
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import util.misc as misc
+from util.shm_store import SHM_DIR, WorkerCounters, shm_key
+
+
+# header fields of the shared cache state
+_HEAD, _QUEUE_HEAD, _QUEUE_TAIL, _EVICTIONS, _NUM_HEADER = 0, 1, 2, 3, 8
+
+
+class SharedDecodedImageCache:
+    """
+    A host-wide cache of decoded RGB images (keyed by sample index) in shared
+    memory, shared by all ranks and DataLoader workers on a host.
+
+    The decoded pixels are stored in a circular arena of `budget_bytes` bytes.
+    Entries are allocated at the head of the arena in a log-structured way and
+    freed from its tail with CLOCK (second-chance) eviction: a cache hit sets
+    the reference bit of an entry, and when the tail reaches an entry with its
+    reference bit set, the entry is moved to the head (with its bit cleared)
+    instead of being evicted.
+
+    Insertions and evictions hold an exclusive file lock on the cache. Lookups
+    copy the pixels out without the lock and then check that the head has not
+    wrapped around over the copied region in the meantime (like a seqlock).
+    """
+    def __init__(self, num_samples, budget_bytes, name):
+        key = shm_key(name, num_samples, budget_bytes)
+        self.path = os.path.join(SHM_DIR, "mae_decoded_{}.bin".format(key))
+        self.num_samples = num_samples
+        self.budget_bytes = budget_bytes
+
+        n = num_samples
+        self._layout = [
+            ("header", np.int64, (_NUM_HEADER,)),
+            ("entry_start", np.int64, (n,)),  # virtual start position in the arena, -1 if not cached
+            ("entry_shape", np.int32, (n, 2)),  # (height, width)
+            ("entry_decode_ns", np.int64, (n,)),  # decoding time of the entry (saved on each hit)
+            ("entry_ref", np.uint8, (n,)),  # CLOCK reference bit
+            ("queue", np.int64, (n,)),  # cached sample indices in allocation order (circular)
+            ("arena", np.uint8, (budget_bytes,)),
+        ]
+        self.nbytes = sum(np.dtype(dtype).itemsize * int(np.prod(shape)) for _, dtype, shape in self._layout)
+
+        if misc.get_local_rank() == 0:
+            tmp_path = "{}.tmp.{}".format(self.path, os.getpid())
+            with open(tmp_path, "wb") as f:
+                f.truncate(self.nbytes)  # sparse: only touched pages take memory
+            arrays = self._map(tmp_path)
+            arrays["entry_start"][:] = -1
+            arrays["entry_start"].flush()
+            del arrays
+            os.replace(tmp_path, self.path)
+            self._owner_pid = os.getpid()
+            atexit.register(self._cleanup)
+        misc.barrier("decoded_cache")
+        while not os.path.exists(self.path):
+            time.sleep(1)
+
+        self.counters = WorkerCounters(["hits", "misses", "decode_s_saved"])
+        self._arrays = None
+        self._lock_file = None
+        self._pid = None
+
+    def _map(self, path):
+        arrays, offset = {}, 0
+        for name, dtype, shape in self._layout:
+            arrays[name] = np.memmap(path, dtype=dtype, mode="r+", offset=offset, shape=shape)
+            offset += np.dtype(dtype).itemsize * int(np.prod(shape))
+        return arrays
+
+    def _open(self):
+        # (re-)open in each process: the file lock must not be shared with the parent
+        if self._pid != os.getpid():
+            self._arrays = self._map(self.path)
+            self._lock_file = open(self.path + ".lock", "a")
+            self._pid = os.getpid()
+        return self._arrays
+
+    def _cleanup(self):
+        if os.getpid() != self._owner_pid:
+            return
+        for path in (self.path, self.path + ".lock"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_arrays"], state["_lock_file"], state["_pid"] = None, None, None
+        return state
+
+    def get(self, index):
+        """Return the cached image of sample `index`, or None."""
+        a = self._open()
+        start = int(a["entry_start"][index])
+        if start >= 0:
+            h, w = a["entry_shape"][index]
+            pos = start % self.budget_bytes
+            pixels = np.array(a["arena"][pos:pos + h * w * 3])
+            # valid if the head hasn't wrapped around over the copied region since
+            if a["header"][_HEAD] <= start + self.budget_bytes and a["entry_start"][index] >= 0:
+                a["entry_ref"][index] = 1
+                self.counters.add("hits")
+                self.counters.add("decode_s_saved", a["entry_decode_ns"][index] / 1e9)
+                return Image.fromarray(pixels.reshape(h, w, 3))
+        self.counters.add("misses")
+        return None
+
+    def put(self, index, img, decode_ns):
+        """Insert the decoded RGB image of sample `index`."""
+        pixels = np.asarray(img, dtype=np.uint8)
+        n = pixels.nbytes
+        if n > self.budget_bytes // 4:
+            return  # too large for the cache
+        a = self._open()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if a["entry_start"][index] >= 0:
+                return  # inserted by another worker in the meantime
+            start = self._allocate(a, n)
+            pos = start % self.budget_bytes
+            a["arena"][pos:pos + n] = pixels.reshape(-1)
+            a["entry_shape"][index] = pixels.shape[:2]
+            a["entry_decode_ns"][index] = decode_ns
+            a["entry_ref"][index] = 0
+            self._push(a, index)
+            a["entry_start"][index] = start  # publish the entry last
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _push(self, a, index):
+        a["queue"][a["header"][_QUEUE_HEAD] % self.num_samples] = index
+        a["header"][_QUEUE_HEAD] += 1
+
+    def _aligned(self, start, n):
+        # entries never wrap around the end of the arena
+        if start % self.budget_bytes + n > self.budget_bytes:
+            start = (start // self.budget_bytes + 1) * self.budget_bytes
+        return start
+
+    def _fits(self, a, start, n):
+        header = a["header"]
+        if header[_QUEUE_TAIL] == header[_QUEUE_HEAD]:
+            return True
+        oldest = a["entry_start"][a["queue"][header[_QUEUE_TAIL] % self.num_samples]]
+        return start + n - oldest <= self.budget_bytes
+
+    def _allocate(self, a, n):
+        header = a["header"]
+        while True:
+            start = self._aligned(int(header[_HEAD]), n)
+            if self._fits(a, start, n):
+                header[_HEAD] = start + n
+                return start
+            # free the oldest entry at the tail
+            index = a["queue"][header[_QUEUE_TAIL] % self.num_samples]
+            header[_QUEUE_TAIL] += 1
+            old_start = int(a["entry_start"][index])
+            h, w = a["entry_shape"][index]
+            size = int(h) * int(w) * 3
+            if a["entry_ref"][index]:
+                # second chance: move the entry to the head
+                a["entry_ref"][index] = 0
+                new_start = self._aligned(int(header[_HEAD]), size)
+                if self._fits(a, new_start, size):
+                    old_pos, new_pos = old_start % self.budget_bytes, new_start % self.budget_bytes
+                    header[_HEAD] = new_start + size
+                    a["arena"][new_pos:new_pos + size] = np.array(a["arena"][old_pos:old_pos + size])
+                    a["entry_start"][index] = new_start
+                    self._push(a, index)
+                    continue
+            a["entry_start"][index] = -1
+            header[_EVICTIONS] += 1
+
+    def stats(self):
+        a = self._open()
+        header = a["header"]
+        counts = self.counters.totals()
+        total = max(1., counts["hits"] + counts["misses"])
+        return {
+            "decoded_cache_gb": self.budget_bytes / 1024 ** 3,
+            "decoded_cache_entries": int(header[_QUEUE_HEAD] - header[_QUEUE_TAIL]),
+            "decoded_cache_evictions": int(header[_EVICTIONS]),
+            "decoded_cache_hits": counts["hits"],
+            "decoded_cache_misses": counts["misses"],
+            "decoded_cache_hit_rate": counts["hits"] / total,
+            "decoded_cache_decode_s_saved": counts["decode_s_saved"],
+        }
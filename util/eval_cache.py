@@ -0,0 +1,126 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# A persistent cache of the preprocessed evaluation set: the deterministic part
+# of the eval transform (resize + center crop) is applied once and its uint8
+# output is stored in a memory-mapped file, so that each evaluation only reads
+# the cropped pixels instead of decoding and resizing every image again.
+
+import copy
+import hashlib
+import os
+import socket
+import time
+
+import numpy as np
+import torch
+from torchvision import transforms
+
+import util.misc as misc
+
+
+EVAL_CACHE_VERSION = 1
+
+
+def split_eval_transform(transform):
+    """
+    Split an eval transform `Compose([..., ToTensor(), Normalize(mean, std)])`
+    into its deterministic PIL part and the normalization.
+    """
+    assert isinstance(transform, transforms.Compose), "the eval cache needs a Compose transform"
+    *pil_transforms, to_tensor, normalize = transform.transforms
+    assert isinstance(to_tensor, transforms.ToTensor) and isinstance(normalize, transforms.Normalize), \
+        "the eval cache needs a transform that ends with ToTensor() and Normalize()"
+    return transforms.Compose(pil_transforms), normalize
+
+
+class CachedEvalDataset(torch.utils.data.Dataset):
+    """
+    The samples of an (eval) image dataset with a deterministic transform, read
+    from a cache of the uint8 (3, H, W) outputs of its PIL transforms (e.g.
+    resize + center crop) and normalized on the fly, exactly like `ToTensor()`
+    and `Normalize()` of the original transform.
+
+    The cache is stored in `cache_dir` under a key of the dataset root, its
+    number of samples and the transform parameters, and is built once (by local
+    rank 0, with a DataLoader of `num_workers` workers) and reused by later runs.
+    Delete the cache files if the images change.
+    """
+    def __init__(self, dataset, cache_dir, num_workers=8, batch_size=64):
+        self.pil_transform, self.normalize = split_eval_transform(dataset.transform)
+        root = os.path.abspath(dataset.root)
+        key = hashlib.sha1("{}:{}:{}:{}".format(
+            EVAL_CACHE_VERSION, root, len(dataset), repr(self.pil_transform)).encode("utf-8")).hexdigest()[:16]
+        name = "mae_eval_{}_{}".format(os.path.basename(root.rstrip("/")), key)
+        self.images_path = os.path.join(cache_dir, name + ".images.npy")
+        self.labels_path = os.path.join(cache_dir, name + ".labels.npy")
+        self.root = root
+
+        if misc.get_local_rank() == 0 and not os.path.exists(self.labels_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            start_time = time.time()
+            self._build(dataset, num_workers, batch_size)
+            print("cached {} preprocessed eval images ({:.2f} GB) in {} in {:.0f} s".format(
+                len(dataset), os.path.getsize(self.images_path) / 1024 ** 3, self.images_path,
+                time.time() - start_time))
+        misc.barrier("eval_cache")
+        # the labels file is renamed into place last, so it marks a complete cache
+        while not os.path.exists(self.labels_path):
+            time.sleep(1)
+
+        self.labels = np.load(self.labels_path)
+        self.images = None
+
+    def _build(self, dataset, num_workers, batch_size):
+        dataset = copy.copy(dataset)
+        dataset.transform = transforms.Compose(self.pil_transform.transforms + [transforms.PILToTensor()])
+        loader = torch.utils.data.DataLoader(
+            dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, drop_last=False
+        )
+        suffix = ".tmp.{}.{}.npy".format(socket.gethostname(), os.getpid())
+        images, labels, pos = None, np.zeros(len(dataset), dtype=np.int64), 0
+        for batch, target in loader:
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    self.images_path + suffix, mode="w+", dtype=np.uint8, shape=(len(dataset),) + tuple(batch.shape[1:])
+                )
+            assert tuple(batch.shape[1:]) == images.shape[1:], "the eval transform must have a fixed output size"
+            images[pos:pos + len(batch)] = batch.numpy()
+            labels[pos:pos + len(batch)] = target.numpy()
+            pos += len(batch)
+        images.flush()
+        del images
+        os.replace(self.images_path + suffix, self.images_path)
+        np.save(self.labels_path + suffix, labels)
+        os.replace(self.labels_path + suffix, self.labels_path)
+
+    def __getstate__(self):
+        # don't pickle the memory map (e.g. when DataLoader workers are spawned)
+        state = self.__dict__.copy()
+        state["images"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self.images is None:
+            self.images = np.load(self.images_path, mmap_mode="r")
+        img = torch.from_numpy(np.array(self.images[index]))
+        # the same ops as `ToTensor()` and `Normalize()`
+        img = self.normalize(img.float().div(255))
+        return img, int(self.labels[index])
+
+    def __repr__(self):
+        lines = [
+            "Dataset " + self.__class__.__name__,
+            "    Number of datapoints: {}".format(len(self)),
+            "    Root location: {}".format(self.root),
+            "    Cache file: {}".format(self.images_path),
+            "    Cached transform: " + repr(self.pil_transform).replace("\n", "\n    "),
+            "    Normalize: {}".format(self.normalize),
+        ]
+        return "\n".join(lines)
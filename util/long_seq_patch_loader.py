@@ -9,83 +9,162 @@
 # BEiT: https://github.com/microsoft/unilm/tree/master/beit
 # --------------------------------------------------------
 
-import math
 import torch
-import numpy as np
+
+from util.batched_aug import collate_crops
+from util.masking import build_masking
 
 
 class SampleVisiblePatchIndices:
+    """
+    Apply `transforms` to an image and sample its visible patches with a
+    masking strategy of `util.masking` (`masking`, e.g. "random").
+    """
     def __init__(
-        self, transforms, num_patches, mask_ratio, mask_downsampling,
+        self, transforms, num_patches, mask_ratio, mask_downsampling, num_repeats=1, sample_masks=True,
+        masking="random",
     ):
         self.transforms = transforms
+        # repeated augmentation: sample `num_repeats` crops (and masks) of each decoded image
+        self.num_repeats = num_repeats
+        # without `sample_masks`, only the images are returned and the model samples the
+        # masks of the whole batch on the device (`BatchedVisiblePatchSampler`)
+        self.sample_masks = sample_masks
         self.num_patches = num_patches
-        self.mask_ratio = mask_ratio
-        self.num_keep_patches = int(num_patches * (1 - mask_ratio))
-
-        assert isinstance(mask_downsampling, int) and mask_downsampling >= 1
-        self.mask_downsampling = mask_downsampling
-        if self.mask_downsampling > 1:
-            grid_size = int(np.sqrt(num_patches))
-            assert num_patches == grid_size ** 2
-            self.grid_size = grid_size
-            self.rounding_needed = (grid_size % mask_downsampling) > 0
-            mask_grid_size = math.ceil(grid_size / mask_downsampling)
-            num_mask_patches = mask_grid_size ** 2
-            self.grid_size = grid_size
-            self.mask_grid_size = mask_grid_size
-            self.num_mask_patches = num_mask_patches
-
-    def _clip_by_grid(self, x):
-        if not self.rounding_needed:
-            return x
-        return np.where(x < self.grid_size, x, -100000 - self.num_patches)
+        self.masking = build_masking(masking, num_patches, mask_ratio, mask_downsampling)
+
+    @property
+    def num_keep_patches(self):
+        return self.masking.num_keep_patches
 
     def __call__(self, img):
+        if self.num_repeats > 1:
+            return [self._sample(img) for _ in range(self.num_repeats)]
+        return self._sample(img)
+
+    def _sample(self, img):
         img = self.transforms(img)
+        if not self.sample_masks:
+            return {"img": img}
 
-        # generating shuffling and masking indices
-        if self.mask_downsampling > 1:
-            mask_ids_shuffle = np.random.permutation(self.num_mask_patches)
-            mask_x = (mask_ids_shuffle % self.mask_grid_size) * self.mask_downsampling
-            mask_y = (mask_ids_shuffle // self.mask_grid_size) * self.mask_downsampling
-            stacks = [
-                self._clip_by_grid(mask_y + ry) * self.grid_size + self._clip_by_grid(mask_x + rx)
-                for rx in range(self.mask_downsampling)
-                for ry in range(self.mask_downsampling)
-            ]
-            ids_shuffle = np.stack(stacks, axis=1).reshape(-1)
-            if not self.rounding_needed:
-                assert len(ids_shuffle) == self.num_patches, f"{len(ids_shuffle)} vs {self.num_patches}"
-            else:
-                ids_shuffle = ids_shuffle[ids_shuffle >= 0]
-                assert len(ids_shuffle) == self.num_patches, f"{len(ids_shuffle)} vs {self.num_patches}"
-        else:
-            ids_shuffle = np.random.permutation(self.num_patches)
-        ids_restore = np.empty(self.num_patches, dtype=np.int64)
-        ids_restore[ids_shuffle] = np.arange(self.num_patches, dtype=np.int64)
-        ids_keep = ids_shuffle[:self.num_keep_patches]
-
-        ids_shuffle = torch.tensor(ids_shuffle, dtype=torch.long)
-        ids_keep = torch.tensor(ids_keep, dtype=torch.long)
-        ids_restore = torch.tensor(ids_restore, dtype=torch.long)
-
-        out = {
+        # a batch of one sample (with the torch RNG, which the DataLoader seeds per worker)
+        ids_keep, ids_restore = self.masking(1)
+        return {
             "img": img,
-            "ids_shuffle": ids_shuffle,
-            "ids_keep": ids_keep,
-            "ids_restore": ids_restore,
+            "ids_keep": ids_keep[0],
+            "ids_restore": ids_restore[0],
         }
 
-        return out
+
+class BatchedVisiblePatchSampler:
+    """
+    Sample the (ids_keep, ids_restore) of a whole batch on a device with a
+    masking strategy of `util.masking`. With `manual_seed`, the masks (and the
+    decoder subsets of `sample_subset`) are drawn from a dedicated generator
+    (per device), independent of the other random ops.
+    """
+    def __init__(self, masking):
+        self.masking = masking
+        self.seed = None
+        self._generators = {}
+
+    def manual_seed(self, seed):
+        self.seed = seed
+        self._generators = {}
+
+    def _generator(self, device):
+        if self.seed is None:
+            return None
+        if device not in self._generators:
+            self._generators[device] = torch.Generator(device=device).manual_seed(self.seed)
+        return self._generators[device]
+
+    def __call__(self, batch_size, device):
+        return self.masking(batch_size, device, self._generator(device))
+
+    def sample_variable(self, batch_size, device, mask_ratio_range):
+        """
+        Per-sample mask ratios (--mask_ratio_range), uniform in [low, high]:
+        the (N, L) patch ranking of the masking strategy (with its pattern
+        sampled at its own `mask_ratio`) and the number of visible patches of
+        each sample `len_keep` (N,), at least one.
+        """
+        generator = self._generator(device)
+        ids_shuffle = self.masking.patch_ranking(batch_size, device, generator)
+        low, high = mask_ratio_range
+        ratios = torch.rand(batch_size, device=device, generator=generator) * (high - low) + low
+        num_patches = ids_shuffle.size(1)
+        len_keep = (num_patches * (1 - ratios)).long().clamp(1, num_patches)
+        return ids_shuffle, len_keep
+
+    def sample_subset(self, batch_size, num_candidates, num_select, device):
+        """
+        A random subset of `num_select` of `num_candidates` positions per sample
+        (N, num_select), e.g. of the removed patches fed to the decoder
+        (--decoder_keep_ratio).
+        """
+        noise = torch.rand(batch_size, num_candidates, device=device, generator=self._generator(device))
+        return noise.argsort(dim=1)[:, :num_select]
+
+
+def flatten_samples(sample_and_label_list):
+    """The samples of a batch, with the repeated samples of each image (a list) flattened into the batch."""
+    sample_list = []
+    for sample, _ in sample_and_label_list:
+        sample_list.extend(sample if isinstance(sample, list) else [sample])
+    return sample_list
+
+
+def narrow_indices(*ids):
+    """Cast patch index tensors to the narrowest integer type holding the sequence length (int16 or int32)."""
+    seq_len = max(i.size(-1) for i in ids)
+    dtype = torch.int16 if seq_len <= torch.iinfo(torch.int16).max else torch.int32
+    return tuple(i.to(dtype) for i in ids)
 
 
 class MAEIndexCollator:
+    """
+    Collate the samples of `SampleVisiblePatchIndices` into (imgs, ids_keep, ids_restore),
+    or (imgs,) if the masks are sampled on the device.
+    With `compact=True`, the images are expected to be uint8 (e.g. from
+    `transforms.PILToTensor`) and the indices are narrowed to int16/int32; the
+    model normalizes and widens them on the device.
+    """
+    def __init__(self, compact=False):
+        self.compact = compact
+
     def __call__(self, sample_and_label_list):
-        sample_list = [sample for sample, _ in sample_and_label_list]
+        sample_list = flatten_samples(sample_and_label_list)
 
         imgs = torch.stack([sample["img"] for sample in sample_list])
+        if "ids_keep" not in sample_list[0]:
+            return (imgs,)  # the masks are sampled on the device
         ids_keep = torch.stack([sample["ids_keep"] for sample in sample_list])
         ids_restore = torch.stack([sample["ids_restore"] for sample in sample_list])
+        if self.compact:
+            assert imgs.dtype == torch.uint8
+            ids_keep, ids_restore = narrow_indices(ids_keep, ids_restore)
 
         return imgs, ids_keep, ids_restore
+
+
+class MAECropIndexCollator:
+    """
+    Like `MAEIndexCollator`, for the uint8 images and crop boxes of
+    `util.batched_aug.SampleCrop`: (imgs, boxes, flips[, ids_keep, ids_restore]).
+    """
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def __call__(self, sample_and_label_list):
+        sample_list = flatten_samples(sample_and_label_list)
+
+        imgs, boxes, flips = collate_crops([sample["img"] for sample in sample_list])
+        if "ids_keep" not in sample_list[0]:
+            return imgs, boxes, flips
+        ids_keep = torch.stack([sample["ids_keep"] for sample in sample_list])
+        ids_restore = torch.stack([sample["ids_restore"] for sample in sample_list])
+        if self.compact:
+            ids_keep, ids_restore = narrow_indices(ids_keep, ids_restore)
+
+        return imgs, boxes, flips, ids_keep, ids_restore
@@ -19,3 +19,21 @@ def adjust_learning_rate(optimizer, epoch, args):
         else:
             param_group["lr"] = lr
     return lr
+
+
+def _anneal(start, end, epoch, anneal_epochs):
+    """Anneal from start to end with half-cycle cosine over anneal_epochs (end if start is None)"""
+    if start is None or epoch >= anneal_epochs:
+        return end
+    return end + (start - end) * 0.5 * (1. + math.cos(math.pi * epoch / anneal_epochs))
+
+
+def adjust_mask_ratio(epoch, args):
+    """Anneal the mask ratio from args.mask_ratio_start to args.mask_ratio with half-cycle cosine"""
+    return _anneal(args.mask_ratio_start, args.mask_ratio, epoch, args.mask_ratio_anneal_epochs or args.epochs)
+
+
+def adjust_decoder_keep_ratio(epoch, args):
+    """Anneal the decoder keep ratio from args.decoder_keep_ratio_start to args.decoder_keep_ratio with half-cycle cosine"""
+    return _anneal(args.decoder_keep_ratio_start, args.decoder_keep_ratio, epoch,
+                   args.decoder_keep_ratio_anneal_epochs or args.epochs)
@@ -0,0 +1,237 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# A persistent file manifest for image folders: one scan stores the relative
+# path, size and mtime of every image (and its label) next to the data, so that
+# later runs don't need to walk the folder (which takes minutes on NFS).
+
+import json
+import os
+
+import numpy as np
+
+from torchvision.datasets.folder import IMG_EXTENSIONS, has_file_allowed_extension
+
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".mae_manifest_v{}.npz".format(MANIFEST_VERSION)
+
+# number of randomly sampled files to re-stat in a "quick" staleness check
+NUM_QUICK_CHECK_FILES = 1000
+
+
+class FileManifest:
+    """
+    The file list of an image folder, stored as flat arrays.
+
+    Paths are relative to `root` and are stored as one utf-8 byte blob
+    (`path_bytes`) indexed by `path_offsets`, so that a manifest of millions
+    of files is only a handful of numpy arrays (no per-file Python objects).
+
+    - labeled: follow `datasets.ImageFolder` (one class per sub-folder)
+    - unlabeled: all images under `root` (recursively) with label 0,
+      e.g. for `unlabeled2017` that has no class sub-folders
+    """
+    def __init__(self, root, labeled, classes, path_offsets, path_bytes,
+                 labels, sizes, mtimes, dir_paths, dir_mtimes):
+        self.root = root
+        self.labeled = labeled
+        self.classes = classes
+        self.path_offsets = path_offsets
+        self.path_bytes = path_bytes
+        self.labels = labels
+        self.sizes = sizes
+        self.mtimes = mtimes
+        # the scanned directories (relative to root) and their mtimes,
+        # used to detect added or removed files
+        self.dir_paths = dir_paths
+        self.dir_mtimes = dir_mtimes
+
+    def __len__(self):
+        return len(self.labels)
+
+    def rel_path(self, index):
+        start, end = self.path_offsets[index], self.path_offsets[index + 1]
+        return self.path_bytes[start:end].tobytes().decode("utf-8")
+
+    def path(self, index):
+        return os.path.join(self.root, self.rel_path(index))
+
+    @property
+    def nbytes(self):
+        arrays = [self.path_offsets, self.path_bytes, self.labels, self.sizes, self.mtimes]
+        return sum(a.nbytes for a in arrays)
+
+    @staticmethod
+    def scan(root, labeled=True):
+        """Walk `root` once and collect all image files (same order as `ImageFolder`)."""
+        root = os.path.expanduser(root)
+        if labeled:
+            classes = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+            if len(classes) == 0:
+                raise FileNotFoundError(f"Couldn't find any class folder in {root}.")
+            class_dirs = [(c, i) for i, c in enumerate(classes)]
+        else:
+            classes = []
+            class_dirs = [("", 0)]
+
+        rel_paths, labels, sizes, mtimes = [], [], [], []
+        dir_paths, dir_mtimes = [""], [os.stat(root).st_mtime_ns]
+        for class_dir, label in class_dirs:
+            for dirpath, _, fnames in sorted(os.walk(os.path.join(root, class_dir), followlinks=True)):
+                rel_dir = os.path.relpath(dirpath, root)
+                if rel_dir != ".":
+                    dir_paths.append(rel_dir)
+                    dir_mtimes.append(os.stat(dirpath).st_mtime_ns)
+                for fname in sorted(fnames):
+                    if not has_file_allowed_extension(fname, IMG_EXTENSIONS):
+                        continue
+                    st = os.stat(os.path.join(dirpath, fname))
+                    rel_paths.append(fname if rel_dir == "." else os.path.join(rel_dir, fname))
+                    labels.append(label)
+                    sizes.append(st.st_size)
+                    mtimes.append(st.st_mtime_ns)
+        if len(rel_paths) == 0:
+            raise FileNotFoundError(f"Found no valid image file in {root}.")
+
+        path_offsets, path_bytes = pack_strings(rel_paths)
+        return FileManifest(
+            root=root,
+            labeled=labeled,
+            classes=classes,
+            path_offsets=path_offsets,
+            path_bytes=path_bytes,
+            labels=np.array(labels, dtype=np.int32),
+            sizes=np.array(sizes, dtype=np.int64),
+            mtimes=np.array(mtimes, dtype=np.int64),
+            dir_paths=dir_paths,
+            dir_mtimes=np.array(dir_mtimes, dtype=np.int64),
+        )
+
+    def save(self, manifest_path):
+        meta = {
+            "version": MANIFEST_VERSION,
+            "labeled": self.labeled,
+            "classes": self.classes,
+            "dir_paths": self.dir_paths,
+        }
+        # write to a temp file and rename, so that concurrent readers never see
+        # a partially written manifest
+        tmp_path = "{}.tmp.{}".format(manifest_path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                path_offsets=self.path_offsets,
+                path_bytes=self.path_bytes,
+                labels=self.labels,
+                sizes=self.sizes,
+                mtimes=self.mtimes,
+                dir_mtimes=self.dir_mtimes,
+            )
+        os.replace(tmp_path, manifest_path)
+
+    @staticmethod
+    def load(manifest_path, root):
+        """Load a manifest; returns None if it has a different format version."""
+        with np.load(manifest_path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["version"] != MANIFEST_VERSION:
+                return None
+            return FileManifest(
+                root=os.path.expanduser(root),
+                labeled=meta["labeled"],
+                classes=meta["classes"],
+                path_offsets=data["path_offsets"],
+                path_bytes=data["path_bytes"],
+                labels=data["labels"],
+                sizes=data["sizes"],
+                mtimes=data["mtimes"],
+                dir_paths=meta["dir_paths"],
+                dir_mtimes=data["dir_mtimes"],
+            )
+
+    def is_stale(self, check="quick"):
+        """
+        Check whether the folder changed since the manifest was written.
+
+        - none: never stale
+        - quick: re-stat all scanned directories (catches added or removed files)
+          and a random subset of the files (catches rewritten files)
+        - full: re-stat all directories and all files
+        """
+        assert check in ("none", "quick", "full")
+        if check == "none":
+            return False
+        for rel_dir, mtime in zip(self.dir_paths, self.dir_mtimes):
+            try:
+                if os.stat(os.path.join(self.root, rel_dir)).st_mtime_ns != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        if check == "full" or len(self) <= NUM_QUICK_CHECK_FILES:
+            indices = range(len(self))
+        else:
+            indices = np.random.RandomState(0).choice(len(self), NUM_QUICK_CHECK_FILES, replace=False)
+        for i in indices:
+            try:
+                st = os.stat(self.path(i))
+            except FileNotFoundError:
+                return True
+            if st.st_size != self.sizes[i] or st.st_mtime_ns != self.mtimes[i]:
+                return True
+        return False
+
+
+def pack_strings(strings):
+    """Pack a list of str into (offsets, utf-8 byte blob) numpy arrays."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return offsets, blob
+
+
+def default_manifest_path(root, labeled, manifest_dir=""):
+    """The manifest is written next to the data folder unless `manifest_dir` is given."""
+    root = os.path.normpath(os.path.abspath(os.path.expanduser(root)))
+    name = os.path.basename(root) + ("" if labeled else ".unlabeled") + MANIFEST_SUFFIX
+    parent = manifest_dir if manifest_dir else os.path.dirname(root)
+    return os.path.join(parent, name)
+
+
+def load_or_build_manifest(root, labeled=True, manifest_path="", check="quick", save=True):
+    """
+    Load the manifest of `root`, or scan the folder if the manifest is missing,
+    has an old format version, or is stale. The new manifest is only written
+    when `save` is True (e.g. only on the main process).
+    """
+    if not manifest_path:
+        manifest_path = default_manifest_path(root, labeled)
+    manifest = None
+    if os.path.exists(manifest_path):
+        manifest = FileManifest.load(manifest_path, root)
+        if manifest is None:
+            print(f"manifest {manifest_path} has an old format version, rebuilding it")
+        elif manifest.labeled != labeled:
+            print(f"manifest {manifest_path} has labeled={manifest.labeled}, rebuilding it")
+            manifest = None
+        elif manifest.is_stale(check):
+            print(f"manifest {manifest_path} is stale, rebuilding it")
+            manifest = None
+    if manifest is not None:
+        print(f"loaded manifest {manifest_path} ({len(manifest)} files)")
+        return manifest
+
+    manifest = FileManifest.scan(root, labeled)
+    print(f"scanned {root} ({len(manifest)} files)")
+    if save:
+        try:
+            manifest.save(manifest_path)
+            print(f"saved manifest to {manifest_path}")
+        except OSError as e:
+            print(f"failed to save manifest to {manifest_path}: {e}")
+    return manifest
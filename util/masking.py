@@ -0,0 +1,193 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Masking strategies for MAE pretraining (--masking). Each strategy samples the
+# visible patches of N samples at once, as batched torch ops (on the CPU in the
+# DataLoader workers, or on the training device with --device_masking), and
+# returns (ids_keep, ids_restore) with a fixed number of visible patches.
+#
+# A strategy scores all patches of each sample and keeps the lowest-scored ones
+# (argsort), so that every strategy keeps exactly `num_keep_patches` patches,
+# filling up (or trimming) its pattern with random patches if needed. With
+# `mask_downsampling` d > 1, the strategy runs on a grid of d x d blocks, and
+# the blocks are expanded into their patches (clipped at the grid border).
+
+import abc
+import math
+
+import torch
+
+
+class MaskingStrategy(abc.ABC):
+    """
+    The base class of the masking strategies: `ids_shuffle` returns a (N, M)
+    ranking of the M cells of a grid_size x grid_size grid for each sample
+    (the first `num_keep` cells are visible).
+    """
+    def __init__(self, num_patches, mask_ratio, mask_downsampling=1):
+        assert isinstance(mask_downsampling, int) and mask_downsampling >= 1
+        self.num_patches = num_patches
+        self.grid_size = int(math.sqrt(num_patches))
+        assert self.grid_size ** 2 == num_patches, "the masking strategies need a square patch grid"
+        self.mask_ratio = mask_ratio
+        self.mask_downsampling = mask_downsampling
+        self.mask_grid_size = math.ceil(self.grid_size / mask_downsampling)
+        self._block_patches = {}
+
+    @property
+    def num_keep_patches(self):
+        return int(self.num_patches * (1 - self.mask_ratio))
+
+    @abc.abstractmethod
+    def ids_shuffle(self, batch_size, grid_size, num_keep, device, generator):
+        """The (N, grid_size ** 2) cell ranking of each sample, with `num_keep` visible cells."""
+
+    def block_patches(self, device):
+        """The patch ids of each d x d mask block (x offset major), -1 beyond the grid."""
+        if device not in self._block_patches:
+            d, g, m = self.mask_downsampling, self.grid_size, self.mask_grid_size
+            block = torch.arange(m ** 2)
+            r = torch.arange(d)
+            # (block, rx, ry) => patch (y, x) = (block_y * d + ry, block_x * d + rx)
+            y = (block // m * d)[:, None, None] + r[None, None, :]
+            x = (block % m * d)[:, None, None] + r[None, :, None]
+            patches = torch.where((y < g) & (x < g), y * g + x, torch.full_like(y, -1))
+            self._block_patches[device] = patches.flatten(1).to(device)
+        return self._block_patches[device]
+
+    def patch_ranking(self, batch_size, device=torch.device("cpu"), generator=None):
+        """The (N, num_patches) ranking of the patches of each sample (the first `num_keep_patches` are visible)."""
+        if self.mask_downsampling > 1:
+            block_patches = self.block_patches(device)
+            num_keep_blocks = int(self.mask_grid_size ** 2 * (1 - self.mask_ratio))
+            block_order = self.ids_shuffle(batch_size, self.mask_grid_size, num_keep_blocks, device, generator)
+            ids_shuffle = block_patches[block_order].flatten(1)
+            if ids_shuffle.size(1) > self.num_patches:
+                # drop the patches beyond the grid (the same number in every row)
+                ids_shuffle = ids_shuffle[ids_shuffle >= 0].view(batch_size, self.num_patches)
+        else:
+            ids_shuffle = self.ids_shuffle(batch_size, self.grid_size, self.num_keep_patches, device, generator)
+        return ids_shuffle
+
+    def __call__(self, batch_size, device=torch.device("cpu"), generator=None):
+        ids_shuffle = self.patch_ranking(batch_size, device, generator)
+        ids_restore = torch.empty_like(ids_shuffle).scatter_(
+            1, ids_shuffle, torch.arange(self.num_patches, device=device).expand(batch_size, -1)
+        )
+        return ids_shuffle[:, :self.num_keep_patches], ids_restore
+
+    def __repr__(self):
+        return "{}(num_patches={}, mask_ratio={}, mask_downsampling={})".format(
+            self.__class__.__name__, self.num_patches, self.mask_ratio, self.mask_downsampling)
+
+
+class RandomMasking(MaskingStrategy):
+    """Uniform random masking (MAE); with `mask_downsampling`, of random d x d blocks."""
+    def ids_shuffle(self, batch_size, grid_size, num_keep, device, generator):
+        if device.type == "cpu":
+            # on the CPU, a permutation per sample is much cheaper than sorting random noise
+            return torch.stack([
+                torch.randperm(grid_size ** 2, generator=generator) for _ in range(batch_size)
+            ])
+        noise = torch.rand(batch_size, grid_size ** 2, device=device, generator=generator)
+        return noise.argsort(dim=1)
+
+
+class GridMasking(MaskingStrategy):
+    """
+    Grid-wise masking (the "grid" sampling of the MAE paper): keep every s-th
+    row and column (s = round(1 / sqrt(1 - mask_ratio)), e.g. 2 for 75%) with
+    a random offset per sample.
+    """
+    def ids_shuffle(self, batch_size, grid_size, num_keep, device, generator):
+        stride = max(1, round(1 / math.sqrt(1 - self.mask_ratio)))
+        offsets = torch.randint(0, stride, (batch_size, 2, 1), device=device, generator=generator)
+        pos = torch.arange(grid_size, device=device)
+        on_y = (pos[None] - offsets[:, 0]) % stride == 0
+        on_x = (pos[None] - offsets[:, 1]) % stride == 0
+        on_grid = (on_y[:, :, None] & on_x[:, None, :]).flatten(1)
+        noise = torch.rand(batch_size, grid_size ** 2, device=device, generator=generator)
+        return ((~on_grid).float() + noise).argsort(dim=1)
+
+
+def _rectangle_first_cover(batch_size, grid_size, areas, device, generator,
+                           min_aspect=0.3, max_aspect=1 / 0.3):
+    """
+    Sample K random rectangles (of `areas` (N, K) patches, with a log-uniform
+    aspect ratio) per sample, and return the index of the first rectangle
+    covering each cell (K if none), (N, grid_size ** 2).
+    """
+    num_rects = areas.size(1)
+    log_aspect = torch.empty(batch_size, num_rects, device=device).uniform_(
+        math.log(min_aspect), math.log(max_aspect), generator=generator)
+    aspect = log_aspect.exp()
+    h = (areas * aspect).sqrt().round().clamp(1, grid_size)
+    w = (areas / aspect).sqrt().round().clamp(1, grid_size)
+    top = (torch.rand(batch_size, num_rects, device=device, generator=generator) * (grid_size - h + 1)).floor()
+    left = (torch.rand(batch_size, num_rects, device=device, generator=generator) * (grid_size - w + 1)).floor()
+    pos = torch.arange(grid_size, device=device, dtype=areas.dtype)
+    in_y = (pos >= top[..., None]) & (pos < (top + h)[..., None])  # (N, K, G)
+    in_x = (pos >= left[..., None]) & (pos < (left + w)[..., None])
+    covered = (in_y[..., :, None] & in_x[..., None, :]).flatten(2)  # (N, K, G * G)
+    rect_index = torch.arange(num_rects, device=device)[None, :, None]
+    return torch.where(covered, rect_index, torch.full_like(rect_index, num_rects)).amin(dim=1)
+
+
+def _keep_uncovered_first(first_cover, device, generator):
+    # visible: the uncovered cells (in random order), then the cells of the last rectangles;
+    # the integer levels -k are kept apart by noise in [0, 1)
+    noise = torch.rand(first_cover.shape, device=device, generator=generator)
+    return (noise - first_cover.float()).argsort(dim=1)
+
+
+class BlockwiseMasking(MaskingStrategy):
+    """
+    Block-wise masking (BEiT): mask random rectangles with an area between
+    `min_block_fraction` of the grid and the number of masked patches and a
+    log-uniform aspect ratio in [0.3, 1/0.3]. BEiT adds blocks one at a time
+    until enough patches are masked; here `num_blocks` rectangles are sampled
+    at once and masked in order (the last one partially, in random order), and
+    random patches fill up the mask if they cover too few patches.
+    """
+    def __init__(self, num_patches, mask_ratio, mask_downsampling=1, num_blocks=16, min_block_fraction=16 / 196):
+        super().__init__(num_patches, mask_ratio, mask_downsampling)
+        self.num_blocks = num_blocks
+        self.min_block_fraction = min_block_fraction
+
+    def ids_shuffle(self, batch_size, grid_size, num_keep, device, generator):
+        num_cells = grid_size ** 2
+        num_mask = num_cells - num_keep
+        min_area = max(1., self.min_block_fraction * num_cells)
+        max_area = max(min_area, float(num_mask))
+        areas = torch.empty(batch_size, self.num_blocks, device=device).uniform_(min_area, max_area, generator=generator)
+        first_cover = _rectangle_first_cover(batch_size, grid_size, areas, device, generator)
+        return _keep_uncovered_first(first_cover, device, generator)
+
+
+class RectangleMasking(MaskingStrategy):
+    """
+    Rectangular block masking: mask one random rectangle with the area of the
+    masked patches and a log-uniform aspect ratio in [0.3, 1/0.3] (clipped to
+    the grid), filled up with random patches.
+    """
+    def ids_shuffle(self, batch_size, grid_size, num_keep, device, generator):
+        num_mask = grid_size ** 2 - num_keep
+        areas = torch.full((batch_size, 1), float(max(1, num_mask)), device=device)
+        first_cover = _rectangle_first_cover(batch_size, grid_size, areas, device, generator)
+        return _keep_uncovered_first(first_cover, device, generator)
+
+
+MASKING_STRATEGIES = {
+    "random": RandomMasking,
+    "blockwise": BlockwiseMasking,
+    "grid": GridMasking,
+    "rectangle": RectangleMasking,
+}
+
+
+def build_masking(name, num_patches, mask_ratio, mask_downsampling=1):
+    """Build a masking strategy by name (`random` with `mask_downsampling` > 1 is downsampled-block masking)."""
+    return MASKING_STRATEGIES[name](num_patches, mask_ratio, mask_downsampling)
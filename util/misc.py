@@ -21,6 +21,8 @@ import torch
 import torch.distributed as dist
 from torch._six import inf
 
+from util.cpu_affinity import configure_cpu_affinity
+
 try:
     import torch_xla.core.xla_model as xm
     import torch_xla.distributed.xla_multiprocessing as xmp
@@ -238,6 +240,48 @@ def is_main_process():
     return get_rank() == 0
 
 
+def get_local_world_size():
+    """Number of processes (ranks) on this node"""
+    for key in ("LOCAL_WORLD_SIZE", "SLURM_NTASKS_PER_NODE"):
+        if key in os.environ:
+            return int(os.environ[key].split("(")[0])  # e.g. SLURM_NTASKS_PER_NODE=8(x2)
+    if get_world_size() == 1:
+        return 1
+    return max(1, torch.cuda.device_count())
+
+
+def get_local_rank():
+    """Rank of this process on its node"""
+    for key in ("LOCAL_RANK", "SLURM_LOCALID"):
+        if key in os.environ:
+            return int(os.environ[key])
+    return get_rank() % get_local_world_size()
+
+
+def get_node_rank():
+    return get_rank() // get_local_world_size()
+
+
+def get_num_nodes():
+    return max(1, get_world_size() // get_local_world_size())
+
+
+def get_job_id():
+    """An id of this job, the same on all its ranks and DataLoader workers (and unique among the jobs on a host)."""
+    if "SLURM_JOB_ID" in os.environ:
+        return "slurm{}.{}".format(os.environ["SLURM_JOB_ID"], os.environ.get("SLURM_STEP_ID", 0))
+    if "MASTER_ADDR" in os.environ and "MASTER_PORT" in os.environ:
+        return "{}:{}".format(os.environ["MASTER_ADDR"], os.environ["MASTER_PORT"])
+    return "pid{}".format(os.getpid())  # a single process
+
+
+def barrier(tag="barrier"):
+    if XLA_CFG["is_xla"]:
+        xm.rendezvous(tag)
+    elif is_dist_avail_and_initialized():
+        dist.barrier()
+
+
 def save_on_master(*args, **kwargs):
     if XLA_CFG["is_xla"]:
         xm.save(*args, **kwargs, global_master=True)
@@ -272,6 +316,7 @@ def init_distributed_mode(args):
         print('Not using distributed mode')
         setup_for_distributed(is_master=True)  # hack
         args.distributed = False
+        _init_cpu_affinity(args)
         return
 
     args.distributed = True
@@ -284,6 +329,14 @@ def init_distributed_mode(args):
                                          world_size=args.world_size, rank=args.rank)
     torch.distributed.barrier()
     setup_for_distributed(args.rank == 0)
+    _init_cpu_affinity(args)
+
+
+def _init_cpu_affinity(args):
+    # split the cores of this rank between the main process and its DataLoader
+    # workers (which are pinned with `util.cpu_affinity.worker_init_fn`)
+    if getattr(args, 'cpu_affinity', False):
+        configure_cpu_affinity(args.num_workers, rank=get_rank())
 
 
 def broadcast_xla_master_model_param(model):
@@ -0,0 +1,110 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Packed variable-length encoder batches (--mask_ratio_range): the visible
+# tokens (and the cls token) of all samples of a batch are concatenated into one
+# flat sequence, so that samples with different numbers of visible patches take
+# no padding FLOPs. The token-wise layers (LayerNorm, qkv, MLP) run on the packed
+# sequence, and the attention runs as one batched call over the samples padded
+# to the longest one (with a key padding mask), so only the attention pays for
+# the padding.
+
+import torch
+
+from util.act_checkpoint import maybe_checkpoint
+
+
+class PackedBatch:
+    """
+    The layout of a packed batch of N samples, each with a cls token followed
+    by its `len_keep[i]` visible patches `ids_shuffle[i, :len_keep[i]]`.
+    """
+    def __init__(self, ids_shuffle, len_keep):
+        N, L = ids_shuffle.shape
+        device = ids_shuffle.device
+        self.batch_size, self.num_patches = N, L
+        self.len_keep = len_keep
+        self.lengths = (len_keep + 1).tolist()  # with the cls token
+        keep = torch.arange(L, device=device)[None] < len_keep[:, None]  # (N, L) in ranking order
+        starts = torch.cumsum(len_keep + 1, dim=0) - (len_keep + 1)
+        # the sample and patch of each visible token (sample-major), and its position in the packed sequence
+        self.batch_index = torch.arange(N, device=device)[:, None].expand(N, L)[keep]
+        self.ids_keep = ids_shuffle[keep]
+        self.token_pos = (starts[:, None] + 1 + torch.arange(L, device=device)[None]).expand(N, L)[keep]
+        self.cls_pos = starts
+        self.total_length = sum(self.lengths)
+        # the position of each packed token in the padded (N, max_length) layout of the attention,
+        # and the key padding mask (N, 1, 1, max_length) of the padded layout (True for the real tokens)
+        self.max_length = max(self.lengths)
+        sample_index = torch.repeat_interleave(
+            torch.arange(N, device=device), len_keep + 1, output_size=self.total_length)
+        offsets = torch.arange(self.total_length, device=device) - starts[sample_index]
+        self.padded_pos = sample_index * self.max_length + offsets
+        self.attn_mask = (torch.arange(self.max_length, device=device)[None] < (len_keep + 1)[:, None])[:, None, None]
+
+    def pack(self, x, cls_tokens):
+        """Pack the visible tokens of x (N, L, D) and the cls tokens (N, D) into (total_length, D)."""
+        return self.pack_visible(x[self.batch_index, self.ids_keep], cls_tokens)
+
+    def pack_visible(self, visible, cls_tokens):
+        """Pack the visible tokens (in the order of `batch_index` / `ids_keep`) and the cls tokens (N, D)."""
+        packed = visible.new_empty(self.total_length, visible.size(-1))
+        packed[self.cls_pos] = cls_tokens.to(visible.dtype)
+        packed[self.token_pos] = visible
+        return packed
+
+    def unpack(self, packed, fill):
+        """The cls tokens (N, D) and the full grid (N, L, D) of a packed sequence, `fill` (D,) at masked patches."""
+        x = fill.to(packed.dtype).expand(self.batch_size, self.num_patches, -1).clone()
+        x[self.batch_index, self.ids_keep] = packed[self.token_pos]
+        return packed[self.cls_pos], x
+
+    def mask(self, device):
+        """The binary mask (N, L): 0 is keep, 1 is remove."""
+        mask = torch.ones(self.batch_size, self.num_patches, device=device)
+        mask[self.batch_index, self.ids_keep] = 0
+        return mask
+
+
+def _qkv(attn, x):
+    if getattr(attn, "q_bias", None) is not None:
+        # `models_mae.AttentionNoKBias`: no bias on the keys
+        bias = torch.cat((attn.q_bias, torch.zeros_like(attn.v_bias, requires_grad=False), attn.v_bias))
+        return torch.nn.functional.linear(x, attn.qkv.weight, bias)
+    return attn.qkv(x)
+
+
+def packed_attention(attn, x, packed):
+    """
+    The self-attention `attn` (a timm `Attention`) within each sample of a
+    packed sequence x (T, C) of the `PackedBatch` `packed`: q, k and v are
+    scattered into the padded layout (N, H, max_length, C/H) and attend in one
+    batched call, with the padded keys masked out.
+    """
+    T, C = x.shape
+    N, L, H = packed.batch_size, packed.max_length, attn.num_heads
+    qkv = x.new_zeros(N * L, 3 * C).index_copy(0, packed.padded_pos, _qkv(attn, x))
+    q, k, v = qkv.reshape(N, L, 3, H, C // H).permute(2, 0, 3, 1, 4)  # (N, H, L, C/H) each
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        assert attn.scale == (C // H) ** -0.5, "the packed attention uses the default scale"
+        x = torch.nn.functional.scaled_dot_product_attention(
+            q, k, v, attn_mask=packed.attn_mask, dropout_p=attn.attn_drop.p if attn.training else 0.)
+    else:
+        a = ((q @ k.transpose(-2, -1)) * attn.scale).masked_fill(~packed.attn_mask, float("-inf"))
+        x = attn.attn_drop(a.softmax(dim=-1)) @ v
+    x = x.transpose(1, 2).reshape(N * L, C)[packed.padded_pos]
+    return attn.proj_drop(attn.proj(x))
+
+
+def _packed_block_forward(blk, x, packed):
+    x = x + maybe_checkpoint(blk, "attn", lambda y: packed_attention(blk.attn, blk.norm1(y), packed), x)
+    x = x + blk.mlp(blk.norm2(x))
+    return x
+
+
+def packed_block_forward(blk, x, packed):
+    """A timm `Block` on a packed sequence x (T, C) (without drop path, which is per sample), with its activation checkpointing."""
+    return maybe_checkpoint(blk, "block", _packed_block_forward, blk, x, packed)
@@ -0,0 +1,217 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import math
+
+import torch
+from torch.utils.data import ConcatDataset, DistributedSampler
+
+
+class RepeatFactorDistributedSampler(DistributedSampler):
+    """
+    DistributedSampler over a `ConcatDataset` of several sources (or over a
+    single dataset), where each source is virtually repeated by a (possibly
+    fractional) repeat factor.
+
+    This replaces duplicating data folders on disk (e.g. the 5x duplicated COCO
+    train2017 + unlabeled2017 in `mae_pretrain_with_unlabeled_dup5`): with
+    integer repeat factors, each epoch visits every image of a source exactly
+    `repeat` times, just like a duplicated folder. With a fractional repeat
+    factor r, each epoch visits every image floor(r) times, plus a random
+    subset (re-drawn every epoch) for the remaining fraction.
+
+    The epoch length is fixed to sum(round(len(source) * repeat)) samples, and
+    the sharding across ranks, padding, `drop_last` and `set_epoch` follow
+    `DistributedSampler` (so the LR schedule is the same as for a duplicated
+    folder of the same size).
+
+    With repeated augmentation (K crops and masks per decoded image, see
+    `SampleVisiblePatchIndices`), the repeat factors are divided by K, so that
+    an epoch still has the same number of training samples.
+    """
+    def __init__(self, dataset, repeat_factors, num_replicas=None, rank=None,
+                 shuffle=True, seed=0, drop_last=False):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank,
+                         shuffle=shuffle, seed=seed, drop_last=drop_last)
+        sources = dataset.datasets if isinstance(dataset, ConcatDataset) else [dataset]
+        assert len(repeat_factors) == len(sources)
+        assert all(r >= 0 for r in repeat_factors)
+        self.source_sizes = [len(d) for d in sources]
+        assert all(n > 0 for n in self.source_sizes), \
+            "empty data source(s): {}".format([i for i, n in enumerate(self.source_sizes) if n == 0])
+        self.repeat_factors = repeat_factors
+        self.epoch_size = sum(
+            int(round(n * r)) for n, r in zip(self.source_sizes, self.repeat_factors)
+        )
+
+        # same as in `DistributedSampler`, but based on the virtual epoch size
+        if self.drop_last and self.epoch_size % self.num_replicas != 0:
+            self.num_samples = math.ceil((self.epoch_size - self.num_replicas) / self.num_replicas)
+        else:
+            self.num_samples = math.ceil(self.epoch_size / self.num_replicas)
+        self.total_size = self.num_samples * self.num_replicas
+
+    def _epoch_indices(self, g):
+        indices = []
+        offset = 0
+        for n, r in zip(self.source_sizes, self.repeat_factors):
+            num_full_repeats, num_rest = divmod(int(round(n * r)), n)
+            indices.append(torch.arange(offset, offset + n).repeat(num_full_repeats))
+            if num_rest > 0:
+                indices.append(offset + torch.randperm(n, generator=g)[:num_rest])
+            offset += n
+        return torch.cat(indices)
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = self._epoch_indices(g)
+        if self.shuffle:
+            indices = indices[torch.randperm(len(indices), generator=g)]
+        indices = indices.tolist()
+
+        if not self.drop_last:
+            # add extra samples to make it evenly divisible
+            padding_size = self.total_size - len(indices)
+            if padding_size <= len(indices):
+                indices += indices[:padding_size]
+            else:
+                indices += (indices * math.ceil(padding_size / len(indices)))[:padding_size]
+        else:
+            # remove tail of data to make it evenly divisible.
+            indices = indices[:self.total_size]
+        assert len(indices) == self.total_size
+
+        # subsample
+        indices = indices[self.rank:self.total_size:self.num_replicas]
+        assert len(indices) == self.num_samples
+
+        return iter(indices)
+
+    def __repr__(self):
+        sources = ", ".join(
+            "{} x {:g}".format(n, r) for n, r in zip(self.source_sizes, self.repeat_factors)
+        )
+        return "{}(sources=[{}], epoch_size={}, num_replicas={}, rank={})".format(
+            self.__class__.__name__, sources, self.epoch_size, self.num_replicas, self.rank
+        )
+
+
+class NodeLocalDistributedSampler(RepeatFactorDistributedSampler):
+    """
+    DistributedSampler that gives each node a mostly stable subset of the data,
+    so that the page cache (or `--shm_store node_shard`) of a node keeps serving
+    the same files across epochs instead of re-reading the whole dataset over
+    the network every epoch.
+
+    Sample i (of each source, i.e. the index within its source) has the home
+    node i % num_nodes, the same split as `--shm_store node_shard`. In each
+    epoch, a random `exchange_fraction` of the samples (re-drawn every epoch,
+    with the same seed on all ranks) is pooled and dealt to random nodes
+    instead, and so is the surplus of a node above its even share of the
+    epoch. Each node then shuffles its samples and splits them across its
+    `ranks_per_node` ranks (ranks are numbered node by node).
+
+    Coverage: each epoch is still a partition of the (virtual) epoch indices
+    across the nodes, so like `DistributedSampler`, every sample is visited
+    exactly once per epoch (`repeat_factors` times with repeat factors),
+    except that each node pads its share with fewer than `ranks_per_node`
+    duplicated samples to an equal length per rank (or drops fewer than
+    `ranks_per_node` samples with `drop_last=True`). With
+    `exchange_fraction=0`, a node only reads its home samples; with 1, the
+    samples are spread across the nodes at random in each epoch.
+    """
+    def __init__(self, dataset, repeat_factors=None, num_replicas=None, rank=None, ranks_per_node=1,
+                 exchange_fraction=0.1, shuffle=True, seed=0, drop_last=False):
+        if repeat_factors is None:
+            repeat_factors = [1.] * (len(dataset.datasets) if isinstance(dataset, ConcatDataset) else 1)
+        super().__init__(dataset, repeat_factors, num_replicas=num_replicas, rank=rank,
+                         shuffle=shuffle, seed=seed, drop_last=drop_last)
+        assert self.num_replicas % ranks_per_node == 0, "ranks must be evenly split across nodes"
+        assert 0. <= exchange_fraction <= 1.
+        self.ranks_per_node = ranks_per_node
+        self.num_nodes = self.num_replicas // ranks_per_node
+        self.node_rank = self.rank // ranks_per_node
+        self.local_rank = self.rank % ranks_per_node
+        self.exchange_fraction = exchange_fraction
+        self.source_starts = torch.tensor([0] + self.source_sizes).cumsum(0)[:-1]
+
+    def _node_indices(self, g):
+        indices = self._epoch_indices(g)
+        indices = indices[torch.randperm(len(indices), generator=g)]
+        # home node of each sample, from its index within its source
+        source = torch.bucketize(indices, self.source_starts, right=True) - 1
+        home = (indices - self.source_starts[source]) % self.num_nodes
+        exchanged = torch.rand(len(indices), generator=g) < self.exchange_fraction
+
+        # keep up to an even share of the home samples on each node, and deal the rest at random
+        num_nodes = self.num_nodes
+        shares = [len(indices) // num_nodes + (1 if n < len(indices) % num_nodes else 0) for n in range(num_nodes)]
+        kept, pool = [], [indices[exchanged]]
+        for n in range(num_nodes):
+            node_samples = indices[(home == n) & ~exchanged]
+            kept.append(node_samples[:shares[n]])
+            pool.append(node_samples[shares[n]:])
+        pool = torch.cat(pool)
+        pool = pool[torch.randperm(len(pool), generator=g)]
+        n = self.node_rank
+        start = sum(shares[m] - len(kept[m]) for m in range(n))
+        node_indices = torch.cat([kept[n], pool[start:start + shares[n] - len(kept[n])]])
+        if self.shuffle:
+            node_indices = node_indices[torch.randperm(len(node_indices), generator=g)]
+        return node_indices
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        indices = self._node_indices(g).tolist()
+
+        # pad (or truncate) the share of this node to the same length for all its ranks
+        node_size = self.num_samples * self.ranks_per_node
+        if len(indices) < node_size:
+            indices += (indices * math.ceil(node_size / len(indices)))[:node_size - len(indices)]
+        indices = indices[:node_size]
+
+        # subsample
+        indices = indices[self.local_rank:node_size:self.ranks_per_node]
+        assert len(indices) == self.num_samples
+
+        return iter(indices)
+
+    def __repr__(self):
+        return "{}(epoch_size={}, num_nodes={}, ranks_per_node={}, exchange_fraction={}, rank={})".format(
+            self.__class__.__name__, self.epoch_size, self.num_nodes, self.ranks_per_node,
+            self.exchange_fraction, self.rank
+        )
+
+
+def parse_data_sources(data_sources):
+    """Parse `--data_sources` entries of the form "path" or "path:repeat"."""
+    paths, repeat_factors = [], []
+    for source in data_sources:
+        path, sep, repeat = source.rpartition(":")
+        try:
+            repeat = float(repeat) if sep else 1.
+        except ValueError:
+            path, repeat = source, 1.
+        paths.append(path if sep else source)
+        repeat_factors.append(repeat)
+    return paths, repeat_factors
+
+
+def repeat_factors_from_mixing_weights(mixing_weights, source_sizes, samples_per_epoch=-1):
+    """
+    Derive per-source repeat factors so that source i makes up a fraction
+    w_i / sum(w) of an epoch of `samples_per_epoch` samples (by default the
+    total size of all sources).
+    """
+    assert len(mixing_weights) == len(source_sizes), "need one mixing weight per data source"
+    assert all(n > 0 for n in source_sizes), \
+        "empty data source(s): {}".format([i for i, n in enumerate(source_sizes) if n == 0])
+    if samples_per_epoch <= 0:
+        samples_per_epoch = sum(source_sizes)
+    total_weight = sum(mixing_weights)
+    return [w / total_weight * samples_per_epoch / n for w, n in zip(mixing_weights, source_sizes)]
@@ -0,0 +1,148 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import atexit
+import hashlib
+import os
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import torch
+
+import util.misc as misc
+
+
+SHM_DIR = "/dev/shm"
+
+# max number of DataLoader workers per rank tracked by the hit/miss counters
+MAX_COUNTER_SLOTS = 128
+
+
+def shm_key(*parts):
+    """
+    A key of the shared-memory files of a job, from `parts` and the job id, so
+    that several jobs on the same host (e.g. a sweep on one node) never share
+    (and rebuild or delete) each other's files.
+    """
+    return hashlib.sha1(":".join(str(p) for p in parts + (misc.get_job_id(),)).encode("utf-8")).hexdigest()[:16]
+
+
+class WorkerCounters:
+    """
+    Per-worker counters in shared memory, so that the counts of DataLoader
+    workers (including persistent ones) are visible from the main process.
+    Each worker only writes its own row, so no locking is needed.
+    """
+    def __init__(self, names):
+        self.names = list(names)
+        self.counts = torch.zeros(MAX_COUNTER_SLOTS, len(self.names), dtype=torch.float64).share_memory_()
+
+    def add(self, name, value=1):
+        worker_info = torch.utils.data.get_worker_info()
+        slot = 0 if worker_info is None else (worker_info.id + 1) % MAX_COUNTER_SLOTS
+        self.counts[slot, self.names.index(name)] += value
+
+    def totals(self):
+        return dict(zip(self.names, self.counts.sum(dim=0).tolist()))
+
+
+class SharedBytesStore:
+    """
+    A node-wide store of the encoded bytes (e.g. JPEG files) of a dataset in
+    shared memory (`/dev/shm`).
+
+    One process per node (local rank 0) reads the files once and writes their
+    bytes into one shared-memory file, and all ranks and DataLoader workers on
+    the node memory-map it, so that reading a sample makes no file system calls.
+    With `node_shard=True`, each node only loads the samples i with
+    i % num_nodes == node_rank; the other samples are read from the file system
+    (counted as misses).
+    """
+    def __init__(self, path_fn, num_samples, name, node_shard=False, num_threads=16):
+        self.num_samples = num_samples
+        num_nodes, node_rank = misc.get_num_nodes(), misc.get_node_rank()
+        if node_shard and num_nodes > 1:
+            indices = np.arange(node_rank, self.num_samples, num_nodes)
+            name = "{}_node{}of{}".format(name, node_rank, num_nodes)
+        else:
+            indices = np.arange(self.num_samples)
+        key = shm_key(name, self.num_samples)
+        self.data_path = os.path.join(SHM_DIR, "mae_bytes_{}.bin".format(key))
+        self.index_path = os.path.join(SHM_DIR, "mae_bytes_{}.index.npy".format(key))
+
+        if misc.get_local_rank() == 0:
+            start_time = time.time()
+            self._build(path_fn, indices, num_threads)
+            print("loaded {} files ({:.2f} GB) into {} in {:.0f} s".format(
+                len(indices), os.path.getsize(self.data_path) / 1024 ** 3, self.data_path,
+                time.time() - start_time))
+            self._owner_pid = os.getpid()
+            atexit.register(self._cleanup)
+        misc.barrier("shm_store")
+        # the index file is renamed into place last, so it marks a complete store
+        while not os.path.exists(self.index_path):
+            time.sleep(1)
+
+        # (start, end) offsets of each sample in the data file, or (0, 0) if it's not stored
+        self.offsets = np.load(self.index_path)
+        self.nbytes = os.path.getsize(self.data_path)
+        self.counters = WorkerCounters(["hits", "misses"])
+        self._data = None
+
+    def _build(self, path_fn, indices, num_threads):
+        def read(i):
+            with open(path_fn(i), "rb") as f:
+                return f.read()
+
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)  # e.g. left over by a crashed run
+        offsets = np.zeros((self.num_samples, 2), dtype=np.int64)
+        pos = 0
+        tmp_data_path = "{}.tmp.{}".format(self.data_path, os.getpid())
+        with open(tmp_data_path, "wb") as f, ThreadPool(num_threads) as pool:
+            for i, data in zip(indices, pool.imap(read, indices, chunksize=64)):
+                f.write(data)
+                offsets[i] = (pos, pos + len(data))
+                pos += len(data)
+        os.replace(tmp_data_path, self.data_path)
+        tmp_index_path = "{}.tmp.{}.npy".format(self.index_path, os.getpid())
+        np.save(tmp_index_path, offsets)
+        os.replace(tmp_index_path, self.index_path)
+
+    def _cleanup(self):
+        if os.getpid() != self._owner_pid:
+            return
+        for path in (self.data_path, self.index_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __getstate__(self):
+        # don't pickle the memory map (e.g. when DataLoader workers are spawned)
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def get(self, index):
+        """Return the bytes of sample `index`, or None if it's not in the store."""
+        start, end = self.offsets[index]
+        if end == 0:
+            self.counters.add("misses")
+            return None
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+        self.counters.add("hits")
+        return self._data[start:end].tobytes()
+
+    def stats(self):
+        counts = self.counters.totals()
+        total = max(1., counts["hits"] + counts["misses"])
+        return {
+            "shm_store_gb": self.nbytes / 1024 ** 3,
+            "shm_store_hits": counts["hits"],
+            "shm_store_misses": counts["misses"],
+            "shm_store_hit_rate": counts["hits"] / total,
+        }
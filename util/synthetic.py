@@ -0,0 +1,84 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Synthetic data (--synthetic_data): in-memory random images that are already
+# in the model input format, to measure the training throughput without any
+# file reading, decoding or augmentation (i.e. whether a run is input-bound).
+
+import torch
+
+# random images shared by all samples (sample i uses image i % NUM_SYNTHETIC_IMAGES)
+NUM_SYNTHETIC_IMAGES = 16
+
+# the number of synthetic validation samples when --synthetic_num_samples is given
+NUM_SYNTHETIC_VAL_SAMPLES = 50000
+
+
+class SyntheticImageDataset(torch.utils.data.Dataset):
+    """
+    A dataset of `num_samples` random (3, input_size, input_size) images, as
+    normalized float32 (like `ToTensor()` + `Normalize()`) or as uint8 (like
+    `PILToTensor()`, with `uint8=True`), and labels `index % num_classes`.
+
+    The images are generated once (from uniform random pixels) and shared by all
+    samples; `transform` (e.g. the mask sampling of `SampleVisiblePatchIndices`)
+    is applied to the image tensor of each sample.
+    """
+    def __init__(self, num_samples, input_size, num_classes=1000, transform=None, uint8=False,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), seed=0):
+        self.num_samples = num_samples
+        self.input_size = input_size
+        self.num_classes = num_classes
+        self.transform = transform
+        self.uint8 = uint8
+        generator = torch.Generator().manual_seed(seed)
+        images = torch.randint(
+            0, 256, (NUM_SYNTHETIC_IMAGES, 3, input_size, input_size), dtype=torch.uint8, generator=generator
+        )
+        if not uint8:
+            mean = torch.tensor(mean).view(1, 3, 1, 1)
+            std = torch.tensor(std).view(1, 3, 1, 1)
+            images = images.float().div(255).sub_(mean).div_(std)
+        self.images = images
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        img = self.images[index % NUM_SYNTHETIC_IMAGES]
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, index % self.num_classes
+
+    def __repr__(self):
+        lines = [
+            "Dataset " + self.__class__.__name__,
+            "    Number of datapoints: {}".format(len(self)),
+            "    Image: 3x{0}x{0} {1}".format(self.input_size, "uint8" if self.uint8 else "float32 (normalized)"),
+        ]
+        if self.transform is not None:
+            lines.append("Transform: " + repr(self.transform).replace("\n", "\n           "))
+        return "\n".join(lines)
+
+
+def num_source_samples(dataset):
+    """The number of samples of each source of a dataset (or of a ConcatDataset), over all ranks."""
+    datasets_ = dataset.datasets if isinstance(dataset, torch.utils.data.ConcatDataset) else [dataset]
+    # a streaming `TarShardDataset` has a per-rank length
+    return [getattr(d, "total_samples", len(d)) for d in datasets_]
+
+
+def synthetic_like(dataset, input_size, **kwargs):
+    """
+    A synthetic dataset with as many samples as `dataset` (and a ConcatDataset
+    with the same source sizes for a ConcatDataset), so that the sampler, the
+    epoch length and the LR schedule are the same as with the real data.
+    """
+    sizes = num_source_samples(dataset)
+    datasets_ = [SyntheticImageDataset(n, input_size, seed=i, **kwargs) for i, n in enumerate(sizes)]
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        return torch.utils.data.ConcatDataset(datasets_)
+    return datasets_[0]
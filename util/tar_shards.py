@@ -0,0 +1,201 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Sequential tar shards: the encoded images are packed into large tar files
+# (`<key>.jpg` + `<key>.cls` members, written by `TarShardWriter`) that are
+# streamed sequentially during training instead of random small-file reads.
+
+import io
+import json
+import math
+import os
+import random
+import tarfile
+
+import torch
+from PIL import Image
+
+
+TAR_SHARDS_VERSION = 1
+INDEX_FILE = "index.json"
+SHARD_FILE = "shard-{:06d}.tar"
+
+
+class TarShardWriter:
+    """Pack (encoded image bytes, label) samples into tar shards of `samples_per_shard` samples."""
+    def __init__(self, output_dir, samples_per_shard=10000, classes=()):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.samples_per_shard = samples_per_shard
+        self.classes = list(classes)
+        self.shards = []
+        self.tar = None
+        self.num_samples = 0
+
+    def _next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        name = SHARD_FILE.format(len(self.shards))
+        self.tar = tarfile.open(os.path.join(self.output_dir, name), "w")
+        self.shards.append({"name": name, "num_samples": 0})
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def write(self, image_bytes, label, ext="jpg"):
+        if self.tar is None or self.shards[-1]["num_samples"] >= self.samples_per_shard:
+            self._next_shard()
+        key = "{:09d}".format(self.num_samples)
+        self._add_member(f"{key}.{ext}", image_bytes)
+        self._add_member(f"{key}.cls", str(label).encode("utf-8"))
+        self.shards[-1]["num_samples"] += 1
+        self.num_samples += 1
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+        index = {
+            "version": TAR_SHARDS_VERSION,
+            "num_samples": self.num_samples,
+            "classes": self.classes,
+            "shards": self.shards,
+        }
+        with open(os.path.join(self.output_dir, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=1)
+
+
+def iterate_tar_samples(path):
+    """Read the (image bytes, label) samples of a tar shard sequentially."""
+    key, image_bytes, label = None, None, None
+    with tarfile.open(path, mode="r|") as tar:  # streaming mode, no seeking
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, ext = os.path.splitext(member.name)
+            if member_key != key:
+                if image_bytes is not None:
+                    yield image_bytes, label
+                key, image_bytes, label = member_key, None, 0
+            data = tar.extractfile(member).read()
+            if ext == ".cls":
+                label = int(data.decode("utf-8"))
+            else:
+                image_bytes = data
+    if image_bytes is not None:
+        yield image_bytes, label
+
+
+class TarShardDataset(torch.utils.data.IterableDataset):
+    """
+    Stream the samples of tar shards sequentially, with a shuffle buffer.
+
+    In each epoch, the shards are shuffled (with the same seed on all ranks) and
+    split across all (rank, DataLoader worker) streams; if there are fewer shards
+    than streams, every stream reads all shards and keeps every n-th sample.
+    Each stream yields exactly its share of `len(self)` samples per epoch (cycling
+    over its shards if needed, like the padding in `DistributedSampler`), in
+    whole batches of `batch_size`, so that `len(data_loader)` is exact and the
+    LR schedule matches a map-style dataset of the same size.
+
+    `set_epoch` writes to a shared-memory tensor, so that it also reaches
+    persistent DataLoader workers.
+    """
+    def __init__(self, root, transform=None, batch_size=1, shuffle_buffer=1000,
+                 num_replicas=1, rank=0, seed=0):
+        assert shuffle_buffer >= 1
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            index = json.load(f)
+        assert index["version"] == TAR_SHARDS_VERSION, \
+            f"unsupported tar shard version {index['version']} in {root}"
+        self.shards = [os.path.join(root, s["name"]) for s in index["shards"]]
+        self.total_samples = index["num_samples"]
+        assert self.total_samples > 0, f"no samples in the tar shards of {root}"
+        self.classes = index["classes"]
+        self.transform = transform
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        # like `DistributedSampler` (without drop_last) and a DataLoader with drop_last=True
+        self.num_batches = math.ceil(self.total_samples / num_replicas) // batch_size
+        self._epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+
+    def set_epoch(self, epoch):
+        self._epoch[0] = epoch
+
+    def __len__(self):
+        return self.num_batches * self.batch_size
+
+    def _stream_samples(self, shards, sample_offset, sample_stride, rng):
+        # cycle over the shards of this stream, keeping every `sample_stride`-th sample
+        while True:
+            rng.shuffle(shards)
+            i = 0
+            for shard in shards:
+                for sample in iterate_tar_samples(shard):
+                    if i % sample_stride == sample_offset:
+                        yield sample
+                    i += 1
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = worker_info.num_workers if worker_info is not None else 1
+        worker_id = worker_info.id if worker_info is not None else 0
+        num_streams = self.num_replicas * num_workers
+        stream_id = self.rank * num_workers + worker_id
+        epoch = int(self._epoch[0])
+
+        # split the batches of this rank across its workers
+        num_samples = (self.num_batches // num_workers
+                       + (1 if worker_id < self.num_batches % num_workers else 0)) * self.batch_size
+        if num_samples == 0:
+            return
+
+        shards = list(self.shards)
+        random.Random(self.seed + epoch).shuffle(shards)
+        if len(shards) >= num_streams:
+            shards, sample_offset, sample_stride = shards[stream_id::num_streams], 0, 1
+        else:
+            # with fewer samples than streams, the last streams repeat the samples of the first ones
+            # (like the padding of `DistributedSampler`), instead of never finding a sample of their own
+            sample_stride = min(num_streams, self.total_samples)
+            sample_offset = stream_id % sample_stride
+        rng = random.Random((self.seed + epoch) * num_streams + stream_id)
+        samples = self._stream_samples(shards, sample_offset, sample_stride, rng)
+
+        buffer = []
+        for _ in range(num_samples):
+            # fill the buffer, then yield a random sample from it and refill its slot
+            while len(buffer) < self.shuffle_buffer:
+                buffer.append(next(samples))
+            idx = rng.randrange(len(buffer))
+            image_bytes, label = buffer[idx]
+            buffer[idx] = buffer[-1]
+            buffer.pop()
+            yield self._decode(image_bytes), label
+
+    def _decode(self, image_bytes):
+        img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        if self.transform is not None:
+            img = self.transform(img)
+        return img
+
+    def __repr__(self):
+        lines = [
+            "Dataset " + self.__class__.__name__,
+            "    Number of datapoints: {} (per rank: {})".format(self.total_samples, len(self)),
+            "    Root location: {}".format(self.root),
+            "    Number of shards: {}".format(len(self.shards)),
+            "    Shuffle buffer: {}".format(self.shuffle_buffer),
+        ]
+        if self.transform is not None:
+            lines.append("    StandardTransform")
+            lines.append("Transform: " + repr(self.transform).replace("\n", "\n           "))
+        return "\n".join(lines)
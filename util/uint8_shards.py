@@ -0,0 +1,139 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Pre-decoded image shards: each image is decoded once (with its short side
+# capped) and stored as raw HWC uint8 RGB pixels in large shard files, with an
+# offset table in `index.npz`. Training then memory-maps the shards and crops
+# from them directly, without any JPEG decoding.
+
+import json
+import os
+
+import numpy as np
+import torch
+
+
+UINT8_SHARDS_VERSION = 1
+INDEX_FILE = "index.npz"
+SHARD_FILE = "shard-{:05d}.u8"
+
+
+class Uint8ShardWriter:
+    """Append decoded HWC uint8 images to shards of at most `shard_size` bytes."""
+    def __init__(self, output_dir, shard_size=4 * 1024 ** 3, classes=()):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.classes = list(classes)
+        self.shard_ids, self.offsets, self.heights, self.widths, self.labels = [], [], [], [], []
+        self.shard_id = -1
+        self.shard_file = None
+        self.shard_pos = 0
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_id += 1
+        self.shard_file = open(os.path.join(self.output_dir, SHARD_FILE.format(self.shard_id)), "wb")
+        self.shard_pos = 0
+
+    def write(self, arr, label):
+        assert arr.dtype == np.uint8 and arr.ndim == 3 and arr.shape[2] == 3
+        if self.shard_file is None or (self.shard_pos > 0 and self.shard_pos + arr.nbytes > self.shard_size):
+            self._next_shard()
+        self.shard_file.write(np.ascontiguousarray(arr).tobytes())
+        self.shard_ids.append(self.shard_id)
+        self.offsets.append(self.shard_pos)
+        self.heights.append(arr.shape[0])
+        self.widths.append(arr.shape[1])
+        self.labels.append(label)
+        self.shard_pos += arr.nbytes
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        meta = {"version": UINT8_SHARDS_VERSION, "classes": self.classes, "num_shards": self.shard_id + 1}
+        with open(os.path.join(self.output_dir, INDEX_FILE), "wb") as f:
+            np.savez(
+                f,
+                meta=np.array(json.dumps(meta)),
+                shard_ids=np.array(self.shard_ids, dtype=np.int32),
+                offsets=np.array(self.offsets, dtype=np.int64),
+                heights=np.array(self.heights, dtype=np.int32),
+                widths=np.array(self.widths, dtype=np.int32),
+                labels=np.array(self.labels, dtype=np.int32),
+            )
+
+
+class Uint8ShardDataset(torch.utils.data.Dataset):
+    """
+    A dataset of pre-decoded images written by `Uint8ShardWriter`.
+
+    Each sample is a zero-copy (H, W, 3) uint8 view into a memory-mapped shard,
+    so the transform should start with `util.crop.ArrayRandomResizedCrop`.
+    The shards are memory-mapped lazily in each process (i.e. in each DataLoader
+    worker) and share the page cache across all workers and ranks on a node.
+    """
+    def __init__(self, root, transform=None, target_transform=None):
+        self.root = root
+        with np.load(os.path.join(root, INDEX_FILE), allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            assert meta["version"] == UINT8_SHARDS_VERSION, \
+                f"unsupported uint8 shard version {meta['version']} in {root}"
+            self.shard_ids = data["shard_ids"]
+            self.offsets = data["offsets"]
+            self.heights = data["heights"]
+            self.widths = data["widths"]
+            self.labels = data["labels"]
+        self.classes = meta["classes"]
+        self.num_shards = meta["num_shards"]
+        self.transform = transform
+        self.target_transform = target_transform
+        self._shards = None
+
+    def _get_shard(self, shard_id):
+        if self._shards is None:
+            self._shards = [None] * self.num_shards
+        if self._shards[shard_id] is None:
+            path = os.path.join(self.root, SHARD_FILE.format(shard_id))
+            self._shards[shard_id] = np.memmap(path, dtype=np.uint8, mode="r")
+        return self._shards[shard_id]
+
+    def __getstate__(self):
+        # don't pickle the memory maps (e.g. when DataLoader workers are spawned)
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_array(self, index):
+        h, w = int(self.heights[index]), int(self.widths[index])
+        start = int(self.offsets[index])
+        shard = self._get_shard(int(self.shard_ids[index]))
+        return shard[start:start + h * w * 3].reshape(h, w, 3)
+
+    def __getitem__(self, index):
+        sample = self.get_array(index)
+        target = int(self.labels[index])
+        if self.transform is not None:
+            sample = self.transform(sample)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+        return sample, target
+
+    def __repr__(self):
+        lines = [
+            "Dataset " + self.__class__.__name__,
+            "    Number of datapoints: {}".format(len(self)),
+            "    Root location: {}".format(self.root),
+            "    Number of shards: {}".format(self.num_shards),
+        ]
+        if self.transform is not None:
+            lines.append("    StandardTransform")
+            lines.append("Transform: " + repr(self.transform).replace("\n", "\n           "))
+        return "\n".join(lines)